@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+
+from app.core.llm_routing import resumen_metricas
+from app.agent.cache import cache_respuestas
+from app.profiling.routes import verificar_admin
+
+router = APIRouter()
+
+
+# ===== Reglas activas y métricas por ruta de la política de LLM =====
+@router.get("/llm-routing", dependencies=[Depends(verificar_admin)])
+async def get_llm_routing():
+    return {
+        **resumen_metricas(),
+        "cache_respuestas": cache_respuestas.estadisticas(),
+    }
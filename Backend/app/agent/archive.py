@@ -0,0 +1,220 @@
+"""
+Retención por niveles del historial de chat.
+
+Los mensajes más antiguos que CHAT_ARCHIVE_AFTER_DAYS salen del documento
+caliente de chat_sessions y se guardan comprimidos (zlib, o zstd si está
+instalado el paquete `zstandard`) en chat_archive, en lotes de hasta
+CHAT_ARCHIVE_BATCH mensajes. En la sesión queda un resumen.
+
+Uso manual (desde Backend/):
+    python -m app.agent.archive
+"""
+import asyncio
+import os
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+import bson
+from bson import ObjectId, Binary
+
+from app.core.database import db, collection_chats, collection_chat_archive
+from app.core.utils import tokenizar
+from app.agent.controllers import SEQ_ACTUAL
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depende del entorno
+    zstandard = None
+
+ARCHIVAR_DESPUES_DIAS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+INTERVALO_HORAS = float(os.getenv("CHAT_ARCHIVE_INTERVAL_HOURS", "24"))  # 0 desactiva el job
+TAMANO_LOTE = int(os.getenv("CHAT_ARCHIVE_BATCH", "500"))
+CODEC = os.getenv("CHAT_ARCHIVE_CODEC", "zstd" if zstandard else "zlib")
+
+
+def comprimir(datos: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(datos)
+    return zlib.compress(datos, 9)
+
+
+def descomprimir(datos: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(datos)
+    return zlib.decompress(datos)
+
+
+def resumir(mensajes: List[Dict[str, Any]], resumen_anterior: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Resumen que queda en la sesión: conteo, rango de fechas y temas más
+    frecuentes en las preguntas archivadas
+    """
+    temas = Counter((resumen_anterior or {}).get("temas_conteo", {}))
+    for m in mensajes:
+        if m.get("role") == "user":
+            temas.update(p for p in tokenizar(m.get("content", "")) if len(p) > 3)
+
+    total = (resumen_anterior or {}).get("mensajes", 0) + len(mensajes)
+    desde = (resumen_anterior or {}).get("desde") or mensajes[0].get("timestamp")
+    hasta = mensajes[-1].get("timestamp")
+    principales = [t for t, _ in temas.most_common(5)]
+    return {
+        "mensajes": total,
+        "desde": desde,
+        "hasta": hasta,
+        "temas_conteo": dict(temas.most_common(50)),
+        "texto": f"{total} mensajes archivados"
+                 + (f" entre {desde:%Y-%m-%d} y {hasta:%Y-%m-%d}" if desde and hasta else "")
+                 + (f". Temas frecuentes: {', '.join(principales)}" if principales else ""),
+    }
+
+
+async def archivar_sesion(session: Dict[str, Any], limite: datetime) -> Dict[str, int]:
+    """
+    Mueve al archivo los mensajes de una sesión anteriores a `limite`
+    """
+    mensajes = session.get("messages", [])
+    viejos = []
+    for m in mensajes:
+        if not m.get("timestamp") or m["timestamp"] >= limite:
+            break
+        viejos.append(m)
+    if not viejos:
+        return {"mensajes": 0, "bytes_originales": 0, "bytes_comprimidos": 0}
+
+    bytes_originales = bytes_comprimidos = 0
+    for inicio in range(0, len(viejos), TAMANO_LOTE):
+        lote = viejos[inicio:inicio + TAMANO_LOTE]
+        original = bson.encode({"messages": lote})
+        comprimido = comprimir(original, CODEC)
+        bytes_originales += len(original)
+        bytes_comprimidos += len(comprimido)
+
+        # Upsert por (sesión, primer mensaje): repetir el job no duplica lotes
+        await collection_chat_archive.update_one(
+            {"session_id": session["_id"], "desde": lote[0]["timestamp"]},
+            {"$set": {
+                "professional_id": session["professional_id"],
+                "hasta": lote[-1]["timestamp"],
+                "cantidad": len(lote),
+                "codec": CODEC,
+                "datos": Binary(comprimido),
+                "bytes_originales": len(original),
+                "created_at": datetime.utcnow(),
+            }},
+            upsert=True,
+        )
+
+    # Quita los N primeros mensajes sin pisar los que lleguen mientras tanto;
+    # el filtro evita que dos workers archiven la misma sesión dos veces.
+    # seq se fija antes de recortar para que la secuencia no retroceda
+    n = len(viejos)
+    result = await collection_chats.update_one(
+        {"_id": session["_id"], "messages.0.timestamp": viejos[0]["timestamp"]},
+        [{"$set": {
+            "seq": SEQ_ACTUAL,
+            "archivados": {"$add": [{"$ifNull": ["$archivados", 0]}, n]},
+            "messages": {"$slice": ["$messages", n, {"$max": [{"$size": "$messages"}, 1]}]},
+            "resumen_archivo": resumir(viejos, session.get("resumen_archivo")),
+            # Cambia el cuerpo de la sesión: el ETag tiene que cambiar también
+            "updated_at": datetime.utcnow(),
+        }}],
+    )
+    if result.modified_count == 0:
+        return {"mensajes": 0, "bytes_originales": 0, "bytes_comprimidos": 0}
+
+    return {"mensajes": n, "bytes_originales": bytes_originales, "bytes_comprimidos": bytes_comprimidos}
+
+
+async def estadisticas_coleccion(nombre: str) -> Dict[str, Any]:
+    """
+    Tamaño de la colección y bytes que ocupa en la caché de WiredTiger
+    """
+    try:
+        stats = await db.command("collStats", nombre)
+    except Exception as e:
+        return {"error": str(e)}
+    return {
+        "documentos": stats.get("count", 0),
+        "tamano": stats.get("size", 0),
+        "tamano_medio_documento": stats.get("avgObjSize", 0),
+        "almacenamiento": stats.get("storageSize", 0),
+        "bytes_en_cache": stats.get("wiredTiger", {}).get("cache", {}).get("bytes currently in the cache"),
+    }
+
+
+async def compactar_historial(dias: int = ARCHIVAR_DESPUES_DIAS) -> Dict[str, Any]:
+    """
+    Archiva los mensajes viejos de todas las sesiones y devuelve un reporte
+    con el tamaño de la colección caliente antes y después
+    """
+    limite = datetime.utcnow() - timedelta(days=dias)
+    antes = await estadisticas_coleccion(collection_chats.name)
+
+    sesiones = mensajes = bytes_originales = bytes_comprimidos = 0
+    cursor = collection_chats.find(
+        {"messages.0.timestamp": {"$lt": limite}},
+        {"professional_id": 1, "messages": 1, "resumen_archivo": 1},
+    )
+    async for session in cursor:
+        resultado = await archivar_sesion(session, limite)
+        if resultado["mensajes"]:
+            sesiones += 1
+            mensajes += resultado["mensajes"]
+            bytes_originales += resultado["bytes_originales"]
+            bytes_comprimidos += resultado["bytes_comprimidos"]
+
+    despues = await estadisticas_coleccion(collection_chats.name)
+    return {
+        "fecha": datetime.utcnow(),
+        "limite": limite,
+        "codec": CODEC,
+        "sesiones_compactadas": sesiones,
+        "mensajes_archivados": mensajes,
+        "bytes_originales": bytes_originales,
+        "bytes_comprimidos": bytes_comprimidos,
+        "ratio_compresion": round(bytes_originales / bytes_comprimidos, 2) if bytes_comprimidos else None,
+        "coleccion_caliente_antes": antes,
+        "coleccion_caliente_despues": despues,
+    }
+
+
+async def job_compactacion():
+    """
+    Bucle de fondo que compacta el historial cada CHAT_ARCHIVE_INTERVAL_HOURS
+    """
+    while True:
+        try:
+            reporte = await compactar_historial()
+            print("Compactación del historial de chat:", reporte)
+        except Exception as e:
+            print("Error en la compactación del historial de chat:", e)
+        await asyncio.sleep(INTERVALO_HORAS * 3600)
+
+
+async def get_archived_messages(chat_session_id: str, professional_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Rehidrata los mensajes archivados de una sesión (del más antiguo al
+    más reciente). Con `limit` se devuelven solo los últimos lotes necesarios.
+    """
+    filtro = {"session_id": ObjectId(chat_session_id), "professional_id": ObjectId(professional_id)}
+    cursor = collection_chat_archive.find(filtro).sort("desde", -1)
+
+    lotes = []
+    cantidad = 0
+    async for lote in cursor:
+        lotes.append(lote)
+        cantidad += lote["cantidad"]
+        if limit and cantidad >= limit:
+            break
+
+    mensajes = []
+    for lote in reversed(lotes):
+        mensajes.extend(bson.decode(descomprimir(lote["datos"], lote["codec"]))["messages"])
+    return mensajes[-limit:] if limit else mensajes
+
+
+if __name__ == "__main__":
+    print(asyncio.run(compactar_historial()))
@@ -0,0 +1,203 @@
+import os
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.agent.retrieval import terminos, raiz, RUIDO
+from app.core.utils import tokenizar, STOPWORDS_ES
+
+CACHE_ENABLED = os.getenv("AGENT_CACHE_ENABLED", "true").lower() == "true"
+CACHE_THRESHOLD = float(os.getenv("AGENT_CACHE_THRESHOLD", "0.8"))
+CACHE_TTL_SECONDS = int(os.getenv("AGENT_CACHE_TTL_SECONDS", str(24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1000"))
+
+NUM_PERMUTACIONES = 64
+BANDAS = 16  # 16 bandas x 4 filas: candidatos a partir de ~0.5 de similitud
+FILAS = NUM_PERMUTACIONES // BANDAS
+PRIMO = (1 << 61) - 1
+# Coeficientes fijos para que las firmas sean reproducibles entre workers
+COEFICIENTES = [
+    ((i * 0x9E3779B97F4A7C15 + 1) % PRIMO, (i * 0xC2B2AE3D27D4EB4F + 7) % PRIMO)
+    for i in range(1, NUM_PERMUTACIONES + 1)
+]
+
+# Interrogativos: "¿cómo lavo…?" y "¿cuándo lavo…?" piden cosas distintas
+# ("por qué" se une en "porque" al normalizar)
+INTERROGATIVOS = {
+    "como", "cuando", "donde", "que", "cual", "cuales", "cuanto", "cuanta",
+    "cuantos", "cuantas", "quien", "quienes", "porque",
+}
+
+# Palabras que la normalización conserva aunque sean stopwords
+CONSERVAR = {"no"} | INTERROGATIVOS
+
+# Términos que cambian la respuesta aunque el resto de la pregunta sea igual
+# ("oleosidad alta" vs "oleosidad baja"): deben coincidir exactamente
+TERMINOS_CLAVE = set(terminos(
+    "plasticidad permeabilidad densidad porosidad oleosidad grosor textura "
+    "alta baja poca media mucha delgada gruesa ondulado rizado afro"
+)) | {raiz(p) for p in CONSERVAR}
+
+# Palabras que indican que la pregunta depende de mensajes anteriores
+REFERENCIAS = {
+    "eso", "esto", "esa", "ese", "esas", "esos", "anterior", "anteriormente",
+    "mismo", "misma", "tambien", "entonces", "dijiste", "mencionaste", "ultimo",
+}
+
+
+def normalizar_pregunta(pregunta: str) -> List[str]:
+    """
+    Minúsculas, sin tildes ni stopwords y con raíces (lavo/lavar → lav).
+    La negación y los interrogativos se conservan: "no se moja" y "se moja",
+    o "¿cómo…?" y "¿cuándo…?", son preguntas distintas.
+    """
+    palabras = tokenizar(pregunta, quitar_stopwords=False)
+    unidas = []
+    for p in palabras:
+        if p == "que" and unidas and unidas[-1] == "por":
+            unidas[-1] = "porque"
+        else:
+            unidas.append(p)
+    return [
+        raiz(p)
+        for p in unidas
+        if p in CONSERVAR or (p not in STOPWORDS_ES and p not in RUIDO)
+    ]
+
+
+def ngramas(palabras: List[str]) -> set:
+    return set(palabras) | {f"{a} {b}" for a, b in zip(palabras, palabras[1:])}
+
+
+def firma_minhash(shingles: set) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles] or [0]
+    return tuple(min((a * h + b) % PRIMO for h in hashes) for a, b in COEFICIENTES)
+
+
+def similitud(firma_a: Tuple[int, ...], firma_b: Tuple[int, ...]) -> float:
+    """
+    Estimación de Jaccard: fracción de posiciones iguales en las firmas
+    """
+    return sum(1 for x, y in zip(firma_a, firma_b) if x == y) / NUM_PERMUTACIONES
+
+
+@dataclass
+class EntradaCache:
+    pregunta: str
+    respuesta: str
+    firma: Tuple[int, ...]
+    claves: frozenset
+    creado: float
+
+
+class CacheRespuestas:
+    """
+    Caché semántica en memoria (por worker) de respuestas del agente.
+    Usa MinHash + LSH por bandas para encontrar preguntas parecidas sin
+    recorrer todas las entradas, con TTL y expulsión LRU por tamaño.
+    """
+
+    def __init__(self, umbral: float = CACHE_THRESHOLD, ttl: int = CACHE_TTL_SECONDS, max_entradas: int = CACHE_MAX_ENTRIES):
+        self.umbral = umbral
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.entradas: "OrderedDict[Tuple[int, ...], EntradaCache]" = OrderedDict()
+        self.bandas: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _claves_banda(self, firma: Tuple[int, ...]):
+        for i in range(BANDAS):
+            yield (i, firma[i * FILAS:(i + 1) * FILAS])
+
+    def _eliminar(self, firma: Tuple[int, ...]):
+        self.entradas.pop(firma, None)
+        for clave in self._claves_banda(firma):
+            grupo = self.bandas.get(clave)
+            if grupo is not None:
+                grupo.discard(firma)
+                if not grupo:
+                    del self.bandas[clave]
+
+    def buscar(self, pregunta: str) -> Optional[str]:
+        palabras = normalizar_pregunta(pregunta)
+        if not palabras:
+            return None
+        firma = firma_minhash(ngramas(palabras))
+        claves = frozenset(p for p in palabras if p in TERMINOS_CLAVE)
+        ahora = time.time()
+
+        candidatos = set()
+        for clave in self._claves_banda(firma):
+            candidatos |= self.bandas.get(clave, set())
+
+        mejor, mejor_similitud = None, 0.0
+        for candidato in candidatos:
+            entrada = self.entradas.get(candidato)
+            if entrada is None:
+                continue
+            if ahora - entrada.creado > self.ttl:
+                self._eliminar(candidato)
+                continue
+            if entrada.claves != claves:
+                continue
+            valor = similitud(firma, entrada.firma)
+            if valor >= self.umbral and valor > mejor_similitud:
+                mejor, mejor_similitud = entrada, valor
+
+        if mejor is None:
+            self.fallos += 1
+            return None
+
+        self.aciertos += 1
+        self.entradas.move_to_end(mejor.firma)
+        return mejor.respuesta
+
+    def guardar(self, pregunta: str, respuesta: str):
+        palabras = normalizar_pregunta(pregunta)
+        if not palabras:
+            return
+        firma = firma_minhash(ngramas(palabras))
+        self._eliminar(firma)
+
+        self.entradas[firma] = EntradaCache(
+            pregunta=pregunta,
+            respuesta=respuesta,
+            firma=firma,
+            claves=frozenset(p for p in palabras if p in TERMINOS_CLAVE),
+            creado=time.time(),
+        )
+        for clave in self._claves_banda(firma):
+            self.bandas.setdefault(clave, set()).add(firma)
+
+        while len(self.entradas) > self.max_entradas:
+            antigua = next(iter(self.entradas))
+            self._eliminar(antigua)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self.entradas),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+        }
+
+
+def es_independiente_del_historial(message: str, chat_history: Optional[List[Dict[str, Any]]] = None) -> bool:
+    """
+    Una pregunta es cacheable si es el primer turno, o si nombra algún
+    componente y no hace referencia a mensajes anteriores
+    """
+    if not chat_history:
+        return True
+    palabras = set(tokenizar(message, quitar_stopwords=False))
+    if palabras & REFERENCIAS:
+        return False
+    conservadas = {raiz(p) for p in CONSERVAR}
+    return any(p in TERMINOS_CLAVE and p not in conservadas for p in normalizar_pregunta(message))
+
+
+cache_respuestas = CacheRespuestas()
@@ -1,23 +1,31 @@
 import os
+import asyncio
+import weakref
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from app.agent.prompts.system_prompt import SYSTEM_PROMPT_SHORT
-from app.core.database import collection_chats
+from app.agent.retrieval import construir_prompt_sistema
+from app.agent.cache import cache_respuestas, es_independiente_del_historial, CACHE_ENABLED
+from app.core.database import collection_chats, collection_chat_archive
+from app.core.read_routing import coleccion_para
+from app.core.profiling import span
+from app.core.llm_routing import elegir, medir
 from app.agent.models import ChatSession, Message, PyObjectId
 from datetime import datetime
 from bson import ObjectId
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional
+from pymongo import ReturnDocument
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def chat_with_openai(message: str, chat_history: List[Dict[str, Any]] = None) -> str:
+def construir_mensajes(message: str, chat_history: List[Dict[str, Any]] = None) -> List[Dict[str, str]]:
     """
-    Envía un mensaje a OpenAI con historial de conversación
+    Arma los mensajes para OpenAI: prompt de sistema del turno, historial
+    y mensaje actual
     """
-    # Construir mensajes con historial
-    messages = [{"role": "system", "content": SYSTEM_PROMPT_SHORT}]
+    # Construir mensajes con historial (núcleo + secciones relevantes del conocimiento base)
+    messages = [{"role": "system", "content": construir_prompt_sistema(message, chat_history)}]
     
     # Agregar historial si existe
     if chat_history:
@@ -27,34 +35,125 @@ async def chat_with_openai(message: str, chat_history: List[Dict[str, Any]] = No
     
     # Agregar mensaje actual
     messages.append({"role": "user", "content": message})
+    return messages
 
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        max_tokens=512,
-        temperature=0.7,
-    )
-    return response.choices[0].message.content
 
-async def save_chat_message(chat_session_id: str, role: str, content: str):
+async def chat_with_openai(message: str, chat_history: List[Dict[str, Any]] = None) -> str:
     """
-    Guarda un mensaje en la sesión de chat
+    Envía un mensaje a OpenAI con historial de conversación.
+    Las preguntas que no dependen del historial se resuelven primero
+    contra la caché semántica de respuestas.
     """
-    message = {
-        "role": role, 
-        "content": content,
-        "timestamp": datetime.utcnow()
-    }
-    
-    await collection_chats.update_one(
-        {"_id": ObjectId(chat_session_id)},
-        {
-            "$push": {"messages": message},
-            "$set": {"updated_at": datetime.utcnow()}
-        }
+    usar_cache = CACHE_ENABLED and es_independiente_del_historial(message, chat_history)
+    if usar_cache:
+        respuesta_cacheada = cache_respuestas.buscar(message)
+        if respuesta_cacheada is not None:
+            return respuesta_cacheada
+
+    politica = elegir("agent.chat", message, historial=bool(chat_history))
+    with span("llm", "chat"), medir(politica) as medicion:
+        response = await client.chat.completions.create(
+            **politica.parametros(),
+            messages=construir_mensajes(message, chat_history),
+        )
+        medicion.usage = response.usage
+    respuesta = response.choices[0].message.content
+
+    # Solo se guardan respuestas sin historial: la caché es compartida entre
+    # profesionales y un turno posterior puede arrastrar datos de la conversación
+    if usar_cache and respuesta and not chat_history:
+        cache_respuestas.guardar(message, respuesta)
+
+    return respuesta
+
+
+async def chat_with_openai_stream(message: str, chat_history: List[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """
+    Igual que chat_with_openai pero entrega la respuesta por fragmentos a
+    medida que OpenAI los genera (un acierto de caché llega completo)
+    """
+    usar_cache = CACHE_ENABLED and es_independiente_del_historial(message, chat_history)
+    if usar_cache:
+        respuesta_cacheada = cache_respuestas.buscar(message)
+        if respuesta_cacheada is not None:
+            yield respuesta_cacheada
+            return
+
+    politica = elegir("agent.chat", message, historial=bool(chat_history))
+    partes = []
+    with medir(politica) as medicion:
+        # El span cubre solo la espera del primer byte; el resto del stream
+        # depende también de lo rápido que consuma el cliente
+        with span("llm", "chat_stream"):
+            stream = await client.chat.completions.create(
+                **politica.parametros(),
+                messages=construir_mensajes(message, chat_history),
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        async for chunk in stream:
+            if chunk.usage:
+                medicion.usage = chunk.usage  # llega en el último fragmento
+            fragmento = chunk.choices[0].delta.content if chunk.choices else None
+            if fragmento:
+                partes.append(fragmento)
+                yield fragmento
+
+    respuesta = "".join(partes)
+    if usar_cache and respuesta and not chat_history:
+        cache_respuestas.guardar(message, respuesta)
+
+# Último número de secuencia de la sesión (las sesiones anteriores a "seq"
+# continúan desde su cantidad de mensajes)
+SEQ_ACTUAL = {"$ifNull": ["$seq", {"$size": {"$ifNull": ["$messages", []]}}]}
+
+# Candados por sesión: serializan los turnos de una misma sesión en este
+# worker sin frenar las demás sesiones del profesional
+candados_sesion: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def candado_sesion(chat_session_id: str) -> asyncio.Lock:
+    candado = candados_sesion.get(chat_session_id)
+    if candado is None:
+        candado = asyncio.Lock()
+        candados_sesion[chat_session_id] = candado
+    return candado
+
+
+async def save_chat_message(chat_session_id: str, role: str, content: str, db_session=None, seq_esperado: Optional[int] = None) -> Optional[int]:
+    """
+    Guarda un mensaje en la sesión de chat y devuelve su número de
+    secuencia. El número se asigna y el mensaje se agrega en la misma
+    actualización, así el orden del arreglo siempre es el de seq. Con
+    `seq_esperado` solo se guarda si la sesión sigue en esa secuencia
+    (si otro cliente escribió antes devuelve None).
+    """
+    ahora = datetime.utcnow()
+    filtro = {"_id": ObjectId(chat_session_id)}
+    if seq_esperado is not None:
+        filtro["$expr"] = {"$eq": [SEQ_ACTUAL, seq_esperado]}
+
+    doc = await collection_chats.find_one_and_update(
+        filtro,
+        [
+            {"$set": {"seq": {"$add": [SEQ_ACTUAL, 1]}}},
+            {"$set": {
+                "messages": {"$concatArrays": [{"$ifNull": ["$messages", []]}, [{
+                    "role": {"$literal": role},
+                    "content": {"$literal": content},
+                    "timestamp": ahora,
+                    "seq": "$seq",
+                }]]},
+                "updated_at": ahora,
+            }},
+        ],
+        projection={"seq": 1},
+        return_document=ReturnDocument.AFTER,
+        session=db_session
     )
+    return doc["seq"] if doc else None
 
-async def create_chat_session(professional_id: str, title: str) -> str:
+async def create_chat_session(professional_id: str, title: str, db_session=None) -> str:
     """
     Crea una nueva sesión de chat
     """
@@ -62,56 +161,74 @@ async def create_chat_session(professional_id: str, title: str) -> str:
         "professional_id": ObjectId(professional_id),
         "title": title,
         "messages": [],
+        "seq": 0,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
-    result = await collection_chats.insert_one(chat_session)
+    result = await collection_chats.insert_one(chat_session, session=db_session)
     return str(result.inserted_id)
 
-async def get_chat_sessions(professional_id: str):
+async def get_chat_sessions(professional_id: str, db_session=None):
     """
-    Obtiene todas las sesiones de chat de un profesional
+    Obtiene todas las sesiones de chat de un profesional (sin traer los
+    mensajes: el conteo y el último se calculan en el servidor)
     """
-    cursor = collection_chats.find(
-        {"professional_id": ObjectId(professional_id)}
-    ).sort("updated_at", -1)
+    cursor = coleccion_para(collection_chats, "agent.session").aggregate([
+        {"$match": {"professional_id": ObjectId(professional_id)}},
+        {"$sort": {"updated_at": -1}},
+        {"$project": {
+            "title": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+            "last_message": {"$arrayElemAt": ["$messages.content", -1]},
+            "last_seq": SEQ_ACTUAL,
+        }},
+    ], session=db_session)
     
     sessions = []
     async for doc in cursor:
-        last_message = doc["messages"][-1]["content"] if doc["messages"] else None
         sessions.append({
             "id": str(doc["_id"]),
             "title": doc["title"],
-            "message_count": len(doc["messages"]),
+            "message_count": doc["message_count"],
             "created_at": doc["created_at"],
             "updated_at": doc["updated_at"],
-            "last_message": last_message
+            "last_message": doc.get("last_message"),
+            "last_seq": doc["last_seq"],
         })
     
     return sessions
 
-async def get_chat_session(chat_session_id: str, professional_id: str):
+async def get_chat_session(chat_session_id: str, professional_id: str, db_session=None):
     """
     Obtiene una sesión de chat específica con todos sus mensajes
     """
     session = await collection_chats.find_one({
         "_id": ObjectId(chat_session_id),
         "professional_id": ObjectId(professional_id)
-    })
+    }, session=db_session)
     
     if not session:
         return None
     
     return session
 
-async def delete_chat_session(chat_session_id: str, professional_id: str):
+async def delete_chat_session(chat_session_id: str, professional_id: str, db_session=None):
     """
     Elimina una sesión de chat
     """
     result = await collection_chats.delete_one({
         "_id": ObjectId(chat_session_id),
         "professional_id": ObjectId(professional_id)
-    })
+    }, session=db_session)
+
+    # Los mensajes archivados de la sesión se eliminan con ella
+    if result.deleted_count:
+        await collection_chat_archive.delete_many({
+            "session_id": ObjectId(chat_session_id),
+            "professional_id": ObjectId(professional_id)
+        }, session=db_session)
     
     return result.deleted_count > 0
\ No newline at end of file
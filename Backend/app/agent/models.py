@@ -42,7 +42,7 @@ class ChatSession(BaseModel):
     )
 
 class ChatSessionCreate(BaseModel):
-    title: str
+    title: str = "Nuevo chat"
 
 class ChatSessionResponse(BaseModel):
     id: str
@@ -50,4 +50,5 @@ class ChatSessionResponse(BaseModel):
     message_count: int
     created_at: datetime
     updated_at: datetime
-    last_message: Optional[str] = None
\ No newline at end of file
+    last_message: Optional[str] = None
+    last_seq: int = 0
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""
+Mide offline cuánto reduce el prompt de sistema la recuperación por secciones.
+
+Uso (desde Backend/):
+    python -m app.agent.prompt_report
+    python -m app.agent.prompt_report --preguntas preguntas.txt   # una por línea
+    python -m app.agent.prompt_report --live                      # compara latencia real con OpenAI
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.agent.prompts.system_prompt import SYSTEM_PROMPT_SHORT
+from app.agent.retrieval import construir_prompt_sistema
+from app.core.llm_routing import elegir, MODELO_BASE
+
+PREGUNTAS_EJEMPLO = [
+    "¿Cómo lavo cabello con oleosidad alta?",
+    "Mi clienta tiene textura afro y grosor grueso, ¿qué productos le recomiendo?",
+    "¿Qué hago si el cabello no se moja fácilmente?",
+    "¿Cada cuánto debe lavarse una persona con oleosidad baja?",
+    "Tengo mucho cabello, ¿cómo lo defino?",
+    "¿Qué es la plasticidad?",
+    "Cabello ondulado y delgado, ¿qué técnica de definición uso?",
+    "Hola, buenos días",
+]
+
+
+def contar_tokens(texto: str) -> int:
+    try:
+        import tiktoken
+        return len(tiktoken.encoding_for_model(MODELO_BASE).encode(texto))
+    except Exception:
+        # Aproximación estándar si tiktoken no está instalado
+        return len(texto) // 4
+
+
+async def latencia_openai(system_prompt: str, pregunta: str) -> float:
+    from app.agent.controllers import client
+    inicio = time.perf_counter()
+    # Misma política que usaría /agent/chat para esta pregunta en un primer turno
+    await client.chat.completions.create(
+        **elegir("agent.chat", pregunta, historial=False).parametros(),
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": pregunta},
+        ],
+    )
+    return time.perf_counter() - inicio
+
+
+async def main(preguntas: list[str], live: bool):
+    tokens_completo = contar_tokens(SYSTEM_PROMPT_SHORT)
+    reducciones, tiempos_recuperacion = [], []
+    latencias = {"completo": [], "recuperado": []}
+
+    print(f"Prompt completo: {tokens_completo} tokens\n")
+    for pregunta in preguntas:
+        inicio = time.perf_counter()
+        prompt = construir_prompt_sistema(pregunta)
+        tiempos_recuperacion.append((time.perf_counter() - inicio) * 1000)
+
+        tokens = contar_tokens(prompt)
+        reduccion = 1 - tokens / tokens_completo
+        reducciones.append(reduccion)
+        print(f"{tokens:5d} tokens ({reduccion:6.1%} menos)  {pregunta}")
+
+        if live:
+            latencias["completo"].append(await latencia_openai(SYSTEM_PROMPT_SHORT, pregunta))
+            latencias["recuperado"].append(await latencia_openai(prompt, pregunta))
+
+    print(f"\nReducción media de tokens de sistema: {statistics.mean(reducciones):.1%}")
+    print(f"Tiempo medio de recuperación: {statistics.mean(tiempos_recuperacion):.3f} ms")
+    if live:
+        for variante, valores in latencias.items():
+            print(f"Latencia OpenAI ({variante}): media {statistics.mean(valores):.2f} s, "
+                  f"mediana {statistics.median(valores):.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reporte de reducción del prompt del agente")
+    parser.add_argument("--preguntas", default=None, help="Archivo con una pregunta por línea")
+    parser.add_argument("--live", action="store_true", help="Medir también la latencia real con OpenAI")
+    args = parser.parse_args()
+
+    preguntas = PREGUNTAS_EJEMPLO
+    if args.preguntas:
+        with open(args.preguntas, encoding="utf-8") as f:
+            preguntas = [linea.strip() for linea in f if linea.strip()]
+
+    asyncio.run(main(preguntas, args.live))
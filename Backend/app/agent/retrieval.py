@@ -0,0 +1,188 @@
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+from app.agent.prompts.system_prompt import SYSTEM_PROMPT_SHORT
+from app.core.utils import tokenizar, slug
+
+# Cantidad de secciones del conocimiento base que se envían por turno
+TOP_K = int(os.getenv("AGENT_PROMPT_TOP_K", "3"))
+# Se descartan secciones con puntaje menor a esta fracción de la mejor
+PUNTAJE_RELATIVO_MIN = float(os.getenv("AGENT_PROMPT_MIN_SCORE", "0.35"))
+
+SUFIJOS = sorted(
+    ["aciones", "acion", "iciones", "icion", "mente", "idades", "idad", "ados", "adas",
+     "ado", "ada", "idos", "ido", "ar", "er", "ir", "os", "as", "es", "o", "a", "s"],
+    key=len,
+    reverse=True,
+)
+
+# Términos con los que los profesionales suelen preguntar por cada sección
+# y que no aparecen literalmente en el texto del prompt
+ALIAS_SECCIONES = {
+    "plasticidad": "forma formar rizo definir cepillo prelavado",
+    "permeabilidad": "moja mojar agua absorbe preshampoo",
+    "densidad": "cantidad volumen poco mucho secciones crema gel",
+    "oleosidad": "grasa graso engrasa cuero cabelludo lavar lavado shampoo frecuencia copoo co poo asa rutina",
+    "grosor": "hebra delgado grueso fino productos ligeros densos",
+    "textura_patron": "patron ondulado rizado afro scrunch praying hands rizo a rizo definicion",
+}
+
+
+def raiz(palabra: str) -> str:
+    """
+    Stemming mínimo para español: quita sufijos comunes (lavo/lavado/lavar → lav)
+    """
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            return palabra[: -len(sufijo)]
+    return palabra
+
+
+# Palabras del dominio que aparecen en casi todas las preguntas y secciones
+RUIDO = {"cabello", "pelo", "hago", "debo", "puedo", "hacer", "quiero", "usar"}
+# Saludos y momentos del día: "buenos días" no debe traer la sección de
+# oleosidad por "dia" (frecuencia de lavado)
+SALUDOS = {
+    "hola", "buen", "buenos", "buenas", "dia", "dias", "tarde", "tardes", "noche", "noches",
+    "saludos", "gracias", "oye",
+}
+
+
+def terminos(texto: str) -> List[str]:
+    return [raiz(p) for p in tokenizar(texto) if p not in RUIDO and p not in SALUDOS]
+
+
+@dataclass
+class Seccion:
+    clave: str
+    titulo: str
+    contenido: str
+    terminos: List[str] = field(default_factory=list)
+
+
+def dividir_prompt(prompt: str) -> tuple[str, List[Seccion]]:
+    """
+    Separa el prompt en el núcleo (rol, instrucciones y resumen de los 7
+    componentes) y las secciones de conocimiento recuperables
+    """
+    bloques: List[tuple[str, List[str]]] = [("", [])]
+    for linea in prompt.splitlines():
+        encabezado = re.match(r"^#{2,3} (.+)$", linea)
+        if encabezado:
+            bloques.append((encabezado.group(1).strip(), [linea]))
+        elif linea.strip() != "---":
+            bloques[-1][1].append(linea)
+
+    nucleo: List[str] = []
+    secciones: List[Seccion] = []
+    en_guia = False
+    for titulo, lineas in bloques:
+        texto = "\n".join(lineas).strip()
+        titulo_limpio = re.sub(r"[^\w\s/–-]", "", titulo).strip()
+        clave = slug(titulo_limpio)
+
+        # Rol, instrucciones, resumen de componentes y el ejemplo de respuesta
+        # forman el núcleo fijo; solo la guía por componente es recuperable
+        if clave.startswith("guia_de_manejo"):
+            en_guia = True
+            continue
+        if not en_guia or clave.startswith("ejemplo"):
+            if texto:
+                nucleo.append(texto)
+            continue
+
+        alias = ALIAS_SECCIONES.get(clave, "")
+        secciones.append(Seccion(
+            clave=clave,
+            titulo=titulo_limpio,
+            contenido=texto,
+            terminos=terminos(f"{titulo_limpio} {titulo_limpio} {texto} {alias}"),
+        ))
+
+    return "\n\n".join(nucleo), secciones
+
+
+class IndiceBM25:
+    """
+    Índice BM25 en memoria sobre las secciones del conocimiento base
+    """
+
+    def __init__(self, secciones: List[Seccion], k1: float = 1.5, b: float = 0.75):
+        self.secciones = secciones
+        self.k1 = k1
+        self.b = b
+        self.frecuencias = [Counter(s.terminos) for s in secciones]
+        self.longitudes = [len(s.terminos) for s in secciones]
+        self.longitud_media = sum(self.longitudes) / max(len(secciones), 1)
+
+        documentos_con_termino: Counter = Counter()
+        for frecuencia in self.frecuencias:
+            documentos_con_termino.update(frecuencia.keys())
+        n = len(secciones)
+        self.idf = {
+            termino: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for termino, df in documentos_con_termino.items()
+        }
+
+    def puntuar(self, consulta: str) -> List[tuple[float, Seccion]]:
+        terminos_consulta = set(terminos(consulta))
+        resultados = []
+        for i, seccion in enumerate(self.secciones):
+            puntaje = 0.0
+            for termino in terminos_consulta:
+                tf = self.frecuencias[i].get(termino, 0)
+                if not tf:
+                    continue
+                norma = self.k1 * (1 - self.b + self.b * self.longitudes[i] / self.longitud_media)
+                puntaje += self.idf[termino] * tf * (self.k1 + 1) / (tf + norma)
+            if puntaje > 0:
+                resultados.append((puntaje, seccion))
+        resultados.sort(key=lambda r: r[0], reverse=True)
+        return resultados
+
+    def buscar(self, consulta: str, k: int = TOP_K) -> List[Seccion]:
+        resultados = self.puntuar(consulta)[:k]
+        if not resultados:
+            return []
+        minimo = resultados[0][0] * PUNTAJE_RELATIVO_MIN
+        return [seccion for puntaje, seccion in resultados if puntaje >= minimo]
+
+
+# Se construye una sola vez al importar el módulo (arranque de la API)
+NUCLEO_PROMPT, SECCIONES_PROMPT = dividir_prompt(SYSTEM_PROMPT_SHORT)
+INDICE = IndiceBM25(SECCIONES_PROMPT)
+
+
+def consulta_desde_turno(message: str, chat_history: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    La consulta incluye el último mensaje del usuario en el historial para
+    que preguntas de seguimiento ("¿y cada cuánto?") mantengan el tema
+    """
+    anteriores = [m["content"] for m in (chat_history or []) if m.get("role") == "user"]
+    return " ".join(anteriores[-1:] + [message])
+
+
+def construir_prompt_sistema(message: str, chat_history: Optional[List[Dict[str, Any]]] = None, k: int = TOP_K) -> str:
+    """
+    Prompt de sistema del turno: núcleo + las k secciones más relevantes.
+    Un turno sin términos de búsqueda (un saludo) lleva solo el núcleo; si
+    hay términos pero ninguna sección coincide se envía el conocimiento
+    base completo.
+    """
+    consulta = consulta_desde_turno(message, chat_history)
+    if not terminos(consulta):
+        return NUCLEO_PROMPT
+
+    secciones = INDICE.buscar(consulta, k)
+    if not secciones:
+        return SYSTEM_PROMPT_SHORT
+
+    # Mantener el orden original del manual
+    secciones.sort(key=SECCIONES_PROMPT.index)
+    partes = [NUCLEO_PROMPT, "## Guía de Manejo (secciones relevantes)"]
+    partes.extend(s.contenido for s in secciones)
+    return "\n\n".join(partes)
@@ -1,13 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 from pydantic import BaseModel
+from typing import Optional
 from app.agent.controllers import (
     chat_with_openai,
     save_chat_message,
     create_chat_session,
     get_chat_session,
-    delete_chat_session
+    get_chat_sessions,
+    delete_chat_session,
+    candado_sesion,
+    SEQ_ACTUAL,
 )
+from app.agent.models import ChatSessionCreate, ChatSessionResponse
+from app.core.database import collection_chats
 from app.auth.routes import get_current_user
+from app.core.read_routing import coleccion_para, sesion_lectura, sesion_escritura
+from app.core.http_cache import etag_para, coincide_etag, no_modificado, aplicar_etag
+from app.agent.archive import get_archived_messages
 from bson import ObjectId
 import json
 
@@ -16,6 +25,8 @@ router = APIRouter()
 
 class ChatRequest(BaseModel):
     message: str
+    # Última seq que vio el cliente: si la sesión avanzó se responde 409
+    expected_seq: Optional[int] = None
 
 
 # 🔹 Enviar mensaje (crea sesión si no existe, guarda historial y recuerda últimos 10)
@@ -23,51 +34,152 @@ class ChatRequest(BaseModel):
 async def chat_endpoint(data: ChatRequest, user=Depends(get_current_user)):
     professional_id = str(user["_id"])
 
-    # Buscar si ya existe una sesión para este profesional
-    session = await get_chat_session_by_professional(professional_id)
+    async with sesion_escritura(professional_id) as db_session:
+        session = await get_or_create_chat_session(professional_id, db_session, projection={"_id": 1})
+        return await procesar_turno(str(session["_id"]), data, db_session)
+
+
+# 🔹 Obtener la sesión actual del profesional (con mensajes)
+@router.get("/session")
+async def get_session(request: Request, response: Response, user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    async with sesion_lectura(professional_id) as db_session:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Consulta cubierta por el índice (professional_id, _id, seq, archivados)
+            meta = await get_chat_session_by_professional(
+                professional_id, "agent.session", db_session, projection=CAMPOS_ETAG
+            )
+            if meta and coincide_etag(if_none_match, etag_sesion(meta)):
+                return no_modificado(etag_sesion(meta))
+
+        session = await get_chat_session_by_professional(professional_id, "agent.session", db_session)
 
-    # Si no existe, crear una
     if not session:
-        session_id = await create_chat_session(professional_id, title="Chat principal")
-        session = await get_chat_session(session_id, professional_id)
-    else:
-        session_id = str(session["_id"])
+        raise HTTPException(status_code=404, detail="No hay sesión activa para este usuario")
 
-    # Tomar últimos 10 mensajes para memoria
-    chat_history = session.get("messages", [])[-10:]
+    aplicar_etag(response, etag_sesion(session))
+    return serializar_sesion(session)
 
-    # Guardar mensaje del usuario
-    await save_chat_message(session_id, "user", data.message)
 
-    # Obtener respuesta con memoria
-    response_text = await chat_with_openai(data.message, chat_history)
+# 🔹 Listar las sesiones del profesional
+@router.get("/sessions", response_model=list[ChatSessionResponse])
+async def list_sessions(user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    async with sesion_lectura(professional_id) as db_session:
+        return await get_chat_sessions(professional_id, db_session)
 
-    # Guardar respuesta del asistente
-    await save_chat_message(session_id, "assistant", response_text)
 
-    return {"session_id": session_id, "response": response_text}
+# 🔹 Crear una sesión nueva (conversación paralela)
+@router.post("/sessions", response_model=ChatSessionResponse)
+async def create_session(data: ChatSessionCreate, user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    async with sesion_escritura(professional_id) as db_session:
+        session_id = await create_chat_session(professional_id, data.title, db_session)
+        session = await get_chat_session(session_id, professional_id, db_session)
 
+    return ChatSessionResponse(
+        id=session_id,
+        title=session["title"],
+        message_count=0,
+        created_at=session["created_at"],
+        updated_at=session["updated_at"],
+    )
 
-# 🔹 Obtener la sesión actual del profesional (con mensajes)
-@router.get("/session")
-async def get_session(user=Depends(get_current_user)):
+
+# 🔹 Obtener una sesión (after_seq: solo los mensajes posteriores a esa seq)
+@router.get("/sessions/{session_id}")
+async def get_session_by_id(
+    session_id: str,
+    request: Request,
+    response: Response,
+    after_seq: Optional[int] = Query(None, ge=0),
+    user=Depends(get_current_user),
+):
     professional_id = str(user["_id"])
-    session = await get_chat_session_by_professional(professional_id)
+    filtro = filtro_sesion(session_id, professional_id)
+    coleccion = coleccion_para(collection_chats, "agent.session")
+
+    async with sesion_lectura(professional_id) as db_session:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            meta = await coleccion.find_one(filtro, CAMPOS_ETAG, session=db_session)
+            if meta and coincide_etag(if_none_match, etag_sesion(meta, after_seq)):
+                return no_modificado(etag_sesion(meta, after_seq))
+
+        projection = None
+        if after_seq is not None:
+            # El filtrado se hace en el servidor: solo viajan los mensajes
+            # nuevos. Las seq son contiguas en el arreglo (también las
+            # implícitas de los mensajes anteriores a "seq"), así que los
+            # posteriores a after_seq son los últimos ultimo_seq - after_seq
+            nuevos = {"$max": [0, {"$min": [
+                {"$size": {"$ifNull": ["$messages", []]}},
+                {"$subtract": [SEQ_ACTUAL, after_seq]},
+            ]}]}
+            projection = {
+                "professional_id": 1, "title": 1, "seq": 1, "archivados": 1, "resumen_archivo": 1,
+                "created_at": 1, "updated_at": 1,
+                "ultimo_seq": SEQ_ACTUAL,
+                "messages": {"$let": {"vars": {"n": nuevos}, "in": {"$cond": [
+                    {"$gt": ["$$n", 0]},
+                    {"$slice": [{"$ifNull": ["$messages", []]}, {"$multiply": [-1, "$$n"]}]},
+                    [],
+                ]}}},
+            }
+        session = await coleccion.find_one(filtro, projection, session=db_session)
 
+    if not session:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+
+    aplicar_etag(response, etag_sesion(session, after_seq))
+    return serializar_sesion(session)
+
+
+# 🔹 Enviar mensaje a una sesión concreta
+@router.post("/sessions/{session_id}/chat")
+async def chat_in_session(session_id: str, data: ChatRequest, user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    filtro = filtro_sesion(session_id, professional_id)
+
+    async with sesion_escritura(professional_id) as db_session:
+        if not await collection_chats.find_one(filtro, {"_id": 1}, session=db_session):
+            raise HTTPException(status_code=404, detail="Sesión no encontrada")
+        return await procesar_turno(session_id, data, db_session)
+
+
+# 🔹 Eliminar una sesión concreta
+@router.delete("/sessions/{session_id}")
+async def delete_session_by_id(session_id: str, user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    filtro_sesion(session_id, professional_id)
+
+    async with sesion_escritura(professional_id) as db_session:
+        deleted = await delete_chat_session(session_id, professional_id, db_session)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+
+    return {"message": "Sesión eliminada correctamente"}
+
+
+# 🔹 Rehidratar el historial archivado de la sesión (mensajes antiguos comprimidos)
+@router.get("/session/archive")
+async def get_session_archive(limit: Optional[int] = Query(None, ge=1, le=5000), user=Depends(get_current_user)):
+    professional_id = str(user["_id"])
+    async with sesion_lectura(professional_id) as db_session:
+        session = await get_chat_session_by_professional(
+            professional_id, "agent.session", db_session, projection={"_id": 1, "resumen_archivo": 1}
+        )
     if not session:
         raise HTTPException(status_code=404, detail="No hay sesión activa para este usuario")
 
-    # Convertir ObjectId a string para serialización JSON
-    session["_id"] = str(session["_id"])
-    session["professional_id"] = str(session["professional_id"])
-    
-    # Convertir ObjectId en mensajes si existen
-    if "messages" in session:
-        for message in session["messages"]:
-            if "_id" in message:
-                message["_id"] = str(message["_id"])
-    
-    return session
+    messages = await get_archived_messages(str(session["_id"]), professional_id, limit)
+    resumen = session.get("resumen_archivo")
+    return {
+        "session_id": str(session["_id"]),
+        "resumen": resumen.get("texto") if resumen else None,
+        "messages": messages,
+    }
 
 
 # 🔹 Eliminar la sesión del profesional
@@ -79,17 +191,111 @@ async def delete_session(user=Depends(get_current_user)):
     if not session:
         raise HTTPException(status_code=404, detail="No hay sesión para eliminar")
 
-    deleted = await delete_chat_session(str(session["_id"]), professional_id)
+    async with sesion_escritura(professional_id) as db_session:
+        deleted = await delete_chat_session(str(session["_id"]), professional_id, db_session)
     if not deleted:
         raise HTTPException(status_code=400, detail="Error al eliminar la sesión")
 
     return {"message": "Sesión eliminada correctamente"}
 
 
-# 🔹 Función auxiliar interna
-async def get_chat_session_by_professional(professional_id: str):
+# 🔹 Funciones auxiliares internas
+async def procesar_turno(session_id: str, data: ChatRequest, db_session=None):
+    """
+    Un turno de chat en una sesión. El candado de la sesión hace que el
+    historial que ve el LLM y las seq de pregunta y respuesta queden
+    contiguos aunque lleguen mensajes en paralelo; otras sesiones no esperan.
+    """
+    async with candado_sesion(session_id):
+        # Tomar últimos 10 mensajes para memoria (leídos ya con el candado)
+        session = await collection_chats.find_one(
+            {"_id": ObjectId(session_id)}, {"messages": {"$slice": -10}}, session=db_session
+        )
+        chat_history = session.get("messages", []) if session else []
+
+        # Guardar mensaje del usuario
+        seq_usuario = await save_chat_message(session_id, "user", data.message, db_session, data.expected_seq)
+        if seq_usuario is None:
+            raise HTTPException(status_code=409, detail="La sesión recibió otros mensajes; vuelve a cargarla")
+
+        # Obtener respuesta con memoria
+        response_text = await chat_with_openai(data.message, chat_history)
+
+        # Guardar respuesta del asistente
+        seq_respuesta = await save_chat_message(session_id, "assistant", response_text, db_session)
+
+    return {
+        "session_id": session_id,
+        "response": response_text,
+        "user_seq": seq_usuario,
+        "seq": seq_respuesta,
+    }
+
+
+def filtro_sesion(session_id: str, professional_id: str):
+    if not ObjectId.is_valid(session_id):
+        raise HTTPException(status_code=404, detail="Sesión no encontrada")
+    return {"_id": ObjectId(session_id), "professional_id": ObjectId(professional_id)}
+
+
+def serializar_sesion(session):
+    # Convertir ObjectId a string para serialización JSON
+    session["_id"] = str(session["_id"])
+    session["professional_id"] = str(session["professional_id"])
+
+    # Los mensajes anteriores a "seq" reciben la suya según su posición
+    messages = session.get("messages", [])
+    ultimo_seq = session.pop("ultimo_seq", None)
+    if ultimo_seq is None:
+        ultimo_seq = session.get("seq", len(messages))
+    session["seq"] = ultimo_seq
+
+    # Convertir ObjectId en mensajes si existen
+    for i, message in enumerate(messages):
+        message.setdefault("seq", ultimo_seq - (len(messages) - 1 - i))
+        if "_id" in message:
+            message["_id"] = str(message["_id"])
+
+    return session
+
+
+async def get_chat_session_by_professional(professional_id: str, ruta: str = "agent.chat", db_session=None, projection=None):
     """
-    Devuelve la única sesión asociada a un profesional, si existe.
+    Devuelve la sesión principal (la más antigua) de un profesional, si
+    existe; es la que usan /chat, /session y el WebSocket sin session_id.
+    La read preference depende de la ruta que la consulta.
     """
-    from app.core.database import collection_chats
-    return await collection_chats.find_one({"professional_id": ObjectId(professional_id)})
\ No newline at end of file
+    return await coleccion_para(collection_chats, ruta).find_one(
+        {"professional_id": ObjectId(professional_id)}, projection, sort=[("_id", 1)], session=db_session
+    )
+
+
+async def get_or_create_chat_session(professional_id: str, db_session=None, projection=None):
+    """
+    Devuelve la sesión principal del profesional (por defecto solo con los
+    últimos 10 mensajes), creándola si todavía no existe
+    """
+    # Buscar si ya existe una sesión para este profesional
+    session = await get_chat_session_by_professional(
+        professional_id, "agent.chat", db_session, projection=projection or {"messages": {"$slice": -10}}
+    )
+
+    # Si no existe, crear una
+    if not session:
+        session_id = await create_chat_session(professional_id, title="Chat principal", db_session=db_session)
+        session = await get_chat_session(session_id, professional_id, db_session)
+
+    return session
+
+
+# Lo que cambia el cuerpo de una sesión: seq con cada mensaje guardado y
+# archivados cuando el job de archivo recorta el historial
+CAMPOS_ETAG = {"_id": 1, "seq": 1, "archivados": 1}
+
+
+def etag_sesion(session, after_seq: Optional[int] = None) -> str:
+    # Las sesiones anteriores a "seq" no tienen el campo hasta su primer mensaje nuevo
+    partes = [session["_id"], session.get("seq", "-"), session.get("archivados", 0)]
+    if after_seq is not None:
+        partes.append(after_seq)
+    return etag_para(*partes)
@@ -0,0 +1,207 @@
+"""
+Canal de chat por WebSocket: se autentica una vez por conexión y mantiene
+la sesión abierta; la respuesta del asistente se transmite por fragmentos.
+Los mensajes se siguen guardando en MongoDB y el historial se relee en
+cada turno, porque otras pestañas o la API HTTP pueden escribir en la
+misma sesión. Con `?session_id=` se conecta a una sesión concreta; sin él,
+a la principal.
+
+Protocolo (JSON):
+    cliente → servidor: {"type": "message", "content": "...", "expected_seq": n?} | {"type": "pong"}
+    servidor → cliente: {"type": "ready", "session_id": "..."}
+                        {"type": "token", "content": "..."}
+                        {"type": "done", "content": "<respuesta completa>", "seq": n}
+                        {"type": "error", "detail": "..."}
+                        {"type": "ping"}
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from bson import ObjectId
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+
+from app.auth.routes import autenticar_token
+from app.agent.controllers import chat_with_openai_stream, save_chat_message, candado_sesion
+from app.agent.routes import get_or_create_chat_session, filtro_sesion
+from app.core.database import collection_chats
+from app.core.read_routing import sesion_escritura
+
+router = APIRouter()
+
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "500"))        # por worker
+WS_HEARTBEAT_SECONDS = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+WS_SEND_QUEUE = int(os.getenv("WS_SEND_QUEUE", "64"))                   # mensajes salientes en cola
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "3"))                  # mensajes del cliente en espera
+WS_MAX_MESSAGE_CHARS = int(os.getenv("WS_MAX_MESSAGE_CHARS", "4000"))
+
+conexiones_activas = 0
+
+
+class ConexionChat:
+    """
+    Estado de una conexión: profesional, sesión y las colas que aplican
+    backpressure en ambos sentidos
+    """
+
+    def __init__(self, websocket: WebSocket, professional_id: str, session: dict):
+        self.websocket = websocket
+        self.professional_id = professional_id
+        self.session_id = str(session["_id"])
+        self.salida: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self.entrada: asyncio.Queue = asyncio.Queue(maxsize=WS_MAX_PENDING)
+        self.ultima_actividad = time.monotonic()
+
+    async def enviar(self, mensaje: dict):
+        # Bloquea si el cliente no está leyendo: el productor espera
+        await self.salida.put(mensaje)
+
+    async def escritor(self):
+        while True:
+            mensaje = await self.salida.get()
+            await self.websocket.send_json(mensaje)
+
+    async def lector(self):
+        while True:
+            data = await self.websocket.receive_json()
+            self.ultima_actividad = time.monotonic()
+
+            if not isinstance(data, dict):
+                # Un JSON válido que no es objeto no debe tumbar la conexión
+                await self.enviar({"type": "error", "detail": "Mensaje con formato inválido"})
+                continue
+            if data.get("type") != "message":
+                continue  # pong u otros mensajes de control
+
+            content = (data.get("content") or "").strip()
+            if not content or len(content) > WS_MAX_MESSAGE_CHARS:
+                await self.enviar({"type": "error", "detail": "Mensaje vacío o demasiado largo"})
+                continue
+            expected_seq = data.get("expected_seq")
+            if expected_seq is not None and (type(expected_seq) is not int or expected_seq < 0):
+                await self.enviar({"type": "error", "detail": "expected_seq inválido"})
+                continue
+            try:
+                self.entrada.put_nowait((content, expected_seq))
+            except asyncio.QueueFull:
+                await self.enviar({"type": "error", "detail": "Hay demasiados mensajes pendientes, espera la respuesta"})
+
+    async def latido(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            if time.monotonic() - self.ultima_actividad > 2 * WS_HEARTBEAT_SECONDS:
+                await self.websocket.close(code=status.WS_1001_GOING_AWAY)
+                return
+            await self.enviar({"type": "ping"})
+
+    async def procesar_turnos(self):
+        while True:
+            content, expected_seq = await self.entrada.get()
+            await self.turno(content, expected_seq)
+
+    async def turno(self, content: str, expected_seq: Optional[int] = None):
+        # Otras conexiones o peticiones HTTP pueden escribir en la misma
+        # sesión: el candado mantiene pregunta y respuesta contiguas
+        async with candado_sesion(self.session_id):
+            await self.turno_con_candado(content, expected_seq)
+
+    async def turno_con_candado(self, content: str, expected_seq: Optional[int] = None):
+        async with sesion_escritura(self.professional_id) as db_session:
+            # Últimos 10 mensajes leídos ya con el candado, como en procesar_turno
+            session = await collection_chats.find_one(
+                {"_id": ObjectId(self.session_id)}, {"messages": {"$slice": -10}}, session=db_session
+            )
+            chat_history = session.get("messages", []) if session else []
+
+            seq_usuario = await save_chat_message(self.session_id, "user", content, db_session, expected_seq)
+            if seq_usuario is None:
+                await self.enviar({"type": "error", "detail": "La sesión recibió otros mensajes; vuelve a cargarla"})
+                return
+
+            partes = []
+            pendiente = ""
+            try:
+                async for fragmento in chat_with_openai_stream(content, chat_history):
+                    partes.append(fragmento)
+                    pendiente += fragmento
+                    # Si la cola está llena se acumulan fragmentos en vez de
+                    # frenar el stream de OpenAI (un cliente lento recibe menos
+                    # mensajes, más grandes)
+                    try:
+                        self.salida.put_nowait({"type": "token", "content": pendiente})
+                        pendiente = ""
+                    except asyncio.QueueFull:
+                        pass
+            except Exception as e:
+                print("Error en el stream de OpenAI:", e)
+                await self.enviar({"type": "error", "detail": "Error al generar la respuesta"})
+                return
+
+            if pendiente:
+                await self.enviar({"type": "token", "content": pendiente})
+
+            respuesta = "".join(partes)
+            seq = await save_chat_message(self.session_id, "assistant", respuesta, db_session)
+
+        await self.enviar({"type": "done", "content": respuesta, "seq": seq})
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket, token: str, session_id: Optional[str] = None):
+    global conexiones_activas
+
+    if conexiones_activas >= WS_MAX_CONNECTIONS:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+
+    # Autenticación única por conexión (el navegador no envía headers en WS)
+    try:
+        user = await autenticar_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Una sesión concreta tiene que existir y ser del profesional
+    professional_id = str(user["_id"])
+    session = None
+    if session_id:
+        try:
+            session = await collection_chats.find_one(
+                filtro_sesion(session_id, professional_id), {"_id": 1}
+            )
+        except HTTPException:
+            pass
+        if not session:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+    await websocket.accept()
+    conexiones_activas += 1
+    tareas = []
+    try:
+        if session is None:
+            async with sesion_escritura(professional_id) as db_session:
+                session = await get_or_create_chat_session(professional_id, db_session)
+
+        conexion = ConexionChat(websocket, professional_id, session)
+        await websocket.send_json({"type": "ready", "session_id": conexion.session_id})
+
+        tareas = [
+            asyncio.create_task(conexion.escritor()),
+            asyncio.create_task(conexion.lector()),
+            asyncio.create_task(conexion.latido()),
+            asyncio.create_task(conexion.procesar_turnos()),
+        ]
+        # Cuando cualquiera termina (desconexión, latido vencido, error) se cierra todo
+        terminadas, _ = await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+        for tarea in terminadas:
+            error = tarea.exception()
+            if error and not isinstance(error, WebSocketDisconnect):
+                print("Error en la conexión WebSocket:", error)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        conexiones_activas -= 1
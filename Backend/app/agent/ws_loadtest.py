@@ -0,0 +1,82 @@
+"""
+Prueba de carga del chat por WebSocket: abre N conexiones concurrentes
+contra un worker y mide conexión, primer fragmento y turno completo.
+
+Uso (desde Backend/, con la API corriendo):
+    python -m app.agent.ws_loadtest --token <JWT> --connections 200 --messages 2
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import websockets
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(int(len(valores) * p), len(valores) - 1)]
+
+
+async def cliente(url: str, mensajes: int, pregunta: str, metricas: dict):
+    inicio = time.perf_counter()
+    try:
+        async with websockets.connect(url, open_timeout=30) as ws:
+            json.loads(await ws.recv())  # "ready"
+            metricas["conexion"].append(time.perf_counter() - inicio)
+
+            for _ in range(mensajes):
+                envio = time.perf_counter()
+                await ws.send(json.dumps({"type": "message", "content": pregunta}))
+                primer_fragmento = None
+                while True:
+                    data = json.loads(await ws.recv())
+                    if data["type"] == "ping":
+                        await ws.send(json.dumps({"type": "pong"}))
+                    elif data["type"] == "token" and primer_fragmento is None:
+                        primer_fragmento = time.perf_counter() - envio
+                    elif data["type"] == "error":
+                        metricas["errores"] += 1
+                        break
+                    elif data["type"] == "done":
+                        metricas["primer_fragmento"].append(primer_fragmento or 0.0)
+                        metricas["turno"].append(time.perf_counter() - envio)
+                        break
+    except Exception as e:
+        metricas["errores"] += 1
+        metricas["ultimo_error"] = repr(e)
+
+
+async def main(args):
+    url = f"{args.url}?token={args.token}"
+    metricas = {"conexion": [], "primer_fragmento": [], "turno": [], "errores": 0, "ultimo_error": None}
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*[
+        cliente(url, args.messages, args.pregunta, metricas)
+        for _ in range(args.connections)
+    ])
+    duracion = time.perf_counter() - inicio
+
+    print(f"Conexiones: {args.connections}  turnos completos: {len(metricas['turno'])}  "
+          f"errores: {metricas['errores']}  duración: {duracion:.1f} s")
+    for nombre in ("conexion", "primer_fragmento", "turno"):
+        valores = metricas[nombre]
+        if valores:
+            print(f"{nombre:>17}: p50 {statistics.median(valores):.3f} s  "
+                  f"p95 {percentil(valores, 0.95):.3f} s  max {max(valores):.3f} s")
+    if metricas["ultimo_error"]:
+        print("Último error:", metricas["ultimo_error"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del chat por WebSocket")
+    parser.add_argument("--url", default="ws://localhost:8000/agent/ws")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=1)
+    parser.add_argument("--pregunta", default="¿Cómo lavo cabello con oleosidad alta?")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,186 @@
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database import collection_analytics, collection_diagnostics
+from app.core.utils import slug
+from app.core.read_routing import coleccion_para
+
+# Componentes del RizoTipo que se acumulan en los rollups
+COMPONENTES = [
+    "plasticidad",
+    "permeabilidad",
+    "densidad",
+    "porosidad",
+    "oleosidad",
+    "grosor",
+    "textura",
+]
+
+
+def clave_mes(fecha: datetime) -> str:
+    return fecha.strftime("%Y-%m")
+
+
+def incrementos_diagnostico(diagnostic: Dict[str, Any], signo: int = 1) -> Dict[str, int]:
+    """
+    Construye el $inc de un diagnóstico: total del mes + un contador por
+    cada valor de componente (ej. componentes.oleosidad.alta)
+    """
+    incrementos = {"total": signo}
+    for componente in COMPONENTES:
+        valor = slug(diagnostic.get(componente) or "")
+        incrementos[f"componentes.{componente}.{valor}"] = signo
+    return incrementos
+
+
+async def registrar_diagnostico_en_rollup(diagnostic: Dict[str, Any], signo: int = 1, db_session=None):
+    """
+    Suma un diagnóstico recién creado al bucket (profesional, mes); con
+    signo=-1 lo resta
+    """
+    await collection_analytics.update_one(
+        {
+            "professional_id": diagnostic["professional_id"],
+            "mes": clave_mes(diagnostic["created_at"]),
+        },
+        {
+            "$inc": incrementos_diagnostico(diagnostic, signo),
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+        session=db_session,
+    )
+
+
+async def ajustar_rollup(antes: Dict[str, Any], despues: Dict[str, Any], db_session=None):
+    """
+    Mueve los contadores de los componentes editados de un diagnóstico
+    (resta el valor anterior y suma el nuevo en el mismo bucket)
+    """
+    incrementos: Dict[str, int] = {}
+    for componente in COMPONENTES:
+        valor_antes = slug(antes.get(componente) or "")
+        valor_despues = slug(despues.get(componente) or "")
+        if valor_antes != valor_despues:
+            incrementos[f"componentes.{componente}.{valor_antes}"] = -1
+            incrementos[f"componentes.{componente}.{valor_despues}"] = 1
+
+    if not incrementos:
+        return
+
+    await collection_analytics.update_one(
+        {
+            "professional_id": antes["professional_id"],
+            "mes": clave_mes(antes["created_at"]),
+        },
+        {
+            "$inc": incrementos,
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        session=db_session,
+    )
+
+
+def pipeline_rebuild(filtro: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Conteos por (profesional, mes, componente, valor crudo) calculados en
+    el servidor; solo viajan los grupos, no los diagnósticos
+    """
+    return [
+        {"$match": filtro},
+        {"$project": {
+            "professional_id": 1,
+            "mes": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+            "pares": [{"k": c, "v": {"$ifNull": [f"${c}", ""]}} for c in COMPONENTES],
+        }},
+        {"$unwind": "$pares"},
+        {"$group": {
+            "_id": {"p": "$professional_id", "mes": "$mes", "k": "$pares.k", "v": "$pares.v"},
+            "n": {"$sum": 1},
+        }},
+    ]
+
+
+async def rebuild_rollups(professional_id: Optional[str] = None) -> int:
+    """
+    Recalcula los rollups desde la colección de diagnósticos.
+    Si se indica un profesional solo se reconstruyen sus buckets.
+    Devuelve la cantidad de buckets escritos.
+
+    Cada bucket se reemplaza por separado (nunca queda borrado a mitad de
+    camino) y al final solo se eliminan los buckets que ya no tienen
+    diagnósticos y que nadie actualizó durante la reconstrucción.
+    """
+    filtro = {"professional_id": ObjectId(professional_id)} if professional_id else {}
+    inicio = datetime.utcnow()
+
+    buckets: Dict[tuple, Dict[str, Any]] = {}
+    async for grupo in collection_diagnostics.aggregate(pipeline_rebuild(filtro), allowDiskUse=True):
+        g = grupo["_id"]
+        bucket = buckets.setdefault((g["p"], g["mes"]), {"total": 0, "componentes": {}})
+        # Los valores crudos se agrupan por slug (igual que al registrar)
+        valores = bucket["componentes"].setdefault(g["k"], {})
+        valor = slug(g["v"] or "")
+        valores[valor] = valores.get(valor, 0) + grupo["n"]
+        if g["k"] == COMPONENTES[0]:
+            bucket["total"] += grupo["n"]
+
+    ahora = datetime.utcnow()
+    for (prof_id, mes), bucket in buckets.items():
+        clave = {"professional_id": prof_id, "mes": mes}
+        documento = {**clave, "total": bucket["total"], "componentes": bucket["componentes"], "updated_at": ahora}
+        try:
+            await collection_analytics.replace_one(clave, documento, upsert=True)
+        except DuplicateKeyError:
+            # Un diagnóstico nuevo creó el bucket en paralelo: ya existe, se reemplaza
+            await collection_analytics.replace_one(clave, documento)
+
+    # Buckets sin diagnósticos; los tocados después del inicio se conservan
+    await collection_analytics.delete_many({**filtro, "updated_at": {"$lt": inicio}})
+
+    return len(buckets)
+
+
+async def get_rollups(professional_id: str, desde: Optional[str] = None, hasta: Optional[str] = None, db_session=None) -> List[Dict[str, Any]]:
+    """
+    Obtiene los buckets mensuales de un profesional, ordenados por mes
+    """
+    filtro: Dict[str, Any] = {"professional_id": ObjectId(professional_id)}
+    if desde or hasta:
+        filtro["mes"] = {}
+        if desde:
+            filtro["mes"]["$gte"] = desde
+        if hasta:
+            filtro["mes"]["$lte"] = hasta
+
+    cursor = coleccion_para(collection_analytics, "analytics.rollups").find(filtro, session=db_session).sort("mes", 1)
+    return [
+        {
+            "mes": doc["mes"],
+            "total": doc["total"],
+            "componentes": doc.get("componentes", {}),
+        }
+        async for doc in cursor
+    ]
+
+
+def distribucion_componente(rollups: List[Dict[str, Any]], componente: str) -> List[Dict[str, Any]]:
+    """
+    Convierte los conteos de un componente en proporciones por mes
+    """
+    resultado = []
+    for bucket in rollups:
+        conteos = bucket["componentes"].get(componente, {})
+        total = bucket["total"]
+        resultado.append({
+            "mes": bucket["mes"],
+            "total": total,
+            "conteos": conteos,
+            "proporciones": {
+                valor: round(cantidad / total, 4) if total else 0.0
+                for valor, cantidad in conteos.items()
+            },
+        })
+    return resultado
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Dict, List
+
+
+class RollupMensual(BaseModel):
+    mes: str
+    total: int
+    componentes: Dict[str, Dict[str, int]]
+
+
+class DistribucionMensual(BaseModel):
+    mes: str
+    total: int
+    conteos: Dict[str, int]
+    proporciones: Dict[str, float]
+
+
+class DistribucionComponente(BaseModel):
+    componente: str
+    meses: List[DistribucionMensual]
@@ -0,0 +1,23 @@
+"""
+Reconstruye todos los rollups de analítica desde la colección de diagnósticos.
+
+Uso (desde Backend/):
+    python -m app.analytics.rebuild
+    python -m app.analytics.rebuild --professional-id <id>
+"""
+import argparse
+import asyncio
+
+from app.analytics.controllers import rebuild_rollups
+
+
+async def main(professional_id: str | None):
+    buckets = await rebuild_rollups(professional_id)
+    print(f"Rollups reconstruidos: {buckets} buckets")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye los rollups de analítica")
+    parser.add_argument("--professional-id", default=None)
+    args = parser.parse_args()
+    asyncio.run(main(args.professional_id))
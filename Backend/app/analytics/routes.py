@@ -0,0 +1,56 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+
+from app.analytics.models import RollupMensual, DistribucionComponente
+from app.analytics.controllers import (
+    COMPONENTES,
+    get_rollups,
+    distribucion_componente,
+    rebuild_rollups,
+)
+from app.auth.routes import get_current_user
+from app.core.read_routing import sesion_lectura
+
+router = APIRouter()
+
+MES_REGEX = r"^\d{4}-\d{2}$"
+
+
+# ===== Buckets mensuales del profesional =====
+@router.get("/rollups", response_model=list[RollupMensual])
+async def get_monthly_rollups(
+    desde: Optional[str] = Query(None, pattern=MES_REGEX),
+    hasta: Optional[str] = Query(None, pattern=MES_REGEX),
+    user=Depends(get_current_user),
+):
+    professional_id = str(user["_id"])
+    # Sesión causal: el diagnóstico recién creado ya cuenta en los buckets
+    async with sesion_lectura(professional_id) as db_session:
+        return await get_rollups(professional_id, desde, hasta, db_session)
+
+
+# ===== Distribución de un componente por mes (ej. % oleosidad alta) =====
+@router.get("/componentes/{componente}", response_model=DistribucionComponente)
+async def get_component_distribution(
+    componente: str,
+    desde: Optional[str] = Query(None, pattern=MES_REGEX),
+    hasta: Optional[str] = Query(None, pattern=MES_REGEX),
+    user=Depends(get_current_user),
+):
+    if componente not in COMPONENTES:
+        raise HTTPException(status_code=404, detail="Componente no encontrado")
+
+    professional_id = str(user["_id"])
+    async with sesion_lectura(professional_id) as db_session:
+        rollups = await get_rollups(professional_id, desde, hasta, db_session)
+    return DistribucionComponente(
+        componente=componente,
+        meses=distribucion_componente(rollups, componente),
+    )
+
+
+# ===== Reconstruir los buckets del profesional desde los diagnósticos =====
+@router.post("/rebuild")
+async def rebuild_professional_rollups(user=Depends(get_current_user)):
+    buckets = await rebuild_rollups(str(user["_id"]))
+    return {"message": "Rollups reconstruidos", "buckets": buckets}
@@ -5,6 +5,8 @@ from jose import jwt, JWTError
 from bson import ObjectId
 
 from app.core.database import collection_professionals
+from app.core.read_routing import coleccion_para
+from app.core.profiling import span
 from app.core.security import pwd_context, create_access_token, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from app.auth.models import ProfessionalCreate, ProfessionalResponse, TokenResponse
 
@@ -12,12 +14,19 @@ router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await autenticar_token(token)
+
+
+async def autenticar_token(token: str):
+    """
+    Valida el JWT y devuelve el profesional (HTTP y WebSocket)
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if not email:
             raise HTTPException(status_code=401, detail="Credenciales inválidas")
-        user = await collection_professionals.find_one({"email": email})
+        user = await coleccion_para(collection_professionals, "auth.current_user").find_one({"email": email})
         if not user:
             raise HTTPException(status_code=401, detail="Usuario no encontrado")
         return user
@@ -53,7 +62,9 @@ async def register(prof: ProfessionalCreate):
 @router.post("/token", response_model=TokenResponse)
 async def login(username: str = Form(...), password: str = Form(...)):
     user = await collection_professionals.find_one({"email": username.lower()})
-    if not user or not pwd_context.verify(password, user["password_hash"]):
+    with span("cpu", "bcrypt"):
+        valido = bool(user) and pwd_context.verify(password, user["password_hash"])
+    if not valido:
         raise HTTPException(status_code=401, detail="Credenciales incorrectas")
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
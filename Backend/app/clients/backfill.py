@@ -0,0 +1,18 @@
+"""
+Vincula los diagnósticos existentes con el registro de clientes.
+
+Uso (desde Backend/):
+    python -m app.clients.backfill
+"""
+import asyncio
+
+from app.clients.controllers import backfill_clients
+
+
+async def main():
+    actualizados = await backfill_clients()
+    print(f"Diagnósticos vinculados a clientes: {actualizados}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,256 @@
+import re
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database import collection_clients, collection_diagnostics
+from app.core.utils import normalizar_texto
+from app.core.read_routing import coleccion_para
+
+# Campos del diagnóstico que se devuelven en el historial del cliente
+CAMPOS_HISTORIAL = {
+    "created_at": 1,
+    "plasticidad": 1,
+    "permeabilidad": 1,
+    "densidad": 1,
+    "porosidad": 1,
+    "oleosidad": 1,
+    "grosor": 1,
+    "textura": 1,
+}
+
+MAX_HISTORIAL = 50
+
+
+def normalizar_correo(correo: Optional[str]) -> str:
+    return (correo or "").strip().lower()
+
+
+def normalizar_whatsapp(whatsapp: Optional[str]) -> str:
+    # Solo dígitos: "+57 300-123 4567" y "573001234567" son el mismo cliente
+    return re.sub(r"\D", "", whatsapp or "")
+
+
+async def upsert_client(professional_id: str, nombre: str, whatsapp: str, correo: str, incrementar: bool = True, db_session=None) -> ObjectId:
+    """
+    Busca el cliente del profesional por correo o WhatsApp normalizado y lo
+    crea si no existe. Devuelve el _id del cliente. Con `incrementar=False`
+    no suma el diagnóstico (ya se contó antes).
+    """
+    correo_norm = normalizar_correo(correo)
+    whatsapp_norm = normalizar_whatsapp(whatsapp)
+
+    claves = []
+    if correo_norm:
+        claves.append({"correo_normalizado": correo_norm})
+    if whatsapp_norm:
+        claves.append({"whatsapp_normalizado": whatsapp_norm})
+
+    ahora = datetime.utcnow()
+    filtro = {"professional_id": ObjectId(professional_id), "$or": claves}
+    update = {
+        "$set": {
+            "nombre": nombre,
+            "nombre_normalizado": normalizar_texto(nombre),
+            "updated_at": ahora,
+        },
+        # Correo y WhatsApp visibles solo cambian junto con su clave de
+        # deduplicación (agregar_contacto), así nunca muestran un dato por
+        # el que el cliente no se puede encontrar
+        "$setOnInsert": {
+            "whatsapp": whatsapp,
+            "correo": correo,
+            "correo_normalizado": correo_norm,
+            "whatsapp_normalizado": whatsapp_norm,
+            "created_at": ahora,
+        },
+        "$inc": {"total_diagnosticos": 1 if incrementar else 0},
+    }
+
+    for _ in range(3):
+        try:
+            doc = await collection_clients.find_one_and_update(
+                filtro,
+                update,
+                projection={"correo_normalizado": 1, "whatsapp_normalizado": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                session=db_session,
+            )
+            break
+        except DuplicateKeyError:
+            # Otra petición creó el mismo cliente en paralelo: reintentar
+            # hace que el filtro lo encuentre y se actualice en vez de insertar
+            continue
+    else:
+        raise RuntimeError("No se pudo registrar el cliente")
+
+    # Un cliente encontrado por WhatsApp con un correo nuevo (o al revés)
+    if correo_norm and correo_norm not in claves_de(doc.get("correo_normalizado")):
+        await agregar_contacto(doc["_id"], "correo", correo, correo_norm, db_session)
+    if whatsapp_norm and whatsapp_norm not in claves_de(doc.get("whatsapp_normalizado")):
+        await agregar_contacto(doc["_id"], "whatsapp", whatsapp, whatsapp_norm, db_session)
+
+    return doc["_id"]
+
+
+def claves_de(valor) -> List[str]:
+    # Los clientes anteriores guardan una sola clave como texto
+    if isinstance(valor, list):
+        return valor
+    return [valor] if valor else []
+
+
+async def agregar_contacto(client_id: ObjectId, campo: str, valor: str, valor_norm: str, db_session=None):
+    """
+    Agrega una clave normalizada (correo o WhatsApp) al cliente y actualiza
+    el dato visible. Las claves anteriores se conservan para seguir
+    encontrándolo por ellas; si otro cliente del profesional ya tiene esa
+    clave no se cambia nada.
+    """
+    campo_norm = f"{campo}_normalizado"
+    actuales = {"$cond": [
+        {"$isArray": f"${campo_norm}"},
+        f"${campo_norm}",
+        {"$filter": {"input": [f"${campo_norm}"], "cond": {"$gt": ["$$this", ""]}}},
+    ]}
+    try:
+        await collection_clients.update_one(
+            {"_id": client_id},
+            [{"$set": {
+                campo_norm: {"$setUnion": [actuales, [valor_norm]]},
+                campo: {"$literal": valor},
+            }}],
+            session=db_session,
+        )
+    except DuplicateKeyError:
+        pass
+
+
+async def descontar_diagnostico_cliente(client_id: ObjectId, db_session=None):
+    """
+    Deshace el conteo de un diagnóstico que finalmente no se guardó
+    """
+    await collection_clients.update_one({"_id": client_id}, {"$inc": {"total_diagnosticos": -1}}, session=db_session)
+
+
+def filtro_prefijo(professional_id: str, q: str) -> Optional[Dict[str, Any]]:
+    """
+    Búsqueda por prefijo sobre los campos normalizados (usa los índices
+    de nombre, WhatsApp y correo). None si el texto no deja nada que buscar.
+    """
+    ramas = []
+    texto = normalizar_texto(q)
+    if texto:
+        ramas.append({"nombre_normalizado": {"$regex": f"^{re.escape(texto)}"}})
+    correo = normalizar_correo(q)
+    if correo:
+        ramas.append({"correo_normalizado": {"$regex": f"^{re.escape(correo)}"}})
+    digitos = normalizar_whatsapp(q)
+    if digitos:
+        ramas.append({"whatsapp_normalizado": {"$regex": f"^{digitos}"}})
+
+    if not ramas:
+        return None
+    return {"professional_id": ObjectId(professional_id), "$or": ramas}
+
+
+def pipeline_busqueda(filtro: Dict[str, Any], limit: int, orden: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Pipeline que busca clientes y trae su historial de diagnósticos en la
+    misma consulta ($lookup sobre el índice client_id + created_at)
+    """
+    return [
+        {"$match": filtro},
+        {"$sort": orden},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": collection_diagnostics.name,
+            "localField": "_id",
+            "foreignField": "client_id",
+            "pipeline": [
+                {"$sort": {"created_at": -1}},
+                {"$limit": MAX_HISTORIAL},
+                {"$project": CAMPOS_HISTORIAL},
+            ],
+            "as": "diagnosticos",
+        }},
+    ]
+
+
+def serializar_cliente(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(doc["_id"]),
+        "nombre": doc["nombre"],
+        "whatsapp": doc["whatsapp"],
+        "correo": doc["correo"],
+        "total_diagnosticos": doc.get("total_diagnosticos", 0),
+        "created_at": doc["created_at"],
+        "updated_at": doc["updated_at"],
+        "diagnosticos": [
+            {"id": str(d.pop("_id")), **d}
+            for d in doc.get("diagnosticos", [])
+        ],
+    }
+
+
+async def search_clients(professional_id: str, q: str, limit: int = 20, db_session=None) -> List[Dict[str, Any]]:
+    """
+    Busca clientes por prefijo de nombre, WhatsApp o correo. Si no hay
+    coincidencias por prefijo, usa el índice de texto (ej. apellidos).
+    """
+    filtro = filtro_prefijo(professional_id, q)
+    if filtro is None:
+        # Solo espacios o signos: MongoDB rechaza un $or vacío
+        return []
+
+    cursor = coleccion_para(collection_clients, "clients.search").aggregate(
+        pipeline_busqueda(filtro, limit, {"updated_at": -1}), session=db_session
+    )
+    clientes = await cursor.to_list(length=limit)
+
+    if not clientes:
+        filtro_texto = {"professional_id": ObjectId(professional_id), "$text": {"$search": q}}
+        cursor = coleccion_para(collection_clients, "clients.search").aggregate(
+            pipeline_busqueda(filtro_texto, limit, {"score": {"$meta": "textScore"}}), session=db_session
+        )
+        clientes = await cursor.to_list(length=limit)
+
+    return [serializar_cliente(c) for c in clientes]
+
+
+async def get_client(client_id: str, professional_id: str, db_session=None) -> Optional[Dict[str, Any]]:
+    """
+    Obtiene un cliente con su historial de diagnósticos
+    """
+    filtro = {"_id": ObjectId(client_id), "professional_id": ObjectId(professional_id)}
+    cursor = coleccion_para(collection_clients, "clients.search").aggregate(
+        pipeline_busqueda(filtro, 1, {"_id": 1}), session=db_session
+    )
+    clientes = await cursor.to_list(length=1)
+    return serializar_cliente(clientes[0]) if clientes else None
+
+
+async def backfill_clients() -> int:
+    """
+    Vincula a un cliente los diagnósticos creados antes del registro de
+    clientes. Devuelve cuántos diagnósticos se actualizaron.
+    """
+    actualizados = 0
+    cursor = collection_diagnostics.find(
+        {"client_id": {"$exists": False}},
+        {"professional_id": 1, "nombre": 1, "whatsapp": 1, "correo": 1},
+    ).sort("created_at", 1)
+
+    async for d in cursor:
+        client_id = await upsert_client(
+            str(d["professional_id"]), d["nombre"], d["whatsapp"], d["correo"]
+        )
+        await collection_diagnostics.update_one(
+            {"_id": d["_id"]}, {"$set": {"client_id": client_id}}
+        )
+        actualizados += 1
+
+    return actualizados
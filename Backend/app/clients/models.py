@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from typing import List
+from datetime import datetime
+
+
+class DiagnosticoResumen(BaseModel):
+    id: str
+    created_at: datetime
+    plasticidad: str
+    permeabilidad: str
+    densidad: str
+    porosidad: str
+    oleosidad: str
+    grosor: str
+    textura: str
+
+
+class ClientResponse(BaseModel):
+    id: str
+    nombre: str
+    whatsapp: str
+    correo: str
+    total_diagnosticos: int
+    created_at: datetime
+    updated_at: datetime
+    diagnosticos: List[DiagnosticoResumen] = []
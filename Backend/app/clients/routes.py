@@ -0,0 +1,37 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from bson import ObjectId
+
+from app.clients.models import ClientResponse
+from app.clients.controllers import search_clients, get_client
+from app.auth.routes import get_current_user
+from app.core.read_routing import sesion_lectura
+
+router = APIRouter()
+
+
+# ===== Buscar clientes por nombre, WhatsApp o correo =====
+@router.get("/search", response_model=list[ClientResponse])
+async def search(
+    q: str = Query(..., min_length=2),
+    limit: int = Query(20, ge=1, le=100),
+    user=Depends(get_current_user),
+):
+    professional_id = str(user["_id"])
+    # Sesión causal: un cliente creado por un diagnóstico aparece enseguida
+    async with sesion_lectura(professional_id) as db_session:
+        return await search_clients(professional_id, q, limit, db_session)
+
+
+# ===== Obtener cliente con su historial de diagnósticos =====
+@router.get("/{client_id}", response_model=ClientResponse)
+async def get_client_by_id(client_id: str, user=Depends(get_current_user)):
+    if not ObjectId.is_valid(client_id):
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+
+    professional_id = str(user["_id"])
+    async with sesion_lectura(professional_id) as db_session:
+        client = await get_client(client_id, professional_id, db_session)
+    if not client:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+
+    return client
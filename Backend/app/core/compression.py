@@ -0,0 +1,122 @@
+"""
+Middleware ASGI de compresión gzip / brotli para respuestas grandes.
+
+Brotli es opcional: si el paquete `brotli` no está instalado solo se usa gzip.
+Configuración:
+    COMPRESSION_ENABLED=true
+    COMPRESSION_ALGORITHMS=br,gzip      # orden de preferencia del servidor
+    COMPRESSION_MIN_SIZE=1024           # bytes
+    COMPRESSION_GZIP_LEVEL=6
+    COMPRESSION_BROTLI_QUALITY=4
+"""
+import gzip
+import os
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_ALGORITHMS = [a.strip() for a in os.getenv("COMPRESSION_ALGORITHMS", "br,gzip").split(",") if a.strip()]
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+TIPOS_COMPRIMIBLES = ("application/json", "text/")
+
+
+def algoritmos_disponibles():
+    return [a for a in COMPRESSION_ALGORITHMS if a == "gzip" or (a == "br" and brotli is not None)]
+
+
+def elegir_codificacion(accept_encoding: str):
+    """
+    Elige el primer algoritmo del servidor que el cliente acepte (q > 0)
+    """
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        if parametros.strip().startswith("q="):
+            try:
+                calidad = float(parametros.strip()[2:])
+            except ValueError:
+                calidad = 0.0
+        if nombre:
+            aceptadas[nombre] = calidad
+
+    for algoritmo in algoritmos_disponibles():
+        if aceptadas.get(algoritmo, aceptadas.get("*", 0)) > 0:
+            return algoritmo
+    return None
+
+
+def comprimir(cuerpo: bytes, algoritmo: str) -> bytes:
+    if algoritmo == "br":
+        return brotli.compress(cuerpo, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(cuerpo, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        algoritmo = elegir_codificacion(Headers(scope=scope).get("accept-encoding", ""))
+        if not algoritmo:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = None
+        transmitiendo = False
+
+        async def send_comprimido(message):
+            nonlocal inicio, transmitiendo
+
+            if message["type"] == "http.response.start":
+                # Se retiene hasta conocer el cuerpo completo
+                inicio = message
+                return
+
+            if message["type"] != "http.response.body" or transmitiendo:
+                await send(message)
+                return
+
+            cuerpo = message.get("body", b"")
+            headers = MutableHeaders(raw=inicio["headers"])
+            comprimible = (
+                not message.get("more_body", False)
+                and inicio["status"] not in (204, 304)
+                and "content-encoding" not in headers
+                and len(cuerpo) >= self.minimum_size
+                and headers.get("content-type", "").startswith(TIPOS_COMPRIMIBLES)
+            )
+
+            if not comprimible:
+                # Respuestas en streaming o pequeñas pasan sin comprimir
+                transmitiendo = True
+                await send(inicio)
+                await send(message)
+                return
+
+            comprimido = comprimir(cuerpo, algoritmo)
+            headers["Content-Encoding"] = algoritmo
+            headers["Content-Length"] = str(len(comprimido))
+            headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and etag.endswith('"'):
+                # La representación comprimida es otra: ETag distinto
+                headers["ETag"] = f'{etag[:-1]}-{algoritmo}"'
+
+            await send(inicio)
+            await send({"type": "http.response.body", "body": comprimido})
+
+        await self.app(scope, receive, send_comprimido)
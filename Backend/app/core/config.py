@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware  # Importa el middleware CORS
 from dotenv import load_dotenv
@@ -5,7 +6,20 @@ from dotenv import load_dotenv
 # Importar routers de cada módulo
 from app.auth.routes import router as auth_router
 from app.agent.routes import router as agent_router
+from app.agent.websocket import router as agent_ws_router
 from app.diagnostic.routes import router as diagnostic_router
+from app.analytics.routes import router as analytics_router
+from app.clients.routes import router as clients_router
+from app.profiling.routes import router as profiling_router
+from app.reports.routes import router as reports_router
+from app.admin.routes import router as admin_router
+from app.core.database import crear_indices
+from app.core.compression import CompressionMiddleware, COMPRESSION_ENABLED
+from app.core.profiling import ProfilerMiddleware, PROFILER_ENABLED
+from app.core.read_routing import MarcaCausalMiddleware
+from app.diagnostic.controllers import job_recuperacion
+from app.agent.archive import job_compactacion, INTERVALO_HORAS as ARCHIVO_INTERVALO_HORAS
+from app.diagnostic.batch import job_lotes, BATCH_ENABLED
 
 load_dotenv()
 
@@ -21,7 +35,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Permite todos los métodos HTTP
     allow_headers=["*"],  # Permite todos los headers
+    expose_headers=["X-Causal-Token"],  # Marca de lectura causal (read_routing)
 )
+
+# Marca causal que el cliente reenvía para leer sus propias escrituras en cualquier worker
+app.add_middleware(MarcaCausalMiddleware)
+
+# Compresión gzip / brotli de respuestas JSON grandes
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+# Perfilado opcional por petición (header X-Profile o tasa de muestreo)
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    await crear_indices()
+    # Completar periódicamente los diagnósticos que quedaron pendientes
+    app.state.tareas_fondo = [asyncio.create_task(job_recuperacion())]
+    # Archivar periódicamente el historial de chat antiguo
+    if ARCHIVO_INTERVALO_HORAS > 0:
+        app.state.tareas_fondo.append(asyncio.create_task(job_compactacion()))
+    # Enviar y sondear los lotes de diagnósticos diferidos
+    if BATCH_ENABLED:
+        app.state.tareas_fondo.append(asyncio.create_task(job_lotes()))
+
 # Health Check Endpoint
 @app.get("/")
 async def read_root():
@@ -30,6 +70,12 @@ async def read_root():
 # Incluir todos los routers
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(agent_router, prefix="/agent", tags=["Agent"])
+app.include_router(agent_ws_router, prefix="/agent", tags=["Agent"])
 app.include_router(diagnostic_router, prefix="/diagnostics", tags=["Diagnostics"])
+app.include_router(analytics_router, prefix="/analytics", tags=["Analytics"])
+app.include_router(clients_router, prefix="/clients", tags=["Clients"])
+app.include_router(reports_router, prefix="/reports", tags=["Reports"])
+app.include_router(profiling_router, prefix="/admin/profiles", tags=["Admin"])
+app.include_router(admin_router, prefix="/admin", tags=["Admin"])
 
 
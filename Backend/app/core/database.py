@@ -1,23 +1,93 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from app.core.profiling import PROFILER_ENABLED, listener_mongo
+
 uri = os.getenv("MONGODB_URI")
 db_name = os.getenv("MONGODB_NAME", "RizoTipoOnline")
 
 if not uri:
     raise RuntimeError("MONGODB_URI no está definida en .env")
 
-client = AsyncIOMotorClient(uri)
+# El listener solo se registra con el perfilador activo (spans de MongoDB)
+client = AsyncIOMotorClient(uri, event_listeners=[listener_mongo] if PROFILER_ENABLED else [])
 db = client[db_name]
 
 collection_professionals = db["professionals"]
 collection_clients = db["clients"]
 collection_diagnostics = db["diagnostics"]
 collection_chats = db["chat_sessions"]
+collection_analytics = db["analytics_rollups"]
+collection_chat_archive = db["chat_archive"]
+collection_reports = db["diagnostic_reports"]
+collection_batches = db["diagnostic_batches"]
 
 
 def connect_to_mongo():
-    return client
\ No newline at end of file
+    return client
+
+
+async def crear_indices():
+    """
+    Crea los índices que usan las consultas de la API (idempotente)
+    """
+    await collection_analytics.create_index(
+        [("professional_id", ASCENDING), ("mes", ASCENDING)], unique=True
+    )
+    await collection_diagnostics.create_index(
+        [("professional_id", ASCENDING), ("created_at", DESCENDING)]
+    )
+    await collection_diagnostics.create_index(
+        [("client_id", ASCENDING), ("created_at", DESCENDING)]
+    )
+    # Cubre las validaciones de ETag (If-None-Match) sin leer el documento
+    await collection_diagnostics.create_index(
+        [("_id", ASCENDING), ("professional_id", ASCENDING), ("version", ASCENDING)]
+    )
+    await collection_diagnostics.create_index(
+        [("estado", ASCENDING), ("created_at", ASCENDING)],
+        partialFilterExpression={"estado": "pendiente"},
+    )
+    # Diagnósticos diferidos a la espera de un lote de OpenAI
+    await collection_diagnostics.create_index(
+        [("estado", ASCENDING), ("lote_id", ASCENDING)],
+        partialFilterExpression={"estado": "diferido"},
+    )
+    await collection_batches.create_index([("estado", ASCENDING)])
+    # Enlaces públicos de los reportes
+    await collection_diagnostics.create_index(
+        [("share_token", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"share_token": {"$exists": True}},
+    )
+
+    await collection_chats.create_index(
+        [("professional_id", ASCENDING), ("updated_at", DESCENDING), ("_id", ASCENDING)]
+    )
+    # Sesión principal (la más antigua) y ETag de una sesión, cubiertos
+    await collection_chats.create_index(
+        [("professional_id", ASCENDING), ("_id", ASCENDING), ("seq", ASCENDING), ("archivados", ASCENDING)]
+    )
+    # Lotes de mensajes archivados: uno por (sesión, primer mensaje)
+    await collection_chat_archive.create_index(
+        [("session_id", ASCENDING), ("desde", ASCENDING)], unique=True
+    )
+
+    # Registro de clientes: deduplicación por correo / WhatsApp normalizado
+    for campo in ("correo_normalizado", "whatsapp_normalizado"):
+        await collection_clients.create_index(
+            [("professional_id", ASCENDING), (campo, ASCENDING)],
+            unique=True,
+            partialFilterExpression={campo: {"$gt": ""}},
+        )
+    await collection_clients.create_index(
+        [("professional_id", ASCENDING), ("nombre_normalizado", ASCENDING)]
+    )
+    await collection_clients.create_index(
+        [("nombre", TEXT), ("correo", TEXT), ("whatsapp", TEXT)],
+        default_language="spanish",
+    )
\ No newline at end of file
@@ -0,0 +1,46 @@
+import hashlib
+from typing import Optional
+
+from fastapi import Response
+
+# Sufijos que agrega el middleware de compresión al ETag de la representación
+SUFIJOS_CODIFICACION = ("-gzip", "-br")
+
+
+def etag_para(*partes) -> str:
+    """
+    ETag fuerte a partir del id del documento y su versión / updated_at
+    """
+    base = ":".join(str(p) for p in partes)
+    return '"' + hashlib.sha1(base.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def quitar_sufijo(etag: str) -> str:
+    etag = etag.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    for sufijo in SUFIJOS_CODIFICACION:
+        if etag.endswith(sufijo + '"'):
+            return etag[: -len(sufijo) - 1] + '"'
+    return etag
+
+
+def coincide_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evalúa If-None-Match (lista separada por comas o "*")
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(quitar_sufijo(candidato) == etag for candidato in if_none_match.split(","))
+
+
+def no_modificado(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def aplicar_etag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    # El navegador guarda la respuesta pero siempre revalida con If-None-Match
+    response.headers["Cache-Control"] = "private, no-cache"
@@ -0,0 +1,214 @@
+"""
+Política de enrutamiento de las llamadas al LLM: elige modelo, max_tokens
+y temperatura según la ruta ("agent.chat", "diagnostics.create",
+"diagnostics.sections") y las características de la petición.
+
+Cada ruta tiene una lista de reglas en orden; gana la primera cuyas
+condiciones se cumplan todas (la última, sin condiciones, es la base):
+
+    max_chars / min_chars   largo del mensaje del usuario
+    latencia_min_s          EWMA de la latencia reciente de la ruta
+    cualquier otra clave    igualdad con la característica (ej. "historial": false)
+
+Si una regla no define max_tokens se usa el que sugiere quien llama (ej. el
+de las secciones a regenerar). Las reglas se reemplazan por ruta con
+LLM_ROUTING_RULES (JSON con la forma de REGLAS_POR_DEFECTO) o con un archivo
+en LLM_ROUTING_FILE.
+"""
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+MODELO_BASE = os.getenv("LLM_DEFAULT_MODEL", "gpt-4o-mini")
+ALFA_EWMA = float(os.getenv("LLM_ROUTING_EWMA_ALPHA", "0.2"))
+
+CAMPOS_POLITICA = {"nombre", "model", "max_tokens", "temperature"}
+
+REGLAS_POR_DEFECTO: Dict[str, List[Dict[str, Any]]] = {
+    "agent.chat": [
+        # Preguntas cortas sin conversación previa: respuesta breve y más directa
+        {"nombre": "corta", "max_chars": 80, "historial": False,
+         "model": MODELO_BASE, "max_tokens": 320, "temperature": 0.5},
+        # OpenAI lento: acotar la cola de latencia
+        {"nombre": "congestion", "latencia_min_s": 8,
+         "model": MODELO_BASE, "max_tokens": 384, "temperature": 0.7},
+        {"nombre": "base", "model": MODELO_BASE, "max_tokens": 512, "temperature": 0.7},
+    ],
+    "diagnostics.create": [
+        # El JSON completo necesita todo el presupuesto: solo baja la temperatura
+        # cuando no hay notas libres que interpretar
+        {"nombre": "sin_notas", "notas": False,
+         "model": MODELO_BASE, "max_tokens": 800, "temperature": 0.5},
+        {"nombre": "base", "model": MODELO_BASE, "max_tokens": 800, "temperature": 0.7},
+    ],
+    "diagnostics.sections": [
+        {"nombre": "base", "model": MODELO_BASE, "temperature": 0.7},
+    ],
+}
+
+
+@dataclass(frozen=True)
+class Politica:
+    ruta: str
+    regla: str
+    model: str
+    max_tokens: int
+    temperature: float
+
+    def parametros(self) -> Dict[str, Any]:
+        return {"model": self.model, "max_tokens": self.max_tokens, "temperature": self.temperature}
+
+
+def cargar_reglas() -> Dict[str, List[Dict[str, Any]]]:
+    reglas = {ruta: list(lista) for ruta, lista in REGLAS_POR_DEFECTO.items()}
+    texto = os.getenv("LLM_ROUTING_RULES", "")
+    archivo = os.getenv("LLM_ROUTING_FILE", "")
+    if archivo:
+        with open(archivo, encoding="utf-8") as f:
+            texto = f.read()
+    if texto:
+        try:
+            reglas.update(json.loads(texto))
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"LLM_ROUTING_RULES no es JSON válido: {e}")
+    for ruta, lista in reglas.items():
+        if not lista or any("model" not in r for r in lista):
+            raise RuntimeError(f"Reglas de enrutamiento inválidas para {ruta}: cada regla necesita 'model'")
+    return reglas
+
+
+REGLAS = cargar_reglas()
+
+
+class MetricasRuta:
+    """
+    Latencia (EWMA) y uso por regla de una ruta
+    """
+
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.latencia_ewma: Optional[float] = None
+        self.por_regla: Dict[str, Dict[str, Any]] = {}
+
+    def registrar(self, politica: Politica, segundos: float, tokens: Optional[int], error: bool, vencida: bool = False):
+        self.llamadas += 1
+        regla = self.por_regla.setdefault(politica.regla, {
+            "model": politica.model, "llamadas": 0, "errores": 0,
+            "segundos_total": 0.0, "tokens_completion_total": 0, "con_usage": 0,
+        })
+        regla["llamadas"] += 1
+        if error:
+            self.errores += 1
+            regla["errores"] += 1
+            if not vencida:
+                return
+        # Las llamadas que vencieron su deadline también cuentan: son la
+        # señal de que OpenAI está lento
+        self.latencia_ewma = segundos if self.latencia_ewma is None else (
+            ALFA_EWMA * segundos + (1 - ALFA_EWMA) * self.latencia_ewma
+        )
+        if error:
+            return
+        regla["segundos_total"] += segundos
+        if tokens is not None:
+            regla["tokens_completion_total"] += tokens
+            regla["con_usage"] += 1
+
+    def resumen(self) -> Dict[str, Any]:
+        return {
+            "llamadas": self.llamadas,
+            "errores": self.errores,
+            "latencia_ewma_s": round(self.latencia_ewma, 3) if self.latencia_ewma is not None else None,
+            "por_regla": {
+                nombre: {
+                    "model": r["model"],
+                    "llamadas": r["llamadas"],
+                    "errores": r["errores"],
+                    "latencia_media_s": round(r["segundos_total"] / max(r["llamadas"] - r["errores"], 1), 3),
+                    "tokens_completion_medios": round(r["tokens_completion_total"] / r["con_usage"], 1) if r["con_usage"] else None,
+                }
+                for nombre, r in self.por_regla.items()
+            },
+        }
+
+
+metricas: Dict[str, MetricasRuta] = {}
+
+
+def cumple(regla: Dict[str, Any], caracteristicas: Dict[str, Any]) -> bool:
+    for clave, valor in regla.items():
+        if clave in CAMPOS_POLITICA:
+            continue
+        if clave == "max_chars":
+            if caracteristicas.get("chars", 0) > valor:
+                return False
+        elif clave == "min_chars":
+            if caracteristicas.get("chars", 0) < valor:
+                return False
+        elif clave == "latencia_min_s":
+            latencia = caracteristicas.get("latencia_ewma_s")
+            if latencia is None or latencia < valor:
+                return False
+        elif caracteristicas.get(clave) != valor:
+            return False
+    return True
+
+
+def elegir(ruta: str, mensaje: str = "", max_tokens_sugerido: Optional[int] = None, **extra) -> Politica:
+    """
+    Devuelve la política para una llamada. `extra` son características
+    adicionales (historial, notas...) que las reglas pueden comparar.
+    """
+    ruta_metricas = metricas.get(ruta)
+    caracteristicas = {
+        "chars": len(mensaje or ""),
+        "latencia_ewma_s": ruta_metricas.latencia_ewma if ruta_metricas else None,
+        **extra,
+    }
+    reglas = REGLAS.get(ruta) or [{"nombre": "base", "model": MODELO_BASE, "max_tokens": 512, "temperature": 0.7}]
+    regla = next((r for r in reglas if cumple(r, caracteristicas)), reglas[-1])
+    return Politica(
+        ruta=ruta,
+        regla=regla.get("nombre", "sin_nombre"),
+        model=regla["model"],
+        max_tokens=regla.get("max_tokens") or max_tokens_sugerido or 512,
+        temperature=regla.get("temperature", 0.7),
+    )
+
+
+class medir:
+    """
+    Registra latencia, tokens y errores de una llamada en las métricas
+    de su ruta
+
+        with medir(politica) as medicion:
+            response = await client.chat.completions.create(**politica.parametros(), ...)
+            medicion.usage = response.usage
+    """
+
+    def __init__(self, politica: Politica):
+        self.politica = politica
+        self.usage = None
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        tokens = getattr(self.usage, "completion_tokens", None)
+        vencida = exc_type is not None and issubclass(exc_type, (asyncio.TimeoutError, asyncio.CancelledError))
+        metricas.setdefault(self.politica.ruta, MetricasRuta()).registrar(
+            self.politica, time.perf_counter() - self.inicio, tokens, exc_type is not None, vencida
+        )
+        return False
+
+
+def resumen_metricas() -> Dict[str, Any]:
+    return {
+        "reglas": REGLAS,
+        "rutas": {ruta: m.resumen() for ruta, m in metricas.items()},
+    }
@@ -0,0 +1,270 @@
+"""
+Perfilado por muestreo de peticiones individuales.
+
+Una petición se perfila si trae el header `X-Profile` con PROFILER_ADMIN_TOKEN
+o si cae en la fracción PROFILER_SAMPLE_RATE. Mientras dura se toman
+muestras de la pila del hilo del event loop cada PROFILER_INTERVAL_MS (un
+hilo aparte lee sys._current_frames, sin instrumentar el código) y se
+registran spans de tiempo real de MongoDB (CommandListener) y de OpenAI.
+Se guardan los últimos PROFILER_KEEP perfiles en memoria del worker; se
+descargan desde /admin/profiles.
+
+Como el event loop es compartido, si se perfilan varias peticiones a la vez
+las muestras de una pueden incluir trabajo de las otras; los spans sí son
+exactos por petición.
+
+Sin token ni tasa de muestreo el middleware y el listener no se registran.
+"""
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import monitoring
+from starlette.datastructures import Headers
+
+PROFILER_ADMIN_TOKEN = os.getenv("PROFILER_ADMIN_TOKEN", "")
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_KEEP = int(os.getenv("PROFILER_KEEP", "50"))
+PROFILER_MAX_DEPTH = 64
+
+PROFILER_ENABLED = bool(PROFILER_ADMIN_TOKEN) or PROFILER_SAMPLE_RATE > 0
+
+
+class Perfil:
+    """
+    Muestras de pila y spans de una petición
+    """
+
+    def __init__(self, method: str, path: str, motivo: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.motivo = motivo
+        self.fecha = datetime.utcnow()
+        self.inicio = time.perf_counter()
+        self.duracion_ms: Optional[float] = None
+        self.status: Optional[int] = None
+        self.pilas: Counter = Counter()
+        self.muestras = 0
+        self.spans: List[Dict[str, Any]] = []
+        self.comandos_en_curso: Dict[int, str] = {}
+
+    def agregar_span(self, tipo: str, nombre: str, inicio: float, duracion_ms: float, **extra):
+        self.spans.append({
+            "tipo": tipo,
+            "nombre": nombre,
+            "inicio_ms": round((inicio - self.inicio) * 1000, 2),
+            "duracion_ms": round(duracion_ms, 2),
+            **extra,
+        })
+
+    def resumen(self) -> Dict[str, Any]:
+        por_tipo: Dict[str, float] = {}
+        for s in self.spans:
+            por_tipo[s["tipo"]] = round(por_tipo.get(s["tipo"], 0) + s["duracion_ms"], 2)
+        return {
+            "id": self.id,
+            "fecha": self.fecha,
+            "method": self.method,
+            "path": self.path,
+            "motivo": self.motivo,
+            "status": self.status,
+            "duracion_ms": self.duracion_ms,
+            "muestras": self.muestras,
+            "spans": len(self.spans),
+            "tiempo_por_tipo_ms": por_tipo,
+        }
+
+    def detalle(self, max_pilas: int = 200) -> Dict[str, Any]:
+        return {
+            **self.resumen(),
+            "intervalo_ms": PROFILER_INTERVAL_MS,
+            "spans_detalle": self.spans,
+            "pilas": [{"pila": p, "muestras": n} for p, n in self.pilas.most_common(max_pilas)],
+        }
+
+    def colapsado(self) -> str:
+        # Formato "collapsed stacks" (flamegraph.pl, speedscope)
+        return "\n".join(f"{pila} {n}" for pila, n in self.pilas.most_common())
+
+
+perfil_actual: ContextVar[Optional[Perfil]] = ContextVar("perfil_actual", default=None)
+perfiles_recientes: "deque[Perfil]" = deque(maxlen=PROFILER_KEEP)
+
+
+def buscar_perfil(perfil_id: str) -> Optional[Perfil]:
+    for perfil in perfiles_recientes:
+        if perfil.id == perfil_id:
+            return perfil
+    return None
+
+
+class span:
+    """
+    Mide el tiempo real de un bloque dentro de la petición perfilada;
+    si no hay perfil activo no hace nada
+
+        with span("llm", "chat"):
+            response = await client.chat.completions.create(...)
+    """
+
+    __slots__ = ("tipo", "nombre", "perfil", "inicio")
+
+    def __init__(self, tipo: str, nombre: str):
+        self.tipo = tipo
+        self.nombre = nombre
+        self.perfil = None
+
+    def __enter__(self):
+        self.perfil = perfil_actual.get()
+        if self.perfil is not None:
+            self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.perfil is not None:
+            self.perfil.agregar_span(
+                self.tipo, self.nombre, self.inicio, (time.perf_counter() - self.inicio) * 1000,
+                error=exc_type.__name__ if exc_type else None,
+            )
+        return False
+
+
+class ListenerMongo(monitoring.CommandListener):
+    """
+    Spans de los comandos de MongoDB. Motor ejecuta pymongo en un pool de
+    hilos copiando el contexto, así que perfil_actual llega hasta aquí.
+    """
+
+    def started(self, event):
+        perfil = perfil_actual.get()
+        if perfil is not None:
+            coleccion = event.command.get(event.command_name)
+            perfil.comandos_en_curso[event.request_id] = (
+                f"{event.command_name} {coleccion}" if isinstance(coleccion, str) else event.command_name
+            )
+
+    def succeeded(self, event):
+        self._cerrar(event, None)
+
+    def failed(self, event):
+        self._cerrar(event, (event.failure or {}).get("codeName", "error"))
+
+    def _cerrar(self, event, error):
+        perfil = perfil_actual.get()
+        if perfil is None:
+            return
+        nombre = perfil.comandos_en_curso.pop(event.request_id, event.command_name)
+        duracion_ms = event.duration_micros / 1000
+        fin = time.perf_counter()
+        perfil.agregar_span("db", nombre, fin - duracion_ms / 1000, duracion_ms, error=error)
+
+
+listener_mongo = ListenerMongo()
+
+
+class Muestreador:
+    """
+    Hilo que toma muestras de la pila del hilo del event loop mientras
+    haya al menos un perfil activo
+    """
+
+    def __init__(self):
+        self.activos: List[Perfil] = []
+        self.lock = threading.Lock()
+        self.hilo: Optional[threading.Thread] = None
+        self.hilo_loop: Optional[int] = None
+
+    def iniciar(self, perfil: Perfil):
+        with self.lock:
+            self.hilo_loop = threading.get_ident()
+            self.activos.append(perfil)
+            if self.hilo is None or not self.hilo.is_alive():
+                self.hilo = threading.Thread(target=self.bucle, name="perfilador", daemon=True)
+                self.hilo.start()
+
+    def detener(self, perfil: Perfil):
+        with self.lock:
+            if perfil in self.activos:
+                self.activos.remove(perfil)
+
+    def bucle(self):
+        intervalo = PROFILER_INTERVAL_MS / 1000
+        while True:
+            time.sleep(intervalo)
+            with self.lock:
+                if not self.activos:
+                    self.hilo = None
+                    return
+                activos = list(self.activos)
+                frame = sys._current_frames().get(self.hilo_loop)
+            if frame is None:
+                continue
+            pila = pila_colapsada(frame)
+            for perfil in activos:
+                perfil.pilas[pila] += 1
+                perfil.muestras += 1
+
+
+def pila_colapsada(frame) -> str:
+    partes = []
+    while frame is not None and len(partes) < PROFILER_MAX_DEPTH:
+        code = frame.f_code
+        partes.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(partes))
+
+
+muestreador = Muestreador()
+
+
+def motivo_perfilado(headers: Headers) -> Optional[str]:
+    token = headers.get("x-profile")
+    if token and PROFILER_ADMIN_TOKEN and hmac.compare_digest(token, PROFILER_ADMIN_TOKEN):
+        return "header"
+    if PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE:
+        return "muestreo"
+    return None
+
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/admin/profiles"):
+            await self.app(scope, receive, send)
+            return
+
+        motivo = motivo_perfilado(Headers(scope=scope))
+        if not motivo:
+            await self.app(scope, receive, send)
+            return
+
+        perfil = Perfil(scope["method"], scope["path"], motivo)
+
+        async def send_con_perfil(message):
+            if message["type"] == "http.response.start":
+                perfil.status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", perfil.id.encode())]
+            await send(message)
+
+        token = perfil_actual.set(perfil)
+        muestreador.iniciar(perfil)
+        try:
+            await self.app(scope, receive, send_con_perfil)
+        finally:
+            muestreador.detener(perfil)
+            perfil_actual.reset(token)
+            perfil.duracion_ms = round((time.perf_counter() - perfil.inicio) * 1000, 2)
+            perfiles_recientes.append(perfil)
@@ -0,0 +1,249 @@
+"""
+Enrutamiento de lecturas a secundarios con garantía de leer lo propio.
+
+Cada ruta de lectura tiene una clave (ej. "diagnostics.list") con su read
+preference, configurable con READ_PREFERENCE_ROUTES:
+
+    READ_PREFERENCE_ROUTES="diagnostics.list=secondaryPreferred,diagnostics.get=primary"
+
+Las escrituras de un profesional se hacen en una sesión causalmente
+consistente y se guarda su operationTime; las lecturas de ese profesional
+abren otra sesión causal adelantada a esa marca, así un secundario espera a
+tener el diagnóstico recién creado antes de responder.
+
+La marca se guarda en memoria del worker y además se devuelve firmada en el
+header X-Causal-Token; el cliente la reenvía en sus peticiones siguientes y
+cualquier worker la usa, sin depender de afinidad de sesión.
+
+Prueba contra un replica set local de tres nodos (desde Backend/):
+
+    mongod --replSet rs0 --port 27017 --dbpath /tmp/rs0-0 &
+    mongod --replSet rs0 --port 27018 --dbpath /tmp/rs0-1 &
+    mongod --replSet rs0 --port 27019 --dbpath /tmp/rs0-2 &
+    mongosh --port 27017 --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"},
+        {_id: 2, host: "localhost:27019"}]})'
+    MONGODB_URI="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0" \\
+        python -m app.core.read_routing
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple, Any
+
+import bson
+from starlette.datastructures import Headers
+
+from pymongo.read_preferences import (
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+    Nearest,
+)
+
+from app.core.database import client
+from app.core.security import SECRET_KEY
+
+PREFERENCIAS = {
+    "primary": Primary(),
+    "primaryPreferred": PrimaryPreferred(),
+    "secondary": Secondary(),
+    "secondaryPreferred": SecondaryPreferred(),
+    "nearest": Nearest(),
+}
+
+# Listados e historiales van a secundarios; el historial que alimenta al
+# agente en /agent/chat se sigue leyendo del primario. El profesional
+# autenticado también: justo después del registro un secundario puede no
+# tenerlo todavía
+RUTAS_POR_DEFECTO = {
+    "auth.current_user": "primary",
+    "diagnostics.list": "secondaryPreferred",
+    "diagnostics.get": "secondaryPreferred",
+    "agent.session": "secondaryPreferred",
+    "agent.chat": "primary",
+    "clients.search": "secondaryPreferred",
+    "analytics.rollups": "secondaryPreferred",
+    "reports.get": "secondaryPreferred",
+}
+
+MAX_MARCAS = int(os.getenv("READ_ROUTING_MAX_MARKS", "10000"))
+CABECERA_MARCA = "x-causal-token"
+
+
+def cargar_rutas() -> Dict[str, str]:
+    rutas = dict(RUTAS_POR_DEFECTO)
+    for par in os.getenv("READ_PREFERENCE_ROUTES", "").split(","):
+        if "=" not in par:
+            continue
+        ruta, modo = (p.strip() for p in par.split("=", 1))
+        if modo not in PREFERENCIAS:
+            raise RuntimeError(f"Read preference inválida para {ruta}: {modo}")
+        rutas[ruta] = modo
+    return rutas
+
+
+RUTAS_LECTURA = cargar_rutas()
+
+
+def coleccion_para(collection, ruta: str):
+    """
+    Devuelve la colección con la read preference configurada para la ruta
+    """
+    modo = RUTAS_LECTURA.get(ruta, "primary")
+    return collection.with_options(read_preference=PREFERENCIAS[modo])
+
+
+# professional_id -> (cluster_time, operation_time) de su última escritura
+marcas_escritura: "OrderedDict[str, Tuple[Optional[Dict[str, Any]], Any]]" = OrderedDict()
+
+
+# Marca que trajo el cliente y marca nueva a devolverle, por petición
+marca_peticion: ContextVar[Optional[Dict[str, Any]]] = ContextVar("marca_peticion", default=None)
+
+
+def firmar(datos: bytes) -> bytes:
+    return hmac.new(SECRET_KEY.encode("utf-8"), datos, hashlib.sha256).digest()[:16]
+
+
+def codificar_marca(professional_id: str, cluster_time, operation_time) -> str:
+    datos = bson.encode({"p": professional_id, "c": cluster_time, "o": operation_time})
+    return base64.urlsafe_b64encode(firmar(datos) + datos).decode("ascii")
+
+
+def decodificar_marca(token: str) -> Optional[Dict[str, Any]]:
+    """
+    Marca enviada por el cliente; None si está mal formada o la firma no
+    coincide (un cliente no puede inventar marcas)
+    """
+    try:
+        crudo = base64.urlsafe_b64decode(token.encode("ascii"))
+        firma, datos = crudo[:16], crudo[16:]
+        if not hmac.compare_digest(firma, firmar(datos)):
+            return None
+        return bson.decode(datos)
+    except (ValueError, binascii.Error, bson.errors.BSONError):
+        return None
+
+
+def registrar_marca(professional_id: str, session):
+    if session.operation_time is None:
+        # Servidor standalone: no hay tiempos de clúster que propagar
+        return
+    marcas_escritura[professional_id] = (session.cluster_time, session.operation_time)
+    marcas_escritura.move_to_end(professional_id)
+    while len(marcas_escritura) > MAX_MARCAS:
+        marcas_escritura.popitem(last=False)
+
+    estado = marca_peticion.get()
+    if estado is not None:
+        estado["saliente"] = codificar_marca(professional_id, session.cluster_time, session.operation_time)
+
+
+@asynccontextmanager
+async def sesion_escritura(professional_id: str):
+    """
+    Sesión causal para las escrituras de un profesional; al cerrar guarda
+    su operationTime para las lecturas siguientes
+    """
+    async with await client.start_session(causal_consistency=True) as session:
+        try:
+            yield session
+        finally:
+            registrar_marca(professional_id, session)
+
+
+@asynccontextmanager
+async def sesion_lectura(professional_id: str):
+    """
+    Sesión causal para lecturas, adelantada a la última escritura conocida
+    del profesional
+    """
+    async with await client.start_session(causal_consistency=True) as session:
+        marcas = [marcas_escritura.get(professional_id)]
+        estado = marca_peticion.get()
+        entrante = estado and estado.get("entrante")
+        if entrante and entrante.get("p") == professional_id:
+            marcas.append((entrante.get("c"), entrante["o"]))
+        # La sesión se queda con la más reciente de ambas
+        for marca in marcas:
+            if marca:
+                cluster_time, operation_time = marca
+                if cluster_time:
+                    session.advance_cluster_time(cluster_time)
+                session.advance_operation_time(operation_time)
+        yield session
+
+
+class MarcaCausalMiddleware:
+    """
+    Lee la marca que reenvía el cliente (X-Causal-Token) y devuelve la de
+    la última escritura hecha en la petición
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        token = Headers(scope=scope).get(CABECERA_MARCA)
+        estado = {"entrante": decodificar_marca(token) if token else None, "saliente": None}
+
+        async def send_con_marca(message):
+            if message["type"] == "http.response.start" and estado["saliente"]:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (CABECERA_MARCA.encode(), estado["saliente"].encode())
+                ]
+            await send(message)
+
+        reset = marca_peticion.set(estado)
+        try:
+            await self.app(scope, receive, send_con_marca)
+        finally:
+            marca_peticion.reset(reset)
+
+
+async def verificar_replica_set(iteraciones: int = 200):
+    """
+    Escribe y relee desde secundarios con y sin sesión causal, y cuenta
+    cuántas lecturas no vieron la escritura recién hecha
+    """
+    from bson import ObjectId
+    from app.core.database import db
+
+    coleccion = db["read_routing_check"]
+    secundaria = coleccion.with_options(read_preference=PREFERENCIAS["secondary"])
+    professional_id = str(ObjectId())
+    obsoletas_sin_sesion = obsoletas_causal = 0
+
+    for i in range(iteraciones):
+        async with sesion_escritura(professional_id) as session:
+            result = await coleccion.insert_one({"i": i}, session=session)
+
+        if not await secundaria.find_one({"_id": result.inserted_id}):
+            obsoletas_sin_sesion += 1
+
+        async with sesion_escritura(professional_id) as session:
+            result = await coleccion.insert_one({"i": i}, session=session)
+
+        async with sesion_lectura(professional_id) as session:
+            if not await secundaria.find_one({"_id": result.inserted_id}, session=session):
+                obsoletas_causal += 1
+
+    await coleccion.drop()
+    print(f"Lecturas obsoletas sin sesión causal: {obsoletas_sin_sesion}/{iteraciones}")
+    print(f"Lecturas obsoletas con sesión causal: {obsoletas_causal}/{iteraciones}")
+
+
+if __name__ == "__main__":
+    import asyncio
+    asyncio.run(verificar_replica_set())
@@ -0,0 +1,40 @@
+import re
+import unicodedata
+
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Pasa el texto a minúsculas y le quita tildes y espacios sobrantes
+    """
+    sin_tildes = unicodedata.normalize("NFKD", texto or "")
+    sin_tildes = "".join(c for c in sin_tildes if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", sin_tildes.lower()).strip()
+
+
+def slug(texto: str, max_len: int = 40) -> str:
+    """
+    Convierte un texto libre en una clave segura para campos de MongoDB
+    (sin puntos ni '$')
+    """
+    clave = re.sub(r"[^a-z0-9]+", "_", normalizar_texto(texto)).strip("_")
+    return clave[:max_len] or "sin_dato"
+
+
+# Palabras vacías en español que no aportan a búsquedas ni comparaciones
+STOPWORDS_ES = {
+    "a", "al", "algo", "como", "con", "cual", "cuando", "de", "del", "donde",
+    "el", "ella", "en", "es", "esta", "este", "esto", "hay", "la", "las", "le",
+    "les", "lo", "los", "me", "mi", "mis", "muy", "no", "o", "para", "pero",
+    "por", "que", "se", "si", "sin", "sobre", "su", "sus", "te", "tengo",
+    "tiene", "tu", "tus", "un", "una", "uno", "y", "ya", "yo",
+}
+
+
+def tokenizar(texto: str, quitar_stopwords: bool = True) -> list[str]:
+    """
+    Separa un texto normalizado en palabras (sin tildes ni signos)
+    """
+    palabras = re.findall(r"[a-z0-9]+", normalizar_texto(texto))
+    if quitar_stopwords:
+        palabras = [p for p in palabras if p not in STOPWORDS_ES]
+    return palabras
@@ -0,0 +1,348 @@
+"""
+Modo diferido de diagnósticos con la Batch API de OpenAI.
+
+Los diagnósticos creados con `?diferido=true` se guardan con el resultado
+del motor de reglas y estado "diferido". Este job los junta en un único
+JSONL, lo envía como lote (a mitad de precio, ventana de 24 h), sondea los
+lotes abiertos y vuelca los resultados en collection_diagnostics.
+
+El cliente de lotes es intercambiable (DIAGNOSTIC_BATCH_CLIENT):
+    openai    Batch API real (files + batches)
+    archivo   stub local en DIAGNOSTIC_BATCH_STUB_DIR: guarda el JSONL de
+              entrada y completa el lote con <id>.output.jsonl si existe,
+              o con respuestas vacías (todas las secciones por reglas)
+
+Uso (desde Backend/):
+    python -m app.diagnostic.batch enviar
+    python -m app.diagnostic.batch sondear
+    python -m app.diagnostic.batch ciclo
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+from app.core.database import collection_diagnostics, collection_batches
+from app.core.llm_routing import elegir
+from app.diagnostic.models import DiagnosticRequest
+from app.diagnostic.controllers import (
+    client as openai_client,
+    mensajes_diagnostico,
+    generar_json_fallback,
+    leer_secciones,
+    seccion_valida,
+    SECCIONES_FALLBACK,
+    ESTADO_DIFERIDO,
+    ESTADO_COMPLETADO,
+    FUENTE_LLM_LOTE,
+    FUENTE_REGLAS,
+)
+
+BATCH_ENABLED = os.getenv("DIAGNOSTIC_BATCH_ENABLED", "false").lower() == "true"
+BATCH_CLIENT = os.getenv("DIAGNOSTIC_BATCH_CLIENT", "openai")
+BATCH_INTERVAL_MINUTES = float(os.getenv("DIAGNOSTIC_BATCH_INTERVAL_MINUTES", "30"))
+BATCH_MIN_SIZE = int(os.getenv("DIAGNOSTIC_BATCH_MIN_SIZE", "1"))
+BATCH_MAX_SIZE = int(os.getenv("DIAGNOSTIC_BATCH_MAX_SIZE", "5000"))
+BATCH_STUB_DIR = os.getenv("DIAGNOSTIC_BATCH_STUB_DIR", "eval/lotes")
+# Una reserva más vieja que esto es de un worker que cayó antes de registrar el lote
+RESERVA_MINUTOS = 60
+
+ESTADOS_TERMINALES = {"completed", "failed", "expired", "cancelled"}
+
+
+# ===== Clientes de lotes =====
+
+class ClienteLotes(ABC):
+    """
+    Interfaz mínima de un proveedor de lotes (un cliente incompleto falla
+    al instanciarse)
+    """
+
+    @abstractmethod
+    async def enviar(self, lineas: List[Dict[str, Any]]) -> str:
+        ...
+
+    @abstractmethod
+    async def estado(self, lote_id: str) -> str:
+        ...
+
+    @abstractmethod
+    async def resultados(self, lote_id: str) -> List[Dict[str, Any]]:
+        ...
+
+
+def leer_jsonl(texto: str) -> List[Dict[str, Any]]:
+    return [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+
+
+def escribir_jsonl(lineas: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(l, ensure_ascii=False) + "\n" for l in lineas).encode("utf-8")
+
+
+class ClienteLotesOpenAI(ClienteLotes):
+    def __init__(self, client=None):
+        self.client = client or openai_client
+
+    async def enviar(self, lineas):
+        archivo = await self.client.files.create(
+            file=("diagnosticos.jsonl", io.BytesIO(escribir_jsonl(lineas))),
+            purpose="batch",
+        )
+        lote = await self.client.batches.create(
+            input_file_id=archivo.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return lote.id
+
+    async def estado(self, lote_id):
+        return (await self.client.batches.retrieve(lote_id)).status
+
+    async def resultados(self, lote_id):
+        lote = await self.client.batches.retrieve(lote_id)
+        lineas = []
+        # Las peticiones fallidas van a error_file; ambas usan el mismo formato
+        for archivo_id in (lote.output_file_id, lote.error_file_id):
+            if archivo_id:
+                contenido = await self.client.files.content(archivo_id)
+                lineas += leer_jsonl(contenido.text)
+        return lineas
+
+
+class ClienteLotesArchivo(ClienteLotes):
+    """
+    Stub local para pruebas: no llama a ningún servicio
+    """
+
+    def __init__(self, directorio: str = BATCH_STUB_DIR):
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+
+    def ruta(self, lote_id: str, sufijo: str) -> str:
+        return os.path.join(self.directorio, f"{lote_id}.{sufijo}.jsonl")
+
+    async def enviar(self, lineas):
+        lote_id = f"lote_local_{uuid.uuid4().hex[:12]}"
+        with open(self.ruta(lote_id, "input"), "wb") as f:
+            f.write(escribir_jsonl(lineas))
+        return lote_id
+
+    async def estado(self, lote_id):
+        return "completed" if os.path.exists(self.ruta(lote_id, "input")) else "failed"
+
+    async def resultados(self, lote_id):
+        salida = self.ruta(lote_id, "output")
+        if os.path.exists(salida):
+            with open(salida, encoding="utf-8") as f:
+                return leer_jsonl(f.read())
+
+        with open(self.ruta(lote_id, "input"), encoding="utf-8") as f:
+            entrada = leer_jsonl(f.read())
+        return [
+            {
+                "custom_id": linea["custom_id"],
+                "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"content": json.dumps({"secciones": {}})}}],
+                }},
+                "error": None,
+            }
+            for linea in entrada
+        ]
+
+
+def crear_cliente_lotes(tipo: str = BATCH_CLIENT) -> ClienteLotes:
+    if tipo == "archivo":
+        return ClienteLotesArchivo()
+    return ClienteLotesOpenAI()
+
+
+# ===== Envío =====
+
+def linea_lote(d: Dict[str, Any]) -> Dict[str, Any]:
+    diagnostic = DiagnosticRequest(**{campo: d.get(campo) for campo in DiagnosticRequest.model_fields})
+    politica = elegir("diagnostics.create", notas=bool(diagnostic.notas))
+    return {
+        # La versión viaja en el id: un resultado de una versión vieja no pisa una edición
+        "custom_id": f"{d['_id']}:{d.get('version', 1)}",
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            **politica.parametros(),
+            "messages": mensajes_diagnostico(diagnostic),
+            "response_format": {"type": "json_object"},
+        },
+    }
+
+
+async def enviar_lote(cliente: ClienteLotes, minimo: int = BATCH_MIN_SIZE, maximo: int = BATCH_MAX_SIZE) -> Optional[str]:
+    """
+    Reserva los diagnósticos diferidos sin lote, los envía en un JSONL y
+    devuelve el id del lote (None si no hay suficientes)
+    """
+    await collection_diagnostics.update_many(
+        {
+            "estado": ESTADO_DIFERIDO,
+            "lote_id": {"$regex": "^reserva:"},
+            "lote_reservado_at": {"$lt": datetime.utcnow() - timedelta(minutes=RESERVA_MINUTOS)},
+        },
+        {"$unset": {"lote_id": "", "lote_reservado_at": ""}},
+    )
+
+    filtro = {"estado": ESTADO_DIFERIDO, "lote_id": {"$exists": False}}
+    if await collection_diagnostics.count_documents(filtro, limit=minimo) < minimo:
+        return None
+
+    # Reserva con un id propio para que dos workers no envíen lo mismo
+    reserva = f"reserva:{uuid.uuid4().hex}"
+    ids = [d["_id"] async for d in collection_diagnostics.find(filtro, {"_id": 1}).limit(maximo)]
+    await collection_diagnostics.update_many({**filtro, "_id": {"$in": ids}}, {"$set": {"lote_id": reserva, "lote_reservado_at": datetime.utcnow()}})
+
+    docs = await collection_diagnostics.find({"lote_id": reserva}).to_list(length=None)
+    if not docs:
+        return None
+
+    try:
+        lote_id = await cliente.enviar([linea_lote(d) for d in docs])
+    except Exception:
+        await collection_diagnostics.update_many({"lote_id": reserva}, {"$unset": {"lote_id": ""}})
+        raise
+
+    await collection_batches.insert_one({
+        "_id": lote_id,
+        "estado": "validating",
+        "total": len(docs),
+        "proveedor": type(cliente).__name__,
+        "created_at": datetime.utcnow(),
+    })
+    await collection_diagnostics.update_many({"lote_id": reserva}, {"$set": {"lote_id": lote_id}})
+    return lote_id
+
+
+# ===== Sondeo y fusión =====
+
+def contenido_de(linea: Dict[str, Any]) -> Optional[str]:
+    respuesta = linea.get("response") or {}
+    if linea.get("error") or respuesta.get("status_code") != 200:
+        return None
+    try:
+        return respuesta["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def combinar_resultado(contenido: Optional[str], diagnostic: DiagnosticRequest) -> Optional[str]:
+    """
+    Secciones del LLM que tengan la estructura esperada, completando las
+    que falten con el motor de reglas. None si la respuesta no sirve o no
+    trae ninguna sección válida (el resultado sería solo de reglas).
+    """
+    secciones = leer_secciones(contenido) if contenido else None
+    if not secciones or not any(seccion_valida(secciones.get(clave)) for clave in SECCIONES_FALLBACK):
+        return None
+    return json.dumps({
+        "secciones": {
+            clave: secciones[clave] if seccion_valida(secciones.get(clave)) else construir(diagnostic)
+            for clave, construir in SECCIONES_FALLBACK.items()
+        }
+    }, ensure_ascii=False)
+
+
+async def fusionar_linea(linea: Dict[str, Any], lote_id: str) -> str:
+    diagnostic_id, _, version = linea["custom_id"].partition(":")
+    d = await collection_diagnostics.find_one({"_id": ObjectId(diagnostic_id), "lote_id": lote_id})
+    if not d or d.get("estado") != ESTADO_DIFERIDO:
+        return "omitido"
+
+    if d.get("version", 1) != int(version):
+        # Se editó mientras esperaba el lote: la respuesta es de otra versión,
+        # así que vuelve a la cola para que el próximo lote use la edición
+        await collection_diagnostics.update_one(
+            {"_id": d["_id"], "version": d.get("version"), "estado": ESTADO_DIFERIDO, "lote_id": lote_id},
+            {"$unset": {"lote_id": ""}, "$set": {"updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+        )
+        return "editado"
+
+    diagnostic = DiagnosticRequest(**{campo: d.get(campo) for campo in DiagnosticRequest.model_fields})
+    resultado = combinar_resultado(contenido_de(linea), diagnostic)
+    cambios = {"estado": ESTADO_COMPLETADO, "updated_at": datetime.utcnow()}
+    if resultado:
+        cambios.update(resultado_agente=resultado, fuente=FUENTE_LLM_LOTE)
+    else:
+        cambios.update(resultado_agente=d.get("resultado_agente") or generar_json_fallback(diagnostic), fuente=FUENTE_REGLAS)
+
+    result = await collection_diagnostics.update_one(
+        {"_id": d["_id"], "version": d.get("version"), "estado": ESTADO_DIFERIDO},
+        {"$set": cambios, "$inc": {"version": 1}},
+    )
+    if not result.modified_count:
+        return "editado"
+    return "llm" if resultado else "reglas"
+
+
+async def sondear_lotes(cliente: ClienteLotes) -> Dict[str, int]:
+    """
+    Revisa los lotes abiertos y fusiona los terminados. Los diagnósticos
+    sin resultado de un lote fallido o vencido vuelven a la cola.
+    """
+    conteo = {"lotes_cerrados": 0, "llm": 0, "reglas": 0, "editado": 0, "omitido": 0, "reencolados": 0}
+    async for lote in collection_batches.find({"estado": {"$nin": list(ESTADOS_TERMINALES)}}):
+        estado = await cliente.estado(lote["_id"])
+        if estado not in ESTADOS_TERMINALES:
+            await collection_batches.update_one({"_id": lote["_id"]}, {"$set": {"estado": estado}})
+            continue
+
+        if estado in ("completed", "expired"):
+            # Un lote vencido puede traer resultados parciales
+            for linea in await cliente.resultados(lote["_id"]):
+                conteo[await fusionar_linea(linea, lote["_id"])] += 1
+
+        result = await collection_diagnostics.update_many(
+            {"lote_id": lote["_id"], "estado": ESTADO_DIFERIDO}, {"$unset": {"lote_id": ""}}
+        )
+        conteo["reencolados"] += result.modified_count
+        conteo["lotes_cerrados"] += 1
+        await collection_batches.update_one(
+            {"_id": lote["_id"]},
+            {"$set": {"estado": estado, "cerrado_at": datetime.utcnow()}},
+        )
+    return conteo
+
+
+async def ciclo(cliente: ClienteLotes) -> Dict[str, Any]:
+    return {"resultado_sondeo": await sondear_lotes(cliente), "lote_enviado": await enviar_lote(cliente)}
+
+
+async def job_lotes():
+    """
+    Bucle de fondo: cada DIAGNOSTIC_BATCH_INTERVAL_MINUTES sondea los lotes
+    abiertos y envía los diagnósticos diferidos acumulados
+    """
+    cliente = crear_cliente_lotes()
+    while True:
+        try:
+            print("Lotes de diagnósticos:", await ciclo(cliente))
+        except Exception as e:
+            print("Error en el job de lotes de diagnósticos:", e)
+        await asyncio.sleep(BATCH_INTERVAL_MINUTES * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lotes diferidos de diagnósticos")
+    parser.add_argument("accion", choices=["enviar", "sondear", "ciclo"])
+    parser.add_argument("--cliente", choices=["openai", "archivo"], default=BATCH_CLIENT)
+    args = parser.parse_args()
+
+    cliente = crear_cliente_lotes(args.cliente)
+    if args.accion == "enviar":
+        print("Lote enviado:", asyncio.run(enviar_lote(cliente)))
+    elif args.accion == "sondear":
+        print(asyncio.run(sondear_lotes(cliente)))
+    else:
+        print(asyncio.run(ciclo(cliente)))
@@ -1,27 +1,66 @@
 import os
 import json
-from datetime import datetime
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
 from fastapi import HTTPException
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 from app.core.database import collection_diagnostics
-from app.diagnostic.models import DiagnosticRequest, DiagnosticResponse
+from app.core.read_routing import sesion_escritura
+from app.core.profiling import span
+from app.core.llm_routing import elegir, medir
+from app.diagnostic.models import DiagnosticRequest, DiagnosticResponse, DiagnosticUpdate, DiagnosticUpdateResponse
 from app.diagnostic.prompts.diagnostic_prompt import RIZOTIPO_DIAGNOSTIC_PROMPT
+from app.diagnostic.generacion import (
+    cliente_openai,
+    generar_resultado_llm,
+    mensajes_diagnostico,
+    construir_mensaje_diagnostico,
+    leer_secciones,
+    seccion_valida,
+    generar_json_fallback,
+    SECCIONES_FALLBACK,
+    DEPENDENCIAS_SECCIONES,
+    FUENTE_LLM,
+    FUENTE_REGLAS,
+    FUENTE_REGLAS_DEADLINE,
+    FUENTE_LLM_LOTE,
+    FUENTE_MIXTA,
+)
+from app.analytics.controllers import registrar_diagnostico_en_rollup, ajustar_rollup
+from app.clients.controllers import upsert_client, descontar_diagnostico_cliente
 
 # Configurar OpenAI
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+client = cliente_openai()
 
+# Presupuesto de tokens por sección al regenerar parcialmente (800 / 5)
+TOKENS_POR_SECCION = int(os.getenv("DIAGNOSTIC_TOKENS_PER_SECTION", "160"))
 
-async def create_diagnostic_controller(diagnostic: DiagnosticRequest, professional_id: str) -> DiagnosticResponse:
-    """
-    Crea un diagnóstico: guarda en MongoDB y genera el resultado con OpenAI
-    """
-    # Guardar datos iniciales
-    new_diag = {
+ESTADO_PENDIENTE = "pendiente"
+ESTADO_COMPLETADO = "completado"
+ESTADO_DIFERIDO = "diferido"  # resultado del motor de reglas, el LLM llega por lote
+# Un diagnóstico pendiente más antiguo que esto se considera abandonado
+PENDIENTE_MINUTOS = int(os.getenv("DIAGNOSTIC_PENDING_MINUTES", "5"))
+RECUPERACION_INTERVALO_MINUTOS = float(os.getenv("DIAGNOSTIC_RECOVERY_INTERVAL_MINUTES", str(PENDIENTE_MINUTOS)))
+
+# SLO de latencia: pasado este tiempo se responde con el motor de reglas
+DEADLINE_SEGUNDOS = float(os.getenv("DIAGNOSTIC_DEADLINE_SECONDS", "10"))
+# Si el LLM responde después del deadline, mejorar el resultado guardado
+MEJORAR_EN_SEGUNDO_PLANO = os.getenv("DIAGNOSTIC_UPGRADE_IN_BACKGROUND", "true").lower() == "true"
+
+
+# Referencias a las mejoras en curso para que no las recoja el GC
+tareas_mejora: set = set()
+
+
+def documento_inicial(diagnostic: DiagnosticRequest, professional_id: str, estado: str) -> Dict[str, Any]:
+    return {
+        "_id": ObjectId(),
         "professional_id": ObjectId(professional_id),
         "nombre": diagnostic.nombre,
         "whatsapp": diagnostic.whatsapp,
@@ -35,155 +74,475 @@ async def create_diagnostic_controller(diagnostic: DiagnosticRequest, profession
         "textura": diagnostic.textura,
         "notas": diagnostic.notas,
         "created_at": datetime.utcnow(),
+        "estado": estado,
+        "version": 1,
+        # Si ya se sumó al cliente y a los rollups (la recuperación lo necesita)
+        "contabilizado": False,
     }
 
-    result = await collection_diagnostics.insert_one(new_diag)
 
-    # Construir mensaje para OpenAI
-    user_message = f"""
-    Cliente: {diagnostic.nombre}
-    WhatsApp: {diagnostic.whatsapp}
-    Correo: {diagnostic.correo}
+async def contabilizar(d: Dict[str, Any], db_session=None) -> ObjectId:
+    """
+    Suma el diagnóstico a su cliente (deduplicado) y a los rollups de
+    analítica. Si la segunda escritura falla se deshace la primera.
+    Devuelve el _id del cliente. Con `db_session` ambas escrituras quedan
+    en la sesión causal del profesional; van una tras otra porque una
+    sesión no admite operaciones concurrentes.
+    """
+    client_id = await upsert_client(
+        str(d["professional_id"]), d["nombre"], d["whatsapp"], d["correo"], db_session=db_session
+    )
+    try:
+        await registrar_diagnostico_en_rollup(d, db_session=db_session)
+    except Exception:
+        await descontar(d, client_id, rollup=False, db_session=db_session)
+        raise
+    return client_id
 
-    Respuestas del diagnóstico:
-    - Plasticidad: {diagnostic.plasticidad}
-    - Permeabilidad: {diagnostic.permeabilidad}
-    - Densidad: {diagnostic.densidad}
-    - Porosidad: {diagnostic.porosidad}
-    - Oleosidad: {diagnostic.oleosidad}
-    - Grosor: {diagnostic.grosor}
-    - Textura: {diagnostic.textura}
 
-    Notas adicionales: {diagnostic.notas or "N/A"}
+async def descontar(d: Dict[str, Any], client_id: Optional[ObjectId], rollup: bool = True, db_session=None):
+    """
+    Deshace lo que contabilizar alcanzó a registrar
+    """
+    try:
+        if client_id is not None:
+            await descontar_diagnostico_cliente(client_id, db_session)
+        if rollup:
+            await registrar_diagnostico_en_rollup(d, signo=-1, db_session=db_session)
+    except Exception as e:
+        print("No se pudo deshacer el conteo del diagnóstico:", e)
+
 
-    **IMPORTANTE:** Genera SOLO un objeto JSON válido con la estructura del ejemplo, sin texto adicional.
+async def create_diagnostic_controller(diagnostic: DiagnosticRequest, professional_id: str, diferido: bool = False) -> DiagnosticResponse:
     """
+    Crea un diagnóstico: guarda en MongoDB y genera el resultado con OpenAI.
+    La llamada al LLM arranca de inmediato, en paralelo con las escrituras
+    iniciales (registro "pendiente", luego cliente y rollups), así la
+    latencia es ≈ max(LLM, DB) + una única actualización final. Si el
+    proceso cae a mitad de camino queda el registro pendiente, que recupera
+    recuperar_diagnosticos_pendientes.
+    Si el LLM falla o no responde antes del deadline se responde con el
+    motor de reglas. Con `diferido` el LLM se pide después en un lote.
+    """
+    if diferido:
+        return await crear_diagnostico_diferido(diagnostic, professional_id)
 
-    try:
-        # Enviar a OpenAI
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": RIZOTIPO_DIAGNOSTIC_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=800,
-            temperature=0.7,
-            response_format={"type": "json_object"}  # Esto fuerza a OpenAI a devolver JSON
-        )
-        
-        resultado_agente = response.choices[0].message.content
-        
-        # Validar que sea JSON válido
+    inicio = time.monotonic()
+    llm_task = asyncio.create_task(generar_resultado_llm(diagnostic))
+
+    # Guardar datos iniciales
+    new_diag = documento_inicial(diagnostic, professional_id, ESTADO_PENDIENTE)
+
+    # Las escrituras van en una sesión causal para que las lecturas en
+    # secundarios del profesional vean este diagnóstico
+    async with sesion_escritura(professional_id) as session:
+        # Primero el registro: si falla no se cuenta un diagnóstico inexistente
+        client_id = None
         try:
-            json.loads(resultado_agente)
-        except json.JSONDecodeError:
-            # Si no es JSON válido, crear uno manualmente con los datos
-            resultado_agente = generar_json_fallback(diagnostic)
+            await collection_diagnostics.insert_one(new_diag, session=session)
+            client_id = await contabilizar(new_diag, session)
+            # Marcarlo enseguida para que la recuperación no lo cuente otra vez
+            await collection_diagnostics.update_one(
+                {"_id": new_diag["_id"]},
+                {"$set": {"client_id": client_id, "contabilizado": True}},
+                session=session
+            )
+        except Exception as e:
+            llm_task.cancel()
+            if client_id is not None:
+                await descontar(new_diag, client_id, db_session=session)
+            try:
+                await collection_diagnostics.delete_one({"_id": new_diag["_id"]}, session=session)
+            except Exception as e_borrado:
+                print("No se pudo eliminar el diagnóstico incompleto:", e_borrado)
+            raise HTTPException(status_code=500, detail=f"Error al guardar diagnóstico: {str(e)}")
 
-        # Guardar respuesta en la DB
-        await collection_diagnostics.update_one(
-            {"_id": result.inserted_id},
-            {"$set": {"resultado_agente": resultado_agente}}
+        restante = max(DEADLINE_SEGUNDOS - (time.monotonic() - inicio), 0)
+        try:
+            # shield: si vence el deadline la llamada al LLM sigue viva
+            resultado_agente, fuente = await asyncio.wait_for(asyncio.shield(llm_task), timeout=restante)
+        except asyncio.TimeoutError:
+            resultado_agente, fuente = generar_json_fallback(diagnostic), FUENTE_REGLAS_DEADLINE
+        except Exception as e:
+            print("Error al generar diagnóstico con OpenAI, usando motor de reglas:", e)
+            resultado_agente, fuente = generar_json_fallback(diagnostic), FUENTE_REGLAS
+
+        # Única escritura final: resultado + vínculo al cliente. Solo si el
+        # registro sigue pendiente y sin tocar (la recuperación pudo completarlo)
+        result = await collection_diagnostics.update_one(
+            {"_id": new_diag["_id"], "estado": ESTADO_PENDIENTE, "version": 1},
+            {
+                "$set": {
+                    "client_id": client_id,
+                    "resultado_agente": resultado_agente,
+                    "fuente": fuente,
+                    "estado": ESTADO_COMPLETADO,
+                },
+                "$inc": {"version": 1},
+            },
+            session=session
         )
+        if result.matched_count == 0:
+            llm_task.cancel()
+            guardado = await collection_diagnostics.find_one({"_id": new_diag["_id"]}, session=session)
+            if not guardado:
+                raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+            return documento_a_respuesta(guardado)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al generar diagnóstico: {str(e)}")
+    if fuente == FUENTE_REGLAS_DEADLINE:
+        if MEJORAR_EN_SEGUNDO_PLANO:
+            tarea = asyncio.create_task(mejorar_resultado(new_diag["_id"], new_diag["version"] + 1, llm_task))
+            tareas_mejora.add(tarea)
+            tarea.add_done_callback(tareas_mejora.discard)
+        else:
+            llm_task.cancel()
 
     # Retornar respuesta
     return DiagnosticResponse(
-        id=str(result.inserted_id),
+        id=str(new_diag["_id"]),
         professional_id=str(professional_id),
+        client_id=str(client_id),
         **diagnostic.dict(),
         created_at=new_diag["created_at"],
+        version=new_diag["version"] + 1,
+        estado=ESTADO_COMPLETADO,
+        fuente=fuente,
         resultado_agente=resultado_agente
     )
 
 
-def generar_json_fallback(diagnostic: DiagnosticRequest) -> str:
-    """
-    Genera un JSON de fallback si OpenAI no devuelve un JSON válido
-    """
-    # Determinar técnica de lavado basada en oleosidad
-    oleosidad_lower = diagnostic.oleosidad.lower()
-    if "alta" in oleosidad_lower or "rapido" in oleosidad_lower or "diario" in oleosidad_lower:
-        tecnica_lavado = "Tecnica CO-POO"
-        instrucciones_lavado = [
-            "Acondicionador en medios y puntas",
-            "Shampoo en raiz",
-            "Enjuagar sin repetir acondicionador",
-            "Frecuencia: diario o dia de por medio"
-        ]
-    else:
-        tecnica_lavado = "Tecnica ASA"
-        instrucciones_lavado = [
-            "Aplicar acondicionante",
-            "Shampoo en raiz dos veces", 
-            "Acondicionador en medios y puntas",
-            "Frecuencia: cada 3-4 dias"
-        ]
-
-    # Determinar tratamientos basados en plasticidad
-    plasticidad_lower = diagnostic.plasticidad.lower()
-    if "baja" in plasticidad_lower or "no" in plasticidad_lower:
-        tratamientos_plasticidad = "Pre-lavado obligatorio: mascarilla + crema 3 en 1 + aceite + Leavein 15 min antes de lavar"
-    else:
-        tratamientos_plasticidad = "Mascarillas despues del shampoo, peinar 5-10 veces"
-
-    # Determinar técnicas de definición basadas en textura
-    textura_lower = diagnostic.textura.lower()
-    if "ondulado" in textura_lower:
-        definicion = "Praying hands + scrunch intensivo, Gel en dos momentos"
-    elif "afro" in textura_lower:
-        definicion = "Pre-lavado obligatorio, Definicion rizo a rizo con Leavein + gel, Mantener cabello muy mojado"
-    else:
-        definicion = "Definicion con cepillo por lineas, Rizo a rizo en coronilla y contornos"
-
-    json_resultado = {
-        "secciones": {
-            "A": {
-                "titulo": "Resultados del Diagnostico",
-                "contenido": [
-                    f"Plasticidad: {diagnostic.plasticidad}",
-                    f"Permeabilidad: {diagnostic.permeabilidad}",
-                    f"Densidad: {diagnostic.densidad}",
-                    f"Porosidad: {diagnostic.porosidad}",
-                    f"Oleosidad: {diagnostic.oleosidad}",
-                    f"Grosor: {diagnostic.grosor}",
-                    f"Textura: {diagnostic.textura}"
-                ]
-            },
-            "B": {
-                "titulo": "Recomendaciones de Lavado",
-                "contenido": [
-                    tecnica_lavado,
-                    *instrucciones_lavado,
-                    "Detox capilar mensual con shampoo Rizos Felices aplicado en cabello seco"
-                ]
-            },
-            "C": {
-                "titulo": "Tratamientos",
-                "contenido": [
-                    tratamientos_plasticidad,
-                    "Lavado normal",
-                    "Tratamientos nutritivos y fortalecedores"
-                ]
+async def crear_diagnostico_diferido(diagnostic: DiagnosticRequest, professional_id: str) -> DiagnosticResponse:
+    """
+    Guarda el diagnóstico con el resultado del motor de reglas y lo deja
+    marcado para el próximo lote de OpenAI (app.diagnostic.batch)
+    """
+    new_diag = documento_inicial(diagnostic, professional_id, ESTADO_DIFERIDO)
+    new_diag.update(resultado_agente=generar_json_fallback(diagnostic), fuente=FUENTE_REGLAS)
+
+    async with sesion_escritura(professional_id) as session:
+        try:
+            client_id = await contabilizar(new_diag, session)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al guardar diagnóstico: {str(e)}")
+
+        new_diag.update(client_id=client_id, contabilizado=True)
+        try:
+            await collection_diagnostics.insert_one(new_diag, session=session)
+        except Exception as e:
+            await descontar(new_diag, client_id, db_session=session)
+            raise HTTPException(status_code=500, detail=f"Error al guardar diagnóstico: {str(e)}")
+
+    return documento_a_respuesta(new_diag)
+
+
+async def mejorar_resultado(diagnostic_id: ObjectId, version: int, llm_task: asyncio.Task):
+    """
+    Cuando el LLM responde después del deadline, reemplaza el resultado del
+    motor de reglas, salvo que el diagnóstico se haya editado mientras tanto
+    """
+    try:
+        resultado_agente, fuente = await llm_task
+    except Exception as e:
+        print("La respuesta tardía de OpenAI falló, se conserva el motor de reglas:", e)
+        return
+
+    if fuente != FUENTE_LLM:
+        return
+
+    await collection_diagnostics.update_one(
+        {"_id": diagnostic_id, "version": version, "fuente": FUENTE_REGLAS_DEADLINE},
+        {
+            "$set": {
+                "resultado_agente": resultado_agente,
+                "fuente": FUENTE_LLM,
+                "updated_at": datetime.utcnow(),
             },
-            "D": {
-                "titulo": "Definicion y Styling",
-                "contenido": [
-                    definicion,
-                    f"Usar productos adecuados para grosor {diagnostic.grosor}"
-                ]
+            "$inc": {"version": 1},
+        }
+    )
+
+
+async def reclamar_pendiente(limite: datetime) -> Optional[Dict[str, Any]]:
+    """
+    Toma un diagnóstico pendiente abandonado y lo reserva por
+    PENDIENTE_MINUTOS, así un solo worker llama a OpenAI por él. Si ese
+    worker cae, la reserva vence y otro lo retoma.
+    """
+    ahora = datetime.utcnow()
+    return await collection_diagnostics.find_one_and_update(
+        {
+            "estado": ESTADO_PENDIENTE,
+            "created_at": {"$lt": limite},
+            "$or": [{"reclamado_hasta": {"$exists": False}}, {"reclamado_hasta": {"$lt": ahora}}],
+        },
+        {"$set": {"reclamado_hasta": ahora + timedelta(minutes=PENDIENTE_MINUTOS)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def recuperar_diagnostico(d: Dict[str, Any]) -> int:
+    client_id = d.get("client_id")
+    if d.get("contabilizado") is False:
+        # Cayó antes de contarse: se cuenta y se marca de inmediato
+        client_id = await contabilizar(d)
+        await collection_diagnostics.update_one(
+            {"_id": d["_id"]}, {"$set": {"client_id": client_id, "contabilizado": True}}
+        )
+    elif not client_id:
+        # Registros anteriores a "contabilizado": ya se contaron al crearse
+        client_id = await upsert_client(
+            str(d["professional_id"]), d["nombre"], d["whatsapp"], d["correo"], incrementar=False
+        )
+
+    diagnostic = DiagnosticRequest(**{campo: d.get(campo) for campo in DiagnosticRequest.model_fields})
+    try:
+        resultado_agente, fuente = await generar_resultado_llm(diagnostic)
+    except Exception as e:
+        print("Error al recuperar diagnóstico con OpenAI, usando motor de reglas:", e)
+        resultado_agente, fuente = generar_json_fallback(diagnostic), FUENTE_REGLAS
+
+    result = await collection_diagnostics.update_one(
+        {"_id": d["_id"], "estado": ESTADO_PENDIENTE},
+        {
+            "$set": {
+                "client_id": client_id,
+                "resultado_agente": resultado_agente,
+                "fuente": fuente,
+                "estado": ESTADO_COMPLETADO,
             },
-            "E": {
-                "titulo": "Cuidados Extra",
-                "contenido": [
-                    "Dormir con gorro de satin",
-                    "Hacer pina o usar rizo protector durante la noche"
-                ]
-            }
+            "$unset": {"reclamado_hasta": ""},
+            "$inc": {"version": 1},
         }
+    )
+    return result.modified_count
+
+
+async def recuperar_diagnosticos_pendientes(antiguedad_minutos: int = PENDIENTE_MINUTOS) -> int:
+    """
+    Completa los diagnósticos que quedaron "pendientes" porque la petición
+    falló o el proceso se detuvo antes de guardar el resultado.
+    Devuelve cuántos diagnósticos se recuperaron.
+    """
+    limite = datetime.utcnow() - timedelta(minutes=antiguedad_minutos)
+
+    recuperados = 0
+    while True:
+        d = await reclamar_pendiente(limite)
+        if d is None:
+            break
+        try:
+            recuperados += await recuperar_diagnostico(d)
+        except Exception as e:
+            # La reserva vence y se reintenta en la próxima pasada
+            print("Error al recuperar diagnóstico pendiente:", e)
+
+    return recuperados
+
+
+async def job_recuperacion():
+    """
+    Bucle de fondo que recupera los diagnósticos pendientes cada
+    DIAGNOSTIC_RECOVERY_INTERVAL_MINUTES (0: solo una vez al arrancar)
+    """
+    while True:
+        try:
+            recuperados = await recuperar_diagnosticos_pendientes()
+            if recuperados:
+                print("Diagnósticos pendientes recuperados:", recuperados)
+        except Exception as e:
+            print("Error en la recuperación de diagnósticos pendientes:", e)
+        if RECUPERACION_INTERVALO_MINUTOS <= 0:
+            return
+        await asyncio.sleep(RECUPERACION_INTERVALO_MINUTOS * 60)
+
+
+def documento_a_respuesta(d: Dict[str, Any]) -> DiagnosticResponse:
+    """
+    Convierte un documento de MongoDB en DiagnosticResponse
+    """
+    return DiagnosticResponse(
+        id=str(d["_id"]),
+        professional_id=str(d["professional_id"]),
+        client_id=str(d["client_id"]) if d.get("client_id") else None,
+        nombre=d["nombre"],
+        whatsapp=d["whatsapp"],
+        correo=d["correo"],
+        plasticidad=d["plasticidad"],
+        permeabilidad=d["permeabilidad"],
+        densidad=d["densidad"],
+        porosidad=d["porosidad"],
+        oleosidad=d["oleosidad"],
+        grosor=d["grosor"],
+        textura=d["textura"],
+        notas=d.get("notas"),
+        created_at=d["created_at"],
+        updated_at=d.get("updated_at"),
+        version=d.get("version", 1),
+        estado=d.get("estado", ESTADO_COMPLETADO),
+        fuente=d.get("fuente"),
+        fuentes_secciones=d.get("fuentes_secciones"),
+        resultado_agente=d.get("resultado_agente")
+    )
+
+
+async def update_diagnostic_controller(diagnostic_id: str, cambios: DiagnosticUpdate, professional_id: str) -> DiagnosticUpdateResponse:
+    """
+    Corrige componentes de un diagnóstico y regenera solo las secciones
+    del resultado que dependen de ellos
+    """
+    filtro = {"_id": ObjectId(diagnostic_id), "professional_id": ObjectId(professional_id)}
+    actual = await collection_diagnostics.find_one(filtro)
+    if not actual:
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+    if actual.get("estado") == ESTADO_PENDIENTE:
+        # El resultado todavía no se guardó: la escritura final lo pisaría
+        raise HTTPException(status_code=409, detail="El diagnóstico todavía se está generando")
+
+    modificados = {
+        campo: {"antes": actual.get(campo), "despues": valor}
+        for campo, valor in cambios.dict(exclude_unset=True).items()
+        if valor is not None and valor != actual.get(campo)
     }
-    
-    return json.dumps(json_resultado, ensure_ascii=False)
\ No newline at end of file
+    if not modificados:
+        respuesta = documento_a_respuesta(actual)
+        return DiagnosticUpdateResponse(**respuesta.dict(), componentes_modificados=[], secciones_regeneradas=[])
+
+    nuevo = {**actual, **{campo: c["despues"] for campo, c in modificados.items()}}
+    diagnostic = DiagnosticRequest(**{campo: nuevo.get(campo) for campo in DiagnosticRequest.model_fields})
+
+    # Secciones afectadas por los componentes modificados
+    afectadas = [
+        seccion for seccion, campos in DEPENDENCIAS_SECCIONES.items()
+        if any(campo in modificados for campo in campos)
+    ]
+
+    secciones = leer_secciones(actual.get("resultado_agente"))
+    if secciones is None:
+        # No hay un resultado previo utilizable: se regenera completo
+        afectadas = list(DEPENDENCIAS_SECCIONES)
+        secciones = {}
+
+    # La sección A solo lista los valores: se reconstruye sin el LLM
+    regenerar_llm = [s for s in afectadas if s != "A"]
+    nuevas = {"A": SECCIONES_FALLBACK["A"](diagnostic)} if "A" in afectadas else {}
+    con_reglas: List[str] = []
+    if regenerar_llm:
+        regeneradas, con_reglas = await regenerar_secciones(diagnostic, regenerar_llm)
+        nuevas.update(regeneradas)
+    secciones.update(nuevas)
+    resultado_agente = json.dumps({"secciones": dict(sorted(secciones.items()))}, ensure_ascii=False)
+
+    # Origen por sección: las regeneradas por reglas dejan de contar como LLM
+    fuentes = fuentes_por_seccion(actual)
+    fuentes.update({clave: FUENTE_REGLAS if clave in con_reglas else FUENTE_LLM for clave in regenerar_llm})
+    fuente = fuente_global(fuentes)
+
+    ahora = datetime.utcnow()
+    version = actual.get("version", 1)
+    update = {
+        "$set": {
+            **{campo: c["despues"] for campo, c in modificados.items()},
+            "resultado_agente": resultado_agente,
+            "fuente": fuente,
+            "fuentes_secciones": fuentes,
+            "updated_at": ahora,
+            "version": version + 1,
+        },
+        "$push": {"ediciones": {
+            "fecha": ahora,
+            "cambios": modificados,
+            "secciones_regeneradas": afectadas,
+            "secciones_reglas": con_reglas,
+        }},
+    }
+    # Control optimista: si otra edición cambió el documento, no pisarla
+    # (los diagnósticos anteriores a este campo no tienen "version")
+    async with sesion_escritura(professional_id) as session:
+        result = await collection_diagnostics.update_one(
+            {**filtro, "version": actual.get("version")},
+            update,
+            session=session,
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail="El diagnóstico fue modificado por otra petición, intenta de nuevo")
+
+        await ajustar_rollup(actual, nuevo, session)
+
+    nuevo.update(
+        resultado_agente=resultado_agente, fuente=fuente, fuentes_secciones=fuentes,
+        updated_at=ahora, version=version + 1,
+    )
+    respuesta = documento_a_respuesta(nuevo)
+    return DiagnosticUpdateResponse(
+        **respuesta.dict(),
+        componentes_modificados=list(modificados),
+        secciones_regeneradas=afectadas,
+        secciones_reglas=con_reglas,
+    )
+
+
+def fuentes_por_seccion(d: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Origen de cada sección del resultado guardado; si nunca se editó,
+    todas comparten la fuente del diagnóstico
+    """
+    if d.get("fuentes_secciones"):
+        return dict(d["fuentes_secciones"])
+    fuente = d.get("fuente") or FUENTE_LLM
+    if fuente == FUENTE_REGLAS_DEADLINE:
+        fuente = FUENTE_REGLAS
+    return {clave: fuente for clave in SECCIONES_FALLBACK}
+
+
+def fuente_global(fuentes: Dict[str, str]) -> str:
+    # La sección A solo lista los valores (igual por LLM o por reglas): no cuenta
+    valores = {fuente for clave, fuente in fuentes.items() if clave != "A"}
+    if len(valores) == 1:
+        return valores.pop()
+    if FUENTE_REGLAS in valores:
+        return FUENTE_MIXTA
+    return FUENTE_LLM  # secciones del lote y regeneradas en línea: todas del LLM
+
+
+async def regenerar_secciones(diagnostic: DiagnosticRequest, claves: List[str]) -> tuple[Dict[str, Any], List[str]]:
+    """
+    Pide al LLM solo las secciones indicadas. Las que no lleguen o no
+    tengan la estructura esperada se completan con el motor de reglas.
+    Devuelve (secciones, claves completadas con reglas).
+    """
+    user_message = construir_mensaje_diagnostico(diagnostic) + f"""
+    **IMPORTANTE:** Genera SOLO las secciones {", ".join(claves)} del ejemplo, con la misma
+    estructura, como un objeto JSON {{"secciones": {{...}}}} sin texto adicional.
+    """
+
+    regeneradas: Dict[str, Any] = {}
+    politica = elegir(
+        "diagnostics.sections",
+        max_tokens_sugerido=TOKENS_POR_SECCION * len(claves),
+        secciones=len(claves),
+    )
+    try:
+        with span("llm", "secciones"), medir(politica) as medicion:
+            response = await asyncio.wait_for(
+                client.chat.completions.create(
+                    **politica.parametros(),
+                    messages=[
+                        {"role": "system", "content": RIZOTIPO_DIAGNOSTIC_PROMPT},
+                        {"role": "user", "content": user_message}
+                    ],
+                    response_format={"type": "json_object"}
+                ),
+                timeout=DEADLINE_SEGUNDOS,
+            )
+            medicion.usage = response.usage
+        regeneradas = leer_secciones(response.choices[0].message.content) or {}
+    except Exception as e:
+        print("Error al regenerar secciones con OpenAI:", repr(e))
+
+    con_reglas = [clave for clave in claves if not seccion_valida(regeneradas.get(clave))]
+    return {
+        clave: SECCIONES_FALLBACK[clave](diagnostic) if clave in con_reglas else regeneradas[clave]
+        for clave in claves
+    }, con_reglas
+
+
@@ -0,0 +1,364 @@
+"""
+Banco de evaluación offline de la generación de diagnósticos.
+
+Reproduce un corpus anonimizado de DiagnosticRequest a través de
+generar_resultado_llm y mide: tasa de JSON válido, tasa de fallback al
+motor de reglas, tokens, distribución de latencia y adherencia al esquema
+de secciones (A–E con titulo + contenido). Con `--modo grabar` se llama a
+OpenAI y se guardan las respuestas; con `--modo reproducir` se usan las
+respuestas grabadas sin red ni credenciales (un cambio de prompt, modelo o
+parámetros cambia la clave de la llamada, así que hay que grabarlo primero).
+Los casos sin grabación se reportan aparte y no cuentan en las métricas.
+
+Uso (desde Backend/):
+    python -m app.diagnostic.eval exportar --salida eval/corpus.jsonl --limite 200
+    python -m app.diagnostic.eval correr --corpus eval/corpus.jsonl --modo grabar \\
+        --grabaciones eval/grabaciones.jsonl --salida eval/antes.json
+    python -m app.diagnostic.eval correr --corpus eval/corpus.jsonl --modo grabar \\
+        --grabaciones eval/grabaciones.jsonl --model gpt-4o --max-tokens 600 --salida eval/despues.json
+    python -m app.diagnostic.eval comparar eval/antes.json eval/despues.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from app.diagnostic.models import DiagnosticRequest
+from app.diagnostic.generacion import (
+    cliente_openai,
+    generar_resultado_llm,
+    leer_secciones,
+    seccion_valida,
+    SECCIONES_FALLBACK,
+    FUENTE_LLM,
+    FUENTE_REGLAS,
+)
+
+COMPONENTES = ["plasticidad", "permeabilidad", "densidad", "porosidad", "oleosidad", "grosor", "textura"]
+
+RE_CORREO = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+RE_TELEFONO = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+
+
+# ===== Corpus anonimizado =====
+
+def anonimizar(d: Dict[str, Any], i: int) -> Dict[str, Any]:
+    """
+    Conserva los componentes y las notas sin datos de contacto ni nombre
+    """
+    notas = d.get("notas") or None
+    if notas:
+        notas = RE_CORREO.sub("[correo]", notas)
+        notas = RE_TELEFONO.sub("[telefono]", notas)
+        for parte in (d.get("nombre") or "").split():
+            if len(parte) > 2:
+                notas = re.sub(re.escape(parte), "[nombre]", notas, flags=re.IGNORECASE)
+    return {
+        "nombre": f"Cliente {i}",
+        "whatsapp": "0000000000",
+        "correo": f"cliente{i}@anonimo.co",
+        **{c: d.get(c, "") for c in COMPONENTES},
+        "notas": notas,
+    }
+
+
+async def exportar_corpus(salida: str, limite: int) -> int:
+    # Solo exportar necesita MongoDB
+    from app.core.database import collection_diagnostics
+
+    proyeccion = {c: 1 for c in COMPONENTES + ["nombre", "notas"]}
+    cursor = collection_diagnostics.find({}, proyeccion).sort("created_at", -1).limit(limite)
+
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    total = 0
+    with open(salida, "w", encoding="utf-8") as f:
+        async for d in cursor:
+            total += 1
+            f.write(json.dumps(anonimizar(d, total), ensure_ascii=False) + "\n")
+    return total
+
+
+def cargar_corpus(ruta: str) -> List[DiagnosticRequest]:
+    with open(ruta, encoding="utf-8") as f:
+        return [DiagnosticRequest(**json.loads(linea)) for linea in f if linea.strip()]
+
+
+# ===== Clientes de OpenAI para la evaluación =====
+
+def clave_llamada(kwargs: Dict[str, Any]) -> str:
+    datos = {k: kwargs.get(k) for k in ("model", "messages", "max_tokens", "temperature", "response_format")}
+    return hashlib.sha256(json.dumps(datos, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def cargar_grabaciones(ruta: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not ruta or not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return {g["clave"]: g for g in (json.loads(linea) for linea in f if linea.strip())}
+
+
+class GrabacionFaltante(KeyError):
+    """
+    La llamada no tiene respuesta grabada (¿cambió el prompt o el modelo?)
+    """
+
+
+class ClienteGrabado:
+    """
+    Stub con la interfaz de AsyncOpenAI que devuelve respuestas grabadas
+    """
+
+    def __init__(self, grabaciones: Dict[str, Dict[str, Any]], simular_latencia: bool = False):
+        self.grabaciones = grabaciones
+        self.simular_latencia = simular_latencia
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        grabacion = self.grabaciones.get(clave_llamada(kwargs))
+        if grabacion is None:
+            raise GrabacionFaltante("No hay respuesta grabada para esta llamada (¿cambió el prompt o el modelo?)")
+        if self.simular_latencia:
+            await asyncio.sleep(grabacion["latencia_s"])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=grabacion["contenido"]))],
+            usage=SimpleNamespace(**grabacion["usage"]) if grabacion.get("usage") else None,
+            latencia_grabada=grabacion["latencia_s"],
+        )
+
+
+class ClienteMedido:
+    """
+    Envuelve el cliente real o el stub: aplica los parámetros candidatos
+    (modelo, max_tokens, temperatura, prompt de sistema) y registra cada
+    llamada con su contenido crudo, tokens y latencia
+    """
+
+    def __init__(self, interno, overrides: Dict[str, Any], prompt_sistema: Optional[str], grabar: Optional[Dict[str, Any]]):
+        self.interno = interno
+        self.overrides = overrides
+        self.prompt_sistema = prompt_sistema
+        self.grabar = grabar
+        self.llamadas: List[Dict[str, Any]] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        kwargs.update(self.overrides)
+        if self.prompt_sistema is not None:
+            kwargs["messages"] = [
+                {**m, "content": self.prompt_sistema} if m["role"] == "system" else m
+                for m in kwargs["messages"]
+            ]
+
+        inicio = time.perf_counter()
+        response = await self.interno.chat.completions.create(**kwargs)
+        latencia = getattr(response, "latencia_grabada", None) or time.perf_counter() - inicio
+
+        usage = getattr(response, "usage", None)
+        llamada = {
+            "contenido": response.choices[0].message.content,
+            "latencia_s": round(latencia, 4),
+            "usage": {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+            } if usage else None,
+        }
+        self.llamadas.append(llamada)
+        if self.grabar is not None:
+            self.grabar[clave_llamada(kwargs)] = {"clave": clave_llamada(kwargs), **llamada}
+        return response
+
+
+# ===== Métricas =====
+
+def adherencia_esquema(contenido: Optional[str]) -> float:
+    """
+    Fracción de las secciones esperadas (A–E) presentes y bien formadas
+    """
+    secciones = leer_secciones(contenido) if contenido else None
+    if not secciones:
+        return 0.0
+    validas = sum(1 for clave in SECCIONES_FALLBACK if seccion_valida(secciones.get(clave)))
+    return validas / len(SECCIONES_FALLBACK)
+
+
+def es_json(contenido: Optional[str]) -> bool:
+    try:
+        json.loads(contenido)
+        return True
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+
+async def evaluar_item(indice: int, diagnostic: DiagnosticRequest, interno, args, grabar) -> Dict[str, Any]:
+    medido = ClienteMedido(interno, args.overrides, args.prompt_sistema_texto, grabar)
+    error = None
+    try:
+        _, fuente = await generar_resultado_llm(diagnostic, medido)
+    except GrabacionFaltante:
+        # No es un fallo del modelo: no debe contar como error ni fallback
+        return {"indice": indice, "faltante": True}
+    except Exception as e:
+        # En producción este caso cae al motor de reglas
+        fuente, error = FUENTE_REGLAS, repr(e)
+
+    llamada = medido.llamadas[-1] if medido.llamadas else {}
+    contenido = llamada.get("contenido")
+    return {
+        "indice": indice,
+        "fuente": fuente,
+        "error": error,
+        "json_valido": es_json(contenido),
+        "adherencia_esquema": adherencia_esquema(contenido),
+        "latencia_s": llamada.get("latencia_s"),
+        "usage": llamada.get("usage"),
+    }
+
+
+def percentil(valores: List[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[min(int(len(valores) * p), len(valores) - 1)]
+
+
+def resumir(todos: List[Dict[str, Any]]) -> Dict[str, Any]:
+    items = [i for i in todos if not i.get("faltante")]
+    n = len(items) or 1
+    latencias = [i["latencia_s"] for i in items if i["latencia_s"] is not None]
+    prompt = [i["usage"]["prompt_tokens"] for i in items if i["usage"]]
+    completion = [i["usage"]["completion_tokens"] for i in items if i["usage"]]
+    return {
+        "casos": len(items),
+        "grabaciones_faltantes": len(todos) - len(items),
+        "tasa_json_valido": round(sum(i["json_valido"] for i in items) / n, 4),
+        "tasa_fallback": round(sum(i["fuente"] != FUENTE_LLM for i in items) / n, 4),
+        "tasa_error": round(sum(i["error"] is not None for i in items) / n, 4),
+        "adherencia_esquema_media": round(sum(i["adherencia_esquema"] for i in items) / n, 4),
+        "tasa_esquema_completo": round(sum(i["adherencia_esquema"] == 1.0 for i in items) / n, 4),
+        "tokens_prompt_medios": round(statistics.mean(prompt), 1) if prompt else None,
+        "tokens_completion_medios": round(statistics.mean(completion), 1) if completion else None,
+        "tokens_completion_p95": percentil(completion, 0.95) if completion else None,
+        "latencia_p50_s": round(percentil(latencias, 0.50), 3),
+        "latencia_p90_s": round(percentil(latencias, 0.90), 3),
+        "latencia_p95_s": round(percentil(latencias, 0.95), 3),
+        "latencia_max_s": round(max(latencias), 3) if latencias else 0.0,
+    }
+
+
+async def correr(args) -> Dict[str, Any]:
+    corpus = cargar_corpus(args.corpus)
+    grabaciones = cargar_grabaciones(args.grabaciones)
+    nuevas: Optional[Dict[str, Any]] = {} if args.modo == "grabar" else None
+    interno = cliente_openai() if args.modo == "grabar" else ClienteGrabado(grabaciones, args.simular_latencia)
+
+    semaforo = asyncio.Semaphore(args.concurrencia)
+
+    async def con_limite(i, d):
+        async with semaforo:
+            return await evaluar_item(i, d, interno, args, nuevas)
+
+    items = await asyncio.gather(*[con_limite(i, d) for i, d in enumerate(corpus)])
+
+    if nuevas:
+        grabaciones.update(nuevas)
+        os.makedirs(os.path.dirname(args.grabaciones) or ".", exist_ok=True)
+        with open(args.grabaciones, "w", encoding="utf-8") as f:
+            for g in grabaciones.values():
+                f.write(json.dumps(g, ensure_ascii=False) + "\n")
+
+    faltantes = [i["indice"] for i in items if i.get("faltante")]
+    if faltantes:
+        print(f"Sin grabación: {len(faltantes)} casos (excluidos de las métricas); grábalos con --modo grabar")
+
+    from app.diagnostic.prompts.diagnostic_prompt import RIZOTIPO_DIAGNOSTIC_PROMPT
+    prompt = args.prompt_sistema_texto if args.prompt_sistema_texto is not None else RIZOTIPO_DIAGNOSTIC_PROMPT
+    reporte = {
+        "fecha": datetime.utcnow().isoformat(),
+        "configuracion": {
+            "modo": args.modo,
+            "corpus": args.corpus,
+            "overrides": args.overrides,
+            "prompt_sha1": hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12],
+        },
+        "resumen": resumir(items),
+        "items": items,
+    }
+    if args.salida:
+        os.makedirs(os.path.dirname(args.salida) or ".", exist_ok=True)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+    return reporte
+
+
+def comparar(antes: Dict[str, Any], despues: Dict[str, Any]) -> str:
+    lineas = [
+        f"Antes:   {antes['configuracion']}",
+        f"Después: {despues['configuracion']}",
+        "",
+        f"{'métrica':<28}{'antes':>12}{'después':>12}{'delta':>12}",
+    ]
+    for metrica, valor_antes in antes["resumen"].items():
+        valor_despues = despues["resumen"].get(metrica)
+        delta = (
+            f"{valor_despues - valor_antes:+.3f}"
+            if isinstance(valor_antes, (int, float)) and isinstance(valor_despues, (int, float))
+            else "-"
+        )
+        lineas.append(f"{metrica:<28}{str(valor_antes):>12}{str(valor_despues):>12}{delta:>12}")
+    return "\n".join(lineas)
+
+
+def imprimir_resumen(resumen: Dict[str, Any]):
+    for metrica, valor in resumen.items():
+        print(f"{metrica:<28}{valor}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluación offline de la generación de diagnósticos")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_exportar = sub.add_parser("exportar", help="Exporta un corpus anonimizado desde MongoDB")
+    p_exportar.add_argument("--salida", default="eval/corpus.jsonl")
+    p_exportar.add_argument("--limite", type=int, default=200)
+
+    p_correr = sub.add_parser("correr", help="Reproduce el corpus y mide la generación")
+    p_correr.add_argument("--corpus", default="eval/corpus.jsonl")
+    p_correr.add_argument("--modo", choices=["grabar", "reproducir"], default="reproducir")
+    p_correr.add_argument("--grabaciones", default="eval/grabaciones.jsonl")
+    p_correr.add_argument("--salida", default=None)
+    p_correr.add_argument("--concurrencia", type=int, default=4)
+    p_correr.add_argument("--simular-latencia", action="store_true")
+    p_correr.add_argument("--model", default=None)
+    p_correr.add_argument("--max-tokens", type=int, default=None)
+    p_correr.add_argument("--temperature", type=float, default=None)
+    p_correr.add_argument("--prompt-sistema", default=None, help="Archivo con un prompt de sistema candidato")
+
+    p_comparar = sub.add_parser("comparar", help="Compara dos reportes (antes / después)")
+    p_comparar.add_argument("antes")
+    p_comparar.add_argument("despues")
+
+    args = parser.parse_args()
+
+    if args.comando == "exportar":
+        print(f"Casos exportados: {asyncio.run(exportar_corpus(args.salida, args.limite))}")
+    elif args.comando == "correr":
+        args.overrides = {
+            k: v for k, v in
+            {"model": args.model, "max_tokens": args.max_tokens, "temperature": args.temperature}.items()
+            if v is not None
+        }
+        args.prompt_sistema_texto = None
+        if args.prompt_sistema:
+            with open(args.prompt_sistema, encoding="utf-8") as f:
+                args.prompt_sistema_texto = f.read()
+        imprimir_resumen(asyncio.run(correr(args))["resumen"])
+    else:
+        with open(args.antes, encoding="utf-8") as f_antes, open(args.despues, encoding="utf-8") as f_despues:
+            print(comparar(json.load(f_antes), json.load(f_despues)))
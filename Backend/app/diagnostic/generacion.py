@@ -0,0 +1,240 @@
+"""
+Generación del resultado del diagnóstico: mensajes para el LLM, llamada a
+OpenAI y motor de reglas por sección. No depende de MongoDB, así lo pueden
+usar el banco de evaluación offline (app.diagnostic.eval) y los lotes.
+"""
+import json
+import os
+from typing import Optional, Dict, Any, List
+
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+from app.core.profiling import span
+from app.core.llm_routing import elegir, medir
+from app.diagnostic.models import DiagnosticRequest
+from app.diagnostic.prompts.diagnostic_prompt import RIZOTIPO_DIAGNOSTIC_PROMPT
+
+load_dotenv()
+
+# Origen del resultado_agente (se devuelve al frontend)
+FUENTE_LLM = "llm"
+FUENTE_REGLAS = "reglas"                    # el LLM falló o no devolvió JSON válido
+FUENTE_REGLAS_DEADLINE = "reglas_deadline"  # el LLM no respondió a tiempo
+FUENTE_LLM_LOTE = "llm_lote"                # generado en un lote diferido (Batch API)
+FUENTE_MIXTA = "mixta"                      # tras una edición: unas secciones del LLM y otras de reglas
+
+_cliente: Optional[AsyncOpenAI] = None
+
+
+def cliente_openai() -> AsyncOpenAI:
+    """
+    Cliente de OpenAI compartido; se crea al primer uso (la reproducción
+    offline no necesita OPENAI_API_KEY)
+    """
+    global _cliente
+    if _cliente is None:
+        _cliente = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _cliente
+
+
+async def generar_resultado_llm(diagnostic: DiagnosticRequest, openai_client=None) -> tuple[str, str]:
+    """
+    Genera el resultado completo con OpenAI. Si la respuesta no es JSON
+    válido se usa el motor de reglas. Devuelve (resultado, fuente).
+    `openai_client` permite inyectar otro cliente (ej. el stub de app.diagnostic.eval).
+    """
+    # Enviar a OpenAI
+    politica = elegir("diagnostics.create", notas=bool(diagnostic.notas))
+    with span("llm", "diagnostico"), medir(politica) as medicion:
+        response = await (openai_client or cliente_openai()).chat.completions.create(
+            **politica.parametros(),
+            messages=mensajes_diagnostico(diagnostic),
+            response_format={"type": "json_object"}  # Esto fuerza a OpenAI a devolver JSON
+        )
+        medicion.usage = response.usage
+
+    resultado_agente = response.choices[0].message.content
+
+    # Validar que sea JSON válido
+    try:
+        json.loads(resultado_agente)
+    except (json.JSONDecodeError, TypeError):
+        # Si no es JSON válido, crear uno manualmente con los datos
+        return generar_json_fallback(diagnostic), FUENTE_REGLAS
+
+    return resultado_agente, FUENTE_LLM
+
+
+def mensajes_diagnostico(diagnostic: DiagnosticRequest) -> List[Dict[str, str]]:
+    """
+    Mensajes para generar el resultado completo (en línea o por lote)
+    """
+    user_message = construir_mensaje_diagnostico(diagnostic) + """
+    **IMPORTANTE:** Genera SOLO un objeto JSON válido con la estructura del ejemplo, sin texto adicional.
+    """
+    return [
+        {"role": "system", "content": RIZOTIPO_DIAGNOSTIC_PROMPT},
+        {"role": "user", "content": user_message}
+    ]
+
+
+def construir_mensaje_diagnostico(diagnostic: DiagnosticRequest) -> str:
+    return f"""
+    Cliente: {diagnostic.nombre}
+    WhatsApp: {diagnostic.whatsapp}
+    Correo: {diagnostic.correo}
+
+    Respuestas del diagnóstico:
+    - Plasticidad: {diagnostic.plasticidad}
+    - Permeabilidad: {diagnostic.permeabilidad}
+    - Densidad: {diagnostic.densidad}
+    - Porosidad: {diagnostic.porosidad}
+    - Oleosidad: {diagnostic.oleosidad}
+    - Grosor: {diagnostic.grosor}
+    - Textura: {diagnostic.textura}
+
+    Notas adicionales: {diagnostic.notas or "N/A"}
+    """
+
+
+def leer_secciones(resultado_agente: Optional[str]) -> Optional[Dict[str, Any]]:
+    try:
+        secciones = json.loads(resultado_agente or "")["secciones"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    return secciones if isinstance(secciones, dict) else None
+
+
+def seccion_valida(seccion: Any) -> bool:
+    return (
+        isinstance(seccion, dict)
+        and isinstance(seccion.get("titulo"), str)
+        and isinstance(seccion.get("contenido"), list)
+    )
+
+
+def seccion_resultados(diagnostic: DiagnosticRequest) -> Dict[str, Any]:
+    return {
+        "titulo": "Resultados del Diagnostico",
+        "contenido": [
+            f"Plasticidad: {diagnostic.plasticidad}",
+            f"Permeabilidad: {diagnostic.permeabilidad}",
+            f"Densidad: {diagnostic.densidad}",
+            f"Porosidad: {diagnostic.porosidad}",
+            f"Oleosidad: {diagnostic.oleosidad}",
+            f"Grosor: {diagnostic.grosor}",
+            f"Textura: {diagnostic.textura}"
+        ]
+    }
+
+
+def seccion_lavado(diagnostic: DiagnosticRequest) -> Dict[str, Any]:
+    # Determinar técnica de lavado basada en oleosidad
+    oleosidad_lower = diagnostic.oleosidad.lower()
+    if "alta" in oleosidad_lower or "rapido" in oleosidad_lower or "diario" in oleosidad_lower:
+        tecnica_lavado = "Tecnica CO-POO"
+        instrucciones_lavado = [
+            "Acondicionador en medios y puntas",
+            "Shampoo en raiz",
+            "Enjuagar sin repetir acondicionador",
+            "Frecuencia: diario o dia de por medio"
+        ]
+    else:
+        tecnica_lavado = "Tecnica ASA"
+        instrucciones_lavado = [
+            "Aplicar acondicionante",
+            "Shampoo en raiz dos veces", 
+            "Acondicionador en medios y puntas",
+            "Frecuencia: cada 3-4 dias"
+        ]
+
+    return {
+        "titulo": "Recomendaciones de Lavado",
+        "contenido": [
+            tecnica_lavado,
+            *instrucciones_lavado,
+            "Detox capilar mensual con shampoo Rizos Felices aplicado en cabello seco"
+        ]
+    }
+
+
+def seccion_tratamientos(diagnostic: DiagnosticRequest) -> Dict[str, Any]:
+    # Determinar tratamientos basados en plasticidad
+    plasticidad_lower = diagnostic.plasticidad.lower()
+    if "baja" in plasticidad_lower or "no" in plasticidad_lower:
+        tratamientos_plasticidad = "Pre-lavado obligatorio: mascarilla + crema 3 en 1 + aceite + Leavein 15 min antes de lavar"
+    else:
+        tratamientos_plasticidad = "Mascarillas despues del shampoo, peinar 5-10 veces"
+
+    return {
+        "titulo": "Tratamientos",
+        "contenido": [
+            tratamientos_plasticidad,
+            "Lavado normal",
+            "Tratamientos nutritivos y fortalecedores"
+        ]
+    }
+
+
+def seccion_definicion(diagnostic: DiagnosticRequest) -> Dict[str, Any]:
+    # Determinar técnicas de definición basadas en textura
+    textura_lower = diagnostic.textura.lower()
+    if "ondulado" in textura_lower:
+        definicion = "Praying hands + scrunch intensivo, Gel en dos momentos"
+    elif "afro" in textura_lower:
+        definicion = "Pre-lavado obligatorio, Definicion rizo a rizo con Leavein + gel, Mantener cabello muy mojado"
+    else:
+        definicion = "Definicion con cepillo por lineas, Rizo a rizo en coronilla y contornos"
+
+    return {
+        "titulo": "Definicion y Styling",
+        "contenido": [
+            definicion,
+            f"Usar productos adecuados para grosor {diagnostic.grosor}"
+        ]
+    }
+
+
+def seccion_cuidados(diagnostic: DiagnosticRequest) -> Dict[str, Any]:
+    return {
+        "titulo": "Cuidados Extra",
+        "contenido": [
+            "Dormir con gorro de satin",
+            "Hacer pina o usar rizo protector durante la noche"
+        ]
+    }
+
+
+# Motor de reglas por sección (se usa como fallback del LLM)
+SECCIONES_FALLBACK = {
+    "A": seccion_resultados,
+    "B": seccion_lavado,
+    "C": seccion_tratamientos,
+    "D": seccion_definicion,
+    "E": seccion_cuidados,
+}
+
+
+# Campos del diagnóstico de los que depende cada sección del resultado
+DEPENDENCIAS_SECCIONES = {
+    "A": ["plasticidad", "permeabilidad", "densidad", "porosidad", "oleosidad", "grosor", "textura"],
+    "B": ["oleosidad"],
+    "C": ["plasticidad", "permeabilidad", "porosidad"],
+    "D": ["textura", "grosor", "densidad"],
+    "E": ["notas"],
+}
+
+
+def generar_json_fallback(diagnostic: DiagnosticRequest) -> str:
+    """
+    Genera un JSON de fallback si OpenAI no devuelve un JSON válido
+    """
+    json_resultado = {
+        "secciones": {
+            clave: construir(diagnostic)
+            for clave, construir in SECCIONES_FALLBACK.items()
+        }
+    }
+    
+    return json.dumps(json_resultado, ensure_ascii=False)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
+from typing import Optional, List, Dict
 from datetime import datetime
 
 
@@ -20,5 +20,29 @@ class DiagnosticRequest(BaseModel):
 class DiagnosticResponse(DiagnosticRequest):
     id: str
     professional_id: str
+    client_id: Optional[str] = None
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    version: int = 1
+    estado: str = "completado"  # "pendiente", "diferido" o "completado"
+    fuente: Optional[str] = None  # "llm", "llm_lote", "reglas", "reglas_deadline" o "mixta"
+    # Origen de cada sección cuando una edición las regeneró por separado
+    fuentes_secciones: Optional[Dict[str, str]] = None
     resultado_agente: Optional[str] = None
+
+
+class DiagnosticUpdate(BaseModel):
+    plasticidad: Optional[str] = None
+    permeabilidad: Optional[str] = None
+    densidad: Optional[str] = None
+    porosidad: Optional[str] = None
+    oleosidad: Optional[str] = None
+    grosor: Optional[str] = None
+    textura: Optional[str] = None
+    notas: Optional[str] = None
+
+
+class DiagnosticUpdateResponse(DiagnosticResponse):
+    componentes_modificados: List[str]
+    secciones_regeneradas: List[str]
+    secciones_reglas: List[str] = []  # regeneradas con el motor de reglas (el LLM falló)
@@ -1,83 +1,88 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Query
 from bson import ObjectId
 
-from app.diagnostic.models import DiagnosticRequest, DiagnosticResponse
-from app.diagnostic.controllers import create_diagnostic_controller
+from app.diagnostic.models import DiagnosticRequest, DiagnosticResponse, DiagnosticUpdate, DiagnosticUpdateResponse
+from app.diagnostic.controllers import (
+    create_diagnostic_controller,
+    update_diagnostic_controller,
+    documento_a_respuesta,
+)
 from app.core.database import collection_diagnostics
+from app.core.read_routing import coleccion_para, sesion_lectura
+from app.core.http_cache import etag_para, coincide_etag, no_modificado, aplicar_etag
+from app.core.profiling import span
 from app.auth.routes import get_current_user
 
 router = APIRouter()
 
 
+def etag_diagnostico(d) -> str:
+    return etag_para(d["_id"], d.get("version", 1))
+
+
 # ===== Crear diagnóstico =====
 @router.post("/", response_model=DiagnosticResponse)
-async def create_diagnostic(diagnostic: DiagnosticRequest, user=Depends(get_current_user)):
+async def create_diagnostic(
+    diagnostic: DiagnosticRequest,
+    diferido: bool = Query(False, description="Generar con el LLM más tarde, en un lote"),
+    user=Depends(get_current_user),
+):
     print("Received diagnostic request:", diagnostic)
     print("Authenticated user:", user)
-    result = await create_diagnostic_controller(diagnostic, str(user["_id"]))
+    result = await create_diagnostic_controller(diagnostic, str(user["_id"]), diferido)
     print("Created diagnostic result:", result)
     return result
 
 
+# ===== Corregir componentes de un diagnóstico =====
+@router.patch("/{diagnostic_id}", response_model=DiagnosticUpdateResponse)
+async def update_diagnostic(diagnostic_id: str, cambios: DiagnosticUpdate, user=Depends(get_current_user)):
+    if not ObjectId.is_valid(diagnostic_id):
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+
+    return await update_diagnostic_controller(diagnostic_id, cambios, str(user["_id"]))
+
+
 # ===== Obtener diagnóstico por ID =====
 @router.get("/{diagnostic_id}", response_model=DiagnosticResponse)
-async def get_diagnostic(diagnostic_id: str, user=Depends(get_current_user)):
-    diagnostic = await collection_diagnostics.find_one({
+async def get_diagnostic(diagnostic_id: str, request: Request, response: Response, user=Depends(get_current_user)):
+    filtro = {
         "_id": ObjectId(diagnostic_id),
         "professional_id": ObjectId(user["_id"])
-    })
+    }
+    coleccion = coleccion_para(collection_diagnostics, "diagnostics.get")
+
+    async with sesion_lectura(str(user["_id"])) as session:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            # Consulta cubierta por el índice (_id, professional_id, version)
+            meta = await coleccion.find_one(filtro, {"_id": 1, "version": 1}, session=session)
+            if not meta:
+                raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+            etag = etag_diagnostico(meta)
+            if coincide_etag(if_none_match, etag):
+                return no_modificado(etag)
+
+        diagnostic = await coleccion.find_one(filtro, session=session)
 
     if not diagnostic:
         raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
 
-    return DiagnosticResponse(
-        id=str(diagnostic["_id"]),
-        professional_id=str(diagnostic["professional_id"]),
-        nombre=diagnostic["nombre"],
-        whatsapp=diagnostic["whatsapp"],
-        correo=diagnostic["correo"],
-        plasticidad=diagnostic["plasticidad"],
-        permeabilidad=diagnostic["permeabilidad"],
-        densidad=diagnostic["densidad"],
-        porosidad=diagnostic["porosidad"],
-        oleosidad=diagnostic["oleosidad"],
-        grosor=diagnostic["grosor"],
-        textura=diagnostic["textura"],
-        notas=diagnostic.get("notas"),
-        created_at=diagnostic["created_at"],
-        resultado_agente=diagnostic.get("resultado_agente")
-    )
+    aplicar_etag(response, etag_diagnostico(diagnostic))
+    return documento_a_respuesta(diagnostic)
 
 # ===== Get all diagnostics for the authenticated professional =====
 @router.get("/", response_model=list[DiagnosticResponse])
 async def get_all_diagnostics(user=Depends(get_current_user)):
-    diagnostics_cursor = collection_diagnostics.find({
-        "professional_id": ObjectId(user["_id"])
-    })
+    async with sesion_lectura(str(user["_id"])) as session:
+        diagnostics_cursor = coleccion_para(collection_diagnostics, "diagnostics.list").find({
+            "professional_id": ObjectId(user["_id"])
+        }, session=session)
 
-    diagnostics = await diagnostics_cursor.to_list(length=None)
+        diagnostics = await diagnostics_cursor.to_list(length=None)
 
     if not diagnostics:
         raise HTTPException(status_code=404, detail="No se encontraron diagnósticos para este profesional")
 
-    return [
-        DiagnosticResponse(
-            id=str(d["_id"]),
-            professional_id=str(d["professional_id"]),
-            nombre=d["nombre"],
-            whatsapp=d["whatsapp"],
-            correo=d["correo"],
-            plasticidad=d["plasticidad"],
-            permeabilidad=d["permeabilidad"],
-            densidad=d["densidad"],
-            porosidad=d["porosidad"],
-            oleosidad=d["oleosidad"],
-            grosor=d["grosor"],
-            textura=d["textura"],
-            notas=d.get("notas"),
-            created_at=d["created_at"],
-            resultado_agente=d.get("resultado_agente")
-        )
-        for d in diagnostics
-    ]
-
+    with span("cpu", "pydantic"):
+        return [documento_a_respuesta(d) for d in diagnostics]
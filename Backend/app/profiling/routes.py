@@ -0,0 +1,47 @@
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.core.profiling import (
+    PROFILER_ADMIN_TOKEN,
+    perfiles_recientes,
+    buscar_perfil,
+)
+
+router = APIRouter()
+
+
+async def verificar_admin(x_admin_token: str = Header("")):
+    """
+    Solo con PROFILER_ADMIN_TOKEN configurado y enviado en X-Admin-Token
+    """
+    if not PROFILER_ADMIN_TOKEN or not hmac.compare_digest(x_admin_token, PROFILER_ADMIN_TOKEN):
+        raise HTTPException(status_code=404, detail="No encontrado")
+
+
+# ===== Últimos perfiles registrados en este worker =====
+@router.get("/", dependencies=[Depends(verificar_admin)])
+async def list_profiles():
+    return [p.resumen() for p in reversed(perfiles_recientes)]
+
+
+# ===== Perfil completo: spans y pilas más frecuentes =====
+@router.get("/{perfil_id}", dependencies=[Depends(verificar_admin)])
+async def get_profile(perfil_id: str):
+    perfil = buscar_perfil(perfil_id)
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return perfil.detalle()
+
+
+# ===== Descarga en formato collapsed stacks (flamegraph / speedscope) =====
+@router.get("/{perfil_id}/collapsed", dependencies=[Depends(verificar_admin)], response_class=PlainTextResponse)
+async def download_profile(perfil_id: str):
+    perfil = buscar_perfil(perfil_id)
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return PlainTextResponse(
+        perfil.colapsado(),
+        headers={"Content-Disposition": f'attachment; filename="perfil-{perfil.id}.txt"'},
+    )
@@ -0,0 +1,257 @@
+"""
+Reportes del diagnóstico pre-renderizados (HTML autónomo y texto para
+WhatsApp).
+
+Cada render se guarda una sola vez en diagnostic_reports con el sha256 de su
+contenido como _id; el diagnóstico solo guarda, por formato, qué hash
+corresponde a su versión actual. Una vista repetida lee ese puntero y el
+blob (o lo sirve de la caché en memoria) sin volver a renderizar ni traer el
+documento completo. Al editar el diagnóstico sube su versión y el puntero
+queda obsoleto. Si cambian las plantillas se sube RENDER_VERSION.
+"""
+import hashlib
+import html
+import json
+import os
+import secrets
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.core.database import collection_diagnostics, collection_reports
+from app.core.read_routing import coleccion_para
+
+RENDER_VERSION = "1"
+REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "256"))
+
+ETIQUETAS_COMPONENTES = [
+    ("plasticidad", "Plasticidad"),
+    ("permeabilidad", "Permeabilidad"),
+    ("densidad", "Densidad"),
+    ("porosidad", "Porosidad"),
+    ("oleosidad", "Oleosidad"),
+    ("grosor", "Grosor"),
+    ("textura", "Textura"),
+]
+
+ESTILOS = """
+body{font-family:-apple-system,Segoe UI,Roboto,sans-serif;max-width:640px;margin:0 auto;padding:24px;color:#2d2d2d;line-height:1.5}
+h1{color:#7a3e9d;font-size:1.5em;margin-bottom:4px}
+h2{color:#7a3e9d;font-size:1.15em;border-bottom:1px solid #eee;padding-bottom:4px;margin-top:28px}
+.fecha{color:#888;font-size:.9em}
+table{border-collapse:collapse;width:100%}
+td{padding:4px 8px;border-bottom:1px solid #f2f2f2}
+td:first-child{font-weight:600;width:40%}
+footer{margin-top:32px;color:#aaa;font-size:.8em;text-align:center}
+"""
+
+
+def leer_resultado(resultado_agente: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Secciones del resultado del agente en orden (A, B, C...); tolera
+    secciones sin la estructura esperada
+    """
+    try:
+        datos = json.loads(resultado_agente or "")
+    except (json.JSONDecodeError, TypeError):
+        return []
+    secciones = datos.get("secciones") if isinstance(datos, dict) else None
+    if not isinstance(secciones, dict):
+        return []
+
+    resultado = []
+    for clave in sorted(secciones):
+        seccion = secciones[clave]
+        if not isinstance(seccion, dict):
+            continue
+        contenido = seccion.get("contenido", [])
+        if isinstance(contenido, str):
+            contenido = [contenido]
+        resultado.append({
+            "titulo": str(seccion.get("titulo", clave)),
+            "contenido": [str(c) for c in contenido if c],
+        })
+    return resultado
+
+
+def render_html(d: Dict[str, Any]) -> str:
+    e = html.escape
+    filas = "".join(
+        f"<tr><td>{etiqueta}</td><td>{e(str(d.get(campo, '')))}</td></tr>"
+        for campo, etiqueta in ETIQUETAS_COMPONENTES
+    )
+    secciones = "".join(
+        f"<h2>{e(s['titulo'])}</h2><ul>" + "".join(f"<li>{e(c)}</li>" for c in s["contenido"]) + "</ul>"
+        for s in leer_resultado(d.get("resultado_agente"))
+    )
+    notas = f"<h2>Notas</h2><p>{e(d['notas'])}</p>" if d.get("notas") else ""
+    return (
+        "<!DOCTYPE html><html lang=\"es\"><head><meta charset=\"utf-8\">"
+        "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">"
+        f"<title>RizoTipo de {e(d['nombre'])}</title><style>{ESTILOS}</style></head><body>"
+        f"<h1>Tu RizoTipo, {e(d['nombre'])}</h1>"
+        f"<div class=\"fecha\">{d['created_at']:%d/%m/%Y}</div>"
+        f"<h2>Tu cabello</h2><table>{filas}</table>{secciones}{notas}"
+        "<footer>Diagnóstico RizoTipo · Rizos Felices</footer></body></html>"
+    )
+
+
+def render_texto(d: Dict[str, Any]) -> str:
+    # Formato de WhatsApp: *negrita* y viñetas simples
+    lineas = [f"*Tu RizoTipo, {d['nombre']}* ({d['created_at']:%d/%m/%Y})", ""]
+    lineas += [f"• {etiqueta}: {d.get(campo, '')}" for campo, etiqueta in ETIQUETAS_COMPONENTES]
+    for s in leer_resultado(d.get("resultado_agente")):
+        if s["titulo"] == "Resultados del Diagnostico":
+            continue  # ya están arriba
+        lineas += ["", f"*{s['titulo']}*"] + [f"• {c}" for c in s["contenido"]]
+    if d.get("notas"):
+        lineas += ["", "*Notas*", d["notas"]]
+    return "\n".join(lineas)
+
+
+FORMATOS = {
+    "html": ("text/html; charset=utf-8", render_html),
+    "texto": ("text/plain; charset=utf-8", render_texto),
+}
+
+CAMPOS_META = {"_id": 1, "version": 1, "estado": 1, "reportes": 1}
+
+
+class CacheBlobs:
+    """
+    LRU en memoria de los reportes por hash; el contenido de un hash no
+    cambia nunca, así que no hay que invalidar
+    """
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self.entradas: "OrderedDict[str, str]" = OrderedDict()
+
+    def obtener(self, hash_: str) -> Optional[str]:
+        contenido = self.entradas.get(hash_)
+        if contenido is not None:
+            self.entradas.move_to_end(hash_)
+        return contenido
+
+    def guardar(self, hash_: str, contenido: str):
+        self.entradas[hash_] = contenido
+        self.entradas.move_to_end(hash_)
+        while len(self.entradas) > self.max_entradas:
+            self.entradas.popitem(last=False)
+
+
+cache_blobs = CacheBlobs(REPORT_CACHE_MAX_ENTRIES)
+
+
+def etag_reporte(hash_: str) -> str:
+    # El hash del contenido ya identifica la representación
+    return f'"{hash_[:32]}"'
+
+
+def puntero_vigente(meta: Dict[str, Any], formato: str) -> Optional[str]:
+    """
+    Hash del reporte ya renderizado para la versión actual, si existe
+    """
+    puntero = (meta.get("reportes") or {}).get(formato)
+    if (
+        puntero
+        and puntero.get("version") == meta.get("version", 1)
+        and puntero.get("render") == RENDER_VERSION
+    ):
+        return puntero["hash"]
+    return None
+
+
+async def leer_blob(hash_: str) -> Optional[str]:
+    contenido = cache_blobs.obtener(hash_)
+    if contenido is None:
+        blob = await collection_reports.find_one({"_id": hash_}, {"contenido": 1})
+        if blob:
+            contenido = blob["contenido"]
+            cache_blobs.guardar(hash_, contenido)
+    return contenido
+
+
+async def renderizar_y_guardar(filtro: Dict[str, Any], formato: str, db_session=None) -> Tuple[str, str]:
+    """
+    Renderiza el reporte desde el documento completo, lo guarda por
+    contenido y apunta la versión actual del diagnóstico a ese hash
+    """
+    d = await collection_diagnostics.find_one(filtro, session=db_session)
+    if not d:
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+
+    content_type, render = FORMATOS[formato]
+    contenido = render(d)
+    hash_ = hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    await collection_reports.update_one(
+        {"_id": hash_},
+        {"$setOnInsert": {
+            "formato": formato,
+            "content_type": content_type,
+            "contenido": contenido,
+            "bytes": len(contenido.encode("utf-8")),
+            "created_at": datetime.utcnow(),
+        }},
+        upsert=True,
+    )
+    # Solo si nadie editó el diagnóstico mientras tanto
+    await collection_diagnostics.update_one(
+        {"_id": d["_id"], "version": d.get("version")},
+        {"$set": {f"reportes.{formato}": {
+            "version": d.get("version", 1),
+            "render": RENDER_VERSION,
+            "hash": hash_,
+        }}},
+        session=db_session,
+    )
+    cache_blobs.guardar(hash_, contenido)
+    return hash_, contenido
+
+
+async def obtener_meta(filtro: Dict[str, Any], db_session=None) -> Dict[str, Any]:
+    meta = await coleccion_para(collection_diagnostics, "reports.get").find_one(
+        filtro, CAMPOS_META, session=db_session
+    )
+    if not meta:
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+    if meta.get("estado") == "pendiente":
+        raise HTTPException(status_code=409, detail="El diagnóstico todavía se está generando")
+    return meta
+
+
+async def obtener_reporte(meta: Dict[str, Any], formato: str, db_session=None) -> Tuple[str, str]:
+    """
+    Devuelve (hash, contenido) del reporte de la versión actual,
+    renderizándolo solo si no existe todavía
+    """
+    hash_ = puntero_vigente(meta, formato)
+    if hash_:
+        contenido = await leer_blob(hash_)
+        if contenido is not None:
+            return hash_, contenido
+    return await renderizar_y_guardar({"_id": meta["_id"]}, formato, db_session)
+
+
+async def crear_enlace(diagnostic_id: str, professional_id: str) -> str:
+    """
+    Token público del enlace para compartir (se reutiliza si ya existe)
+    """
+    filtro = {"_id": ObjectId(diagnostic_id), "professional_id": ObjectId(professional_id)}
+    d = await collection_diagnostics.find_one(filtro, {"share_token": 1})
+    if not d:
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+    if d.get("share_token"):
+        return d["share_token"]
+
+    token = secrets.token_urlsafe(16)
+    await collection_diagnostics.update_one(
+        {**filtro, "share_token": {"$exists": False}}, {"$set": {"share_token": token}}
+    )
+    # Si otra petición lo creó en paralelo, gana el que quedó guardado
+    d = await collection_diagnostics.find_one(filtro, {"share_token": 1})
+    return d["share_token"]
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from bson import ObjectId
+
+from app.reports.controllers import (
+    FORMATOS,
+    obtener_meta,
+    obtener_reporte,
+    puntero_vigente,
+    etag_reporte,
+    crear_enlace,
+)
+from app.core.read_routing import sesion_lectura
+from app.core.http_cache import coincide_etag
+from app.auth.routes import get_current_user
+
+router = APIRouter()
+
+FORMATO_REGEX = r"^(html|texto)$"
+
+
+async def responder_reporte(request: Request, filtro: dict, formato: str, cache_control: str, db_session=None) -> Response:
+    """
+    Sirve el reporte con su ETag; si el cliente ya tiene la versión
+    actual responde 304 sin leer el contenido
+    """
+    meta = await obtener_meta(filtro, db_session)
+    if_none_match = request.headers.get("if-none-match")
+
+    hash_ = puntero_vigente(meta, formato)
+    if hash_ and coincide_etag(if_none_match, etag_reporte(hash_)):
+        return Response(status_code=304, headers={"ETag": etag_reporte(hash_), "Cache-Control": cache_control})
+
+    hash_, contenido = await obtener_reporte(meta, formato, db_session)
+    # Una edición que no cambia el reporte produce el mismo hash
+    if coincide_etag(if_none_match, etag_reporte(hash_)):
+        return Response(status_code=304, headers={"ETag": etag_reporte(hash_), "Cache-Control": cache_control})
+
+    return Response(
+        contenido,
+        media_type=FORMATOS[formato][0],
+        headers={"ETag": etag_reporte(hash_), "Cache-Control": cache_control},
+    )
+
+
+# ===== Enlace público para compartir (WhatsApp) =====
+@router.get("/compartido/{token}")
+async def get_shared_report(token: str, request: Request, formato: str = Query("html", pattern=FORMATO_REGEX)):
+    # Público pero revalidable: si el diagnóstico se corrige, el ETag cambia
+    return await responder_reporte(request, {"share_token": token}, formato, "public, no-cache")
+
+
+# ===== Reporte del diagnóstico (HTML o texto) =====
+@router.get("/{diagnostic_id}")
+async def get_report(
+    diagnostic_id: str,
+    request: Request,
+    formato: str = Query("html", pattern=FORMATO_REGEX),
+    user=Depends(get_current_user),
+):
+    if not ObjectId.is_valid(diagnostic_id):
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+
+    professional_id = str(user["_id"])
+    filtro = {"_id": ObjectId(diagnostic_id), "professional_id": ObjectId(professional_id)}
+    async with sesion_lectura(professional_id) as db_session:
+        return await responder_reporte(request, filtro, formato, "private, no-cache", db_session)
+
+
+# ===== Crear (o recuperar) el enlace para compartir =====
+@router.post("/{diagnostic_id}/share")
+async def share_report(diagnostic_id: str, user=Depends(get_current_user)):
+    if not ObjectId.is_valid(diagnostic_id):
+        raise HTTPException(status_code=404, detail="Diagnóstico no encontrado")
+
+    token = await crear_enlace(diagnostic_id, str(user["_id"]))
+    return {
+        "token": token,
+        "url_html": f"/reports/compartido/{token}",
+        "url_texto": f"/reports/compartido/{token}?formato=texto",
+    }